@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""Pre-render Mapbox Vector Tiles of streets and their snow removal status into a static z/x/y.pbf pyramid"""
+from typing import Optional, Dict, Any, List, Tuple, Iterator
+import os
+import sys
+import json
+import math
+import time
+import queue
+import threading
+import argparse
+from datetime import datetime
+import psycopg2
+from dotenv import load_dotenv
+
+load_dotenv()
+
+TILES_DIR = os.environ.get("TILES_DIR", "tiles")
+# The map (client/components/map.tsx) is used up to zoom 16
+TILE_MIN_ZOOM = int(os.environ.get("TILE_MIN_ZOOM", "12"))
+TILE_MAX_ZOOM = int(os.environ.get("TILE_MAX_ZOOM", "16"))
+
+# Id of the last tile_invalidations row applied to the pyramid, kept next to the tiles
+FEED_POSITION_FILENAME = ".feed_position"
+# ingest_state key of the highest tile_invalidations id deleted by the feed retention (see dirty_tiles.publish);
+# a saved position below it has missed rows
+FEED_PRUNED_KEY = "tile_invalidations_pruned_id"
+
+LAYER_NAME = "streets"
+TILE_EXTENT = 4096
+TILE_BUFFER = 64
+
+# Attributes of each feature in the streets layer (dates as ISO text, MVT has no date type)
+LAYER_FIELDS = {
+    "cote_rue_id": "Number",
+    "nom_voie": "String",
+    "nom_ville": "String",
+    "debut_adresse": "Number",
+    "fin_adresse": "Number",
+    "cote": "String",
+    "sens_cir": "Number",
+    "etat_deneig": "Number",
+    "status": "String",
+    "date_debut_planif": "String",
+    "date_fin_planif": "String",
+    "date_debut_replanif": "String",
+    "date_fin_replanif": "String",
+    "date_maj": "String",
+}
+
+# Streets are filtered with the geography GIST index, then clipped to the tile in Web Mercator
+TILE_SQL = """
+    WITH bounds AS (
+        SELECT ST_TileEnvelope(%(z)s, %(x)s, %(y)s) AS geom,
+               ST_Transform(ST_TileEnvelope(%(z)s, %(x)s, %(y)s, margin => %(margin)s), 4326)::geography AS area
+    ),
+    features AS (
+        SELECT
+            ST_AsMVTGeom(ST_Transform(s.geometry::geometry, 3857), bounds.geom, %(extent)s, %(buffer)s, true) AS geom,
+            s.cote_rue_id, s.nom_voie, s.nom_ville, s.debut_adresse, s.fin_adresse, s.cote, s.sens_cir,
+            dc.etat_deneig, dc.status,
+            to_char(dc.date_debut_planif AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS"Z"') AS date_debut_planif,
+            to_char(dc.date_fin_planif AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS"Z"') AS date_fin_planif,
+            to_char(dc.date_debut_replanif AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS"Z"') AS date_debut_replanif,
+            to_char(dc.date_fin_replanif AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS"Z"') AS date_fin_replanif,
+            to_char(dc.date_maj AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS"Z"') AS date_maj
+        FROM streets s
+        CROSS JOIN bounds
+        LEFT JOIN deneigement_current dc ON dc.cote_rue_id = s.cote_rue_id
+        WHERE s.geometry && bounds.area
+    )
+    SELECT ST_AsMVT(features.*, %(layer)s, %(extent)s, 'geom')
+    FROM features
+    WHERE geom IS NOT NULL
+"""
+
+
+def tile_coords(lon: float, lat: float, z: int) -> Tuple[float, float]:
+    """Fractional XYZ tile coordinates of a WGS84 point at zoom z"""
+    n = 2 ** z
+    lat = max(min(lat, 85.0511), -85.0511)
+    x = (lon + 180.0) / 360.0 * n
+    y = (1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n
+    return x, y
+
+
+def lonlat_to_tile(lon: float, lat: float, z: int) -> Tuple[int, int]:
+    """XYZ tile containing a WGS84 point at zoom z"""
+    n = 2 ** z
+    x, y = tile_coords(lon, lat, z)
+    return min(max(int(x), 0), n - 1), min(max(int(y), 0), n - 1)
+
+
+def tile_to_lonlat(x: int, y: int, z: int) -> Tuple[float, float]:
+    """WGS84 coordinates of the north-west corner of a tile"""
+    n = 2 ** z
+    lon = x / n * 360.0 - 180.0
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    return lon, lat
+
+
+def tiles_in_bounds(bounds: Tuple[float, float, float, float], z: int, margin: float = 0.0) -> Iterator[Tuple[int, int, int]]:
+    """
+    Yield every (z, x, y) tile intersecting bounds (min_lng, min_lat, max_lng, max_lat).
+    With a margin (in tile units), tiles whose buffer reaches the bounds are included too.
+    """
+    n = 2 ** z
+    left, bottom = tile_coords(bounds[0], bounds[1], z)
+    right, top = tile_coords(bounds[2], bounds[3], z)
+    min_x, max_x = max(math.floor(left - margin), 0), min(math.floor(right + margin), n - 1)
+    min_y, max_y = max(math.floor(top - margin), 0), min(math.floor(bottom + margin), n - 1)
+    for x in range(min_x, max_x + 1):
+        for y in range(min_y, max_y + 1):
+            yield z, x, y
+
+
+def get_streets_bounds(db_conn) -> Optional[Tuple[float, float, float, float]]:
+    """Bounding box (min_lng, min_lat, max_lng, max_lat) of the streets table, or None if it is empty"""
+    with db_conn.cursor() as cur:
+        cur.execute("""
+            SELECT ST_XMin(e), ST_YMin(e), ST_XMax(e), ST_YMax(e)
+            FROM (SELECT ST_Extent(geometry::geometry) AS e FROM streets) extent
+        """)
+        row = cur.fetchone()
+    return tuple(row) if row and row[0] is not None else None
+
+
+def render_tile(cur, z: int, x: int, y: int) -> bytes:
+    """Render one tile; an empty bytes object means the tile has no street"""
+    cur.execute(TILE_SQL, {
+        "z": z, "x": x, "y": y,
+        "margin": TILE_BUFFER / TILE_EXTENT,
+        "extent": TILE_EXTENT,
+        "buffer": TILE_BUFFER,
+        "layer": LAYER_NAME,
+    })
+    row = cur.fetchone()
+    return bytes(row[0]) if row and row[0] is not None else b""
+
+
+def tile_path(tiles_dir: str, z: int, x: int, y: int) -> str:
+    return os.path.join(tiles_dir, str(z), str(x), f"{y}.pbf")
+
+
+def write_tile(tiles_dir: str, z: int, x: int, y: int, data: bytes) -> None:
+    """Write a tile atomically, or remove it if it became empty"""
+    path = tile_path(tiles_dir, z, x, y)
+    if not data:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".part"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def write_metadata(tiles_dir: str, min_zoom: int, max_zoom: int, bounds: Tuple[float, float, float, float]) -> None:
+    """Write a TileJSON document describing the pyramid next to it"""
+    metadata = {
+        "tilejson": "3.0.0",
+        "name": "planif-neige-streets",
+        "tiles": ["{z}/{x}/{y}.pbf"],
+        "minzoom": min_zoom,
+        "maxzoom": max_zoom,
+        "bounds": list(bounds),
+        "vector_layers": [{"id": LAYER_NAME, "fields": LAYER_FIELDS, "minzoom": min_zoom, "maxzoom": max_zoom}],
+        "generated_at": datetime.now().isoformat(),
+    }
+    os.makedirs(tiles_dir, exist_ok=True)
+    tmp_path = os.path.join(tiles_dir, "metadata.json.part")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(metadata, f, indent=2)
+    os.replace(tmp_path, os.path.join(tiles_dir, "metadata.json"))
+
+
+def build_tiles(tiles: List[Tuple[int, int, int]], database_url: str, tiles_dir: str, workers: int) -> Dict[int, Dict[str, Any]]:
+    """
+    Render and write tiles with several connections in parallel.
+
+    Args:
+        tiles: (z, x, y) tiles to render
+        database_url: PostgreSQL connection string
+        tiles_dir: Root of the z/x/y.pbf pyramid
+        workers: Number of rendering threads (one connection each)
+
+    Returns:
+        Per-zoom statistics {z: {"tiles", "written", "empty", "failed", "bytes"}}
+    """
+    stats = {}
+    for z, _, _ in tiles:
+        stats.setdefault(z, {"tiles": 0, "written": 0, "empty": 0, "failed": 0, "bytes": 0})
+    lock = threading.Lock()
+    work = queue.Queue()
+    for tile in tiles:
+        work.put(tile)
+
+    def worker():
+        db_conn = psycopg2.connect(database_url)
+        db_conn.autocommit = True
+        try:
+            with db_conn.cursor() as cur:
+                while True:
+                    try:
+                        z, x, y = work.get_nowait()
+                    except queue.Empty:
+                        return
+                    try:
+                        data = render_tile(cur, z, x, y)
+                        write_tile(tiles_dir, z, x, y, data)
+                    except Exception as e:
+                        print(f"✗ Failed to render tile {z}/{x}/{y}: {str(e)}")
+                        with lock:
+                            stats[z]["tiles"] += 1
+                            stats[z]["failed"] += 1
+                        continue
+                    with lock:
+                        zoom_stats = stats[z]
+                        zoom_stats["tiles"] += 1
+                        if data:
+                            zoom_stats["written"] += 1
+                            zoom_stats["bytes"] += len(data)
+                        else:
+                            zoom_stats["empty"] += 1
+        finally:
+            db_conn.close()
+
+    threads = [threading.Thread(target=worker, name=f"tiles-{i + 1}") for i in range(max(1, workers))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return stats
+
+
+def get_feed_head(db_conn) -> int:
+    """Id of the latest tile_invalidations row (0 if the feed is empty)"""
+    with db_conn.cursor() as cur:
+        cur.execute("SELECT COALESCE(max(id), 0) FROM tile_invalidations")
+        return cur.fetchone()[0]
+
+
+def get_feed_pruned_id(db_conn) -> int:
+    """Id of the latest tile_invalidations row deleted by the feed retention (0 if none was)"""
+    with db_conn.cursor() as cur:
+        cur.execute("SELECT value FROM ingest_state WHERE key = %s", (FEED_PRUNED_KEY,))
+        row = cur.fetchone()
+    return int(row[0]) if row else 0
+
+
+def read_feed(db_conn, after_id: int) -> Tuple[int, List[Tuple[int, int, int]]]:
+    """
+    Tiles invalidated by the tile_invalidations rows after after_id (see dirty_tiles.py).
+
+    Returns:
+        Tuple of (id of the last row read, or after_id if there is none; sorted (z, x, y) tiles)
+    """
+    with db_conn.cursor() as cur:
+        cur.execute("SELECT id, tiles FROM tile_invalidations WHERE id > %s ORDER BY id", (after_id,))
+        rows = cur.fetchall()
+    tiles = set()
+    for _, keys in rows:
+        for key in keys:
+            z, x, y = key.split("/")
+            tiles.add((int(z), int(x), int(y)))
+    return (rows[-1][0] if rows else after_id), sorted(tiles)
+
+
+def load_feed_position(tiles_dir: str) -> Optional[int]:
+    try:
+        with open(os.path.join(tiles_dir, FEED_POSITION_FILENAME), "r", encoding="utf-8") as f:
+            return int(f.read().strip())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def save_feed_position(tiles_dir: str, feed_id: int) -> None:
+    os.makedirs(tiles_dir, exist_ok=True)
+    path = os.path.join(tiles_dir, FEED_POSITION_FILENAME)
+    with open(path + ".part", "w", encoding="utf-8") as f:
+        f.write(str(feed_id))
+    os.replace(path + ".part", path)
+
+
+def cache_size(tiles_dir: str) -> Tuple[int, int]:
+    """Number of tile files and their total size in bytes"""
+    count = 0
+    size = 0
+    for root, _, files in os.walk(tiles_dir):
+        for name in files:
+            if name.endswith(".pbf"):
+                count += 1
+                size += os.path.getsize(os.path.join(root, name))
+    return count, size
+
+
+def parse_args(argv=None):
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Pre-render vector tiles of streets and their snow removal status")
+    parser.add_argument("--min-zoom", type=int, default=TILE_MIN_ZOOM, help="lowest zoom (env TILE_MIN_ZOOM, default: 12)")
+    parser.add_argument("--max-zoom", type=int, default=TILE_MAX_ZOOM, help="highest zoom (env TILE_MAX_ZOOM, default: 16)")
+    parser.add_argument("--tiles-dir", default=TILES_DIR, help="root of the z/x/y.pbf pyramid (env TILES_DIR, default: tiles)")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("TILE_WORKERS", "4")),
+                        help="tiles rendered in parallel, one connection each (env TILE_WORKERS, default: 4)")
+    parser.add_argument("--dirty", action="store_true",
+                        help="only re-render the tiles invalidated by ingests since the last build (tile_invalidations feed)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Main function to build the tile pyramid"""
+    args = parse_args(argv)
+
+    database_url = os.environ.get("DATABASE_URL") or os.environ.get("SUPABASE_DB_URL")
+    if not database_url:
+        print("ERROR: DATABASE_URL or SUPABASE_DB_URL not set in .env file")
+        return 1
+
+    feed_position = load_feed_position(args.tiles_dir) if args.dirty else None
+    if args.dirty and feed_position is None:
+        print(f"⚠ No feed position in {args.tiles_dir}/, building the whole pyramid")
+
+    db_conn = psycopg2.connect(database_url)
+    try:
+        bounds = get_streets_bounds(db_conn)
+        if feed_position is not None:
+            # Rows past the position may have been deleted by the feed retention before this run
+            pruned_id = get_feed_pruned_id(db_conn)
+            if feed_position < pruned_id:
+                print(f"⚠ Feed position {feed_position} is older than the retained invalidations "
+                      f"(rows up to {pruned_id} were deleted), building the whole pyramid")
+                feed_position = None
+        if feed_position is not None:
+            feed_head, tiles = read_feed(db_conn, feed_position)
+            tiles = [tile for tile in tiles if args.min_zoom <= tile[0] <= args.max_zoom]
+        else:
+            # Changes published while the pyramid renders are applied by the next --dirty run
+            feed_head = get_feed_head(db_conn)
+            tiles = None
+    finally:
+        db_conn.close()
+    if bounds is None:
+        print("⚠ No streets, nothing to render")
+        return 0
+
+    if tiles is None:
+        tiles = [tile for z in range(args.min_zoom, args.max_zoom + 1) for tile in tiles_in_bounds(bounds, z)]
+        print(f"Rendering {len(tiles)} tiles (zoom {args.min_zoom}-{args.max_zoom}) into {args.tiles_dir}/ with {args.workers} worker(s)")
+    elif not tiles:
+        save_feed_position(args.tiles_dir, feed_head)
+        print("✓ No tile invalidated since the last build")
+        return 0
+    else:
+        print(f"Re-rendering {len(tiles)} invalidated tile(s) (feed {feed_position + 1}-{feed_head}) into {args.tiles_dir}/")
+
+    start = time.monotonic()
+    stats = build_tiles(tiles, database_url, args.tiles_dir, args.workers)
+    elapsed = time.monotonic() - start
+    write_metadata(args.tiles_dir, args.min_zoom, args.max_zoom, bounds)
+
+    print("\n" + "=" * 60)
+    print("TILE SUMMARY")
+    print("=" * 60)
+    for z in sorted(stats):
+        zoom_stats = stats[z]
+        average = zoom_stats["bytes"] / zoom_stats["written"] / 1024 if zoom_stats["written"] else 0
+        print(f"  z{z:<3} {zoom_stats['tiles']:7d} tiles  {zoom_stats['written']:7d} written  {zoom_stats['empty']:7d} empty  "
+              f"{zoom_stats['bytes'] / 1024 / 1024:8.1f} MB  avg {average:6.1f} KB")
+    failed = sum(zoom_stats["failed"] for zoom_stats in stats.values())
+    count, size = cache_size(args.tiles_dir)
+    print(f"  Rendered {len(tiles)} tiles in {elapsed:.1f}s ({len(tiles) / elapsed if elapsed else 0:.0f} tiles/s)")
+    print(f"  Cache: {count} tiles, {size / 1024 / 1024:.1f} MB")
+    if failed:
+        print(f"  ✗ Failed tiles: {failed} (feed position not advanced)")
+    else:
+        save_feed_position(args.tiles_dir, feed_head)
+    print("=" * 60)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -19,6 +19,10 @@ export async function GET(request: Request) {
     const minLng = searchParams.get("minLng");
     const maxLat = searchParams.get("maxLat");
     const maxLng = searchParams.get("maxLng");
+    // Optional map zoom: below 16, geometries are simplified for that zoom
+    const zoom = searchParams.get("zoom");
+    // Optional encoding=polyline: geometries as encoded polylines instead of GeoJSON coordinates
+    const polyline = searchParams.get("encoding") === "polyline";
 
     const supabase = createClient(supabaseUrl, supabaseKey);
 
@@ -36,6 +40,8 @@ export async function GET(request: Request) {
         max_lng: maxLngNum,
         max_lat: maxLatNum,
         include_snow: includeSnowStatus,
+        zoom: zoom ? parseInt(zoom, 10) : null,
+        polyline,
       });
 
       //console.log("data length", data ? data.length : 0);
@@ -70,6 +76,10 @@ export async function GET(request: Request) {
           result.deneigement_current = row.deneigement_current;
         }
 
+        if (polyline) {
+          result.polyline = row.encoded_geometry;
+        }
+
         return result;
       });
 
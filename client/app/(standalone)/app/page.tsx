@@ -42,6 +42,7 @@ import {
   onAuthStateChange,
 } from "@/lib/auth";
 import { searchAddress, type GeocodingResult } from "@/lib/geocoding";
+import { decodePolyline } from "@/lib/polyline";
 import { getEtatDeneigColor, getEtatDeneigStatus } from "@/lib/constants";
 import { AuthModal } from "@/components/auth-modal";
 import type { User as SupabaseUser } from "@supabase/supabase-js";
@@ -60,6 +61,7 @@ export default function MapApp() {
     minLng: number;
     maxLat: number;
     maxLng: number;
+    zoom?: number;
   } | null>(null);
   const [selectedPlanif, setSelectedPlanif] = useState<any | null>(null);
   const [searchQuery, setSearchQuery] = useState("");
@@ -140,15 +142,21 @@ export default function MapApp() {
         minLng: number;
         maxLat: number;
         maxLng: number;
+        zoom?: number;
       }
     ) => {
       setLoading(true);
       try {
-        let url = "/api/streets?include_snow=true";
+        // Geometries come back as encoded polylines, decoded below
+        let url = "/api/streets?include_snow=true&encoding=polyline";
 
         // Add bounding box parameters if provided
         if (bounds) {
           url += `&minLat=${bounds.minLat}&minLng=${bounds.minLng}&maxLat=${bounds.maxLat}&maxLng=${bounds.maxLng}`;
+          // Lets the API return geometries simplified for the zoom level
+          if (bounds.zoom !== undefined) {
+            url += `&zoom=${Math.round(bounds.zoom)}`;
+          }
         }
 
         const response = await fetch(url, {
@@ -163,6 +171,20 @@ export default function MapApp() {
 
         if (result.success && result.data) {
           const transformedData = result.data
+            .map((street: any) =>
+              street.polyline && street.street_feature
+                ? {
+                    ...street,
+                    street_feature: {
+                      ...street.street_feature,
+                      geometry: {
+                        type: "LineString",
+                        coordinates: decodePolyline(street.polyline),
+                      },
+                    },
+                  }
+                : street
+            )
             .filter(
               (street: any) =>
                 street.deneigement_current && street.street_feature?.geometry
@@ -204,6 +226,7 @@ export default function MapApp() {
       minLng: number;
       maxLat: number;
       maxLng: number;
+      zoom?: number;
     }) => {
       if (!hasInitialBoundsRef.current) {
         hasInitialBoundsRef.current = true;
@@ -142,6 +142,7 @@ interface SnowMapProps {
     minLng: number;
     maxLat: number;
     maxLng: number;
+    zoom?: number;
   }) => void;
   enableDynamicFetching?: boolean;
   onMapClick?: (lat: number, lng: number) => void;
@@ -262,6 +263,7 @@ function MapBoundsTracker({
     minLng: number;
     maxLat: number;
     maxLng: number;
+    zoom?: number;
   }) => void;
   enableDynamicFetching?: boolean;
 }) {
@@ -293,7 +295,7 @@ function MapBoundsTracker({
     }
 
     timeoutRef.current = setTimeout(() => {
-      onBoundsChange({ minLat, minLng, maxLat, maxLng });
+      onBoundsChange({ minLat, minLng, maxLat, maxLng, zoom: map.getZoom() });
     }, 300); // 300ms debounce
   }, [map, onBoundsChange, enableDynamicFetching]);
 
@@ -0,0 +1,37 @@
+// Decimal places of the polylines returned by get_streets_in_bbox (ST_AsEncodedPolyline(geom, 6))
+export const POLYLINE_PRECISION = 6;
+
+/**
+ * Decode an encoded polyline (latitude first, zigzag varint deltas) into
+ * GeoJSON [lng, lat] positions.
+ */
+export function decodePolyline(
+  encoded: string,
+  precision: number = POLYLINE_PRECISION
+): [number, number][] {
+  const factor = Math.pow(10, precision);
+  const coordinates: [number, number][] = [];
+  let index = 0;
+  let lat = 0;
+  let lng = 0;
+
+  const readValue = () => {
+    let result = 0;
+    let shift = 0;
+    let byte: number;
+    do {
+      byte = encoded.charCodeAt(index++) - 63;
+      // Multiply instead of shifting: deltas can exceed 31 bits at precision 6
+      result += (byte & 0x1f) * Math.pow(2, shift);
+      shift += 5;
+    } while (byte >= 0x20);
+    return result % 2 === 1 ? -(result + 1) / 2 : result / 2;
+  };
+
+  while (index < encoded.length) {
+    lat += readValue();
+    lng += readValue();
+    coordinates.push([lng / factor, lat / factor]);
+  }
+  return coordinates;
+}
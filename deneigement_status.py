@@ -0,0 +1,17 @@
+#!/usr/bin/env python3
+"""Human-readable snow removal status of the API's etatDeneig codes"""
+
+ETAT_DENEIG_STATUS = {
+    0: "Enneigé",
+    1: "Déneigé",
+    2: "Planifié",
+    3: "Replanifié",
+    4: "Sera replanifié ultérieurement",
+    5: "Chargement en cours",
+    10: "Dégagé (entre 2 chargements de neige)"
+}
+
+
+def get_etat_deneig_status(etat: int) -> str:
+    """Convert etatDeneig number to human-readable status string"""
+    return ETAT_DENEIG_STATUS.get(etat, f"État inconnu ({etat})")
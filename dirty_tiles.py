@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""Tile invalidation feed: the tile keys and bbox cells covering the street sides changed by an ingest or a street rewrite"""
+from typing import Optional, Dict, Any, List, Tuple, Iterable
+import os
+import math
+import json
+import build_tiles
+
+# LISTEN channel the feed is announced on
+CHANNEL = "tile_invalidations"
+
+# Size in degrees of the bbox cells downstream caches key bounding-box responses on
+CELL_SIZE = float(os.environ.get("INVALIDATION_CELL_SIZE", "0.01"))
+
+# NOTIFY payloads must stay under 8000 bytes; larger feeds only announce the row id
+NOTIFY_PAYLOAD_LIMIT = 7900
+
+FEED_RETENTION_DAYS = int(os.environ.get("INVALIDATION_RETENTION_DAYS", "7"))
+
+
+def get_street_bounds(cur, cote_rue_ids: List[int]) -> List[Tuple[float, float, float, float]]:
+    """Bounding boxes (min_lng, min_lat, max_lng, max_lat) of the given street sides"""
+    cur.execute("""
+        SELECT ST_XMin(g), ST_YMin(g), ST_XMax(g), ST_YMax(g)
+        FROM (SELECT geometry::geometry AS g FROM streets WHERE cote_rue_id = ANY(%s) AND geometry IS NOT NULL) s
+    """, (cote_rue_ids,))
+    return cur.fetchall()
+
+
+def dirty_tiles(bounds_list: Iterable[Tuple[float, float, float, float]], min_zoom: int, max_zoom: int) -> List[str]:
+    """
+    Keys ("z/x/y") of every tile a street with one of these bounds is drawn in,
+    including the neighbours whose buffer it reaches.
+    """
+    margin = build_tiles.TILE_BUFFER / build_tiles.TILE_EXTENT
+    tiles = set()
+    for bounds in bounds_list:
+        for z in range(min_zoom, max_zoom + 1):
+            tiles.update(build_tiles.tiles_in_bounds(bounds, z, margin=margin))
+    return [f"{z}/{x}/{y}" for z, x, y in sorted(tiles)]
+
+
+def dirty_cells(bounds_list: Iterable[Tuple[float, float, float, float]], cell_size: float) -> List[str]:
+    """
+    Keys ("i,j") of the cell_size-degree grid cells intersecting these bounds;
+    cell i,j spans longitudes [i * cell_size, (i + 1) * cell_size) and the same for latitudes with j.
+    """
+    cells = set()
+    for min_lng, min_lat, max_lng, max_lat in bounds_list:
+        for i in range(math.floor(min_lng / cell_size), math.floor(max_lng / cell_size) + 1):
+            for j in range(math.floor(min_lat / cell_size), math.floor(max_lat / cell_size) + 1):
+                cells.add((i, j))
+    return [f"{i},{j}" for i, j in sorted(cells)]
+
+
+def notify_payload(feed_id: int, tiles: List[str], cells: List[str]) -> str:
+    """The full change set if it fits in a NOTIFY payload, otherwise only the feed row id and its counts"""
+    payload = json.dumps({"id": feed_id, "tiles": tiles, "cells": cells}, separators=(",", ":"))
+    if len(payload.encode("utf-8")) <= NOTIFY_PAYLOAD_LIMIT:
+        return payload
+    return json.dumps({"id": feed_id, "tile_count": len(tiles), "cell_count": len(cells)}, separators=(",", ":"))
+
+
+def publish(
+    db_conn,
+    cote_rue_ids: List[int],
+    min_zoom: int = build_tiles.TILE_MIN_ZOOM,
+    max_zoom: int = build_tiles.TILE_MAX_ZOOM,
+    cell_size: float = CELL_SIZE,
+    extra_bounds: Iterable[Tuple[float, float, float, float]] = ()
+) -> Optional[Dict[str, Any]]:
+    """
+    Record the tiles and bbox cells covering the changed street sides in tile_invalidations
+    and announce them with NOTIFY, in one transaction (listeners only hear about committed rows).
+
+    Args:
+        db_conn: psycopg2 connection
+        cote_rue_ids: Street sides whose current state or geometry changed (their stored bounds are used)
+        min_zoom: Lowest tile zoom to invalidate
+        max_zoom: Highest tile zoom to invalidate
+        cell_size: Size of the bbox cells in degrees
+        extra_bounds: Bounds that are no longer stored, e.g. the previous geometry of a rewritten
+            or deleted street, whose tiles must be redrawn without it
+
+    Returns:
+        {"id", "tiles", "cells"} counts of the feed row, or None if nothing changed
+    """
+    extra_bounds = [bounds for bounds in extra_bounds if bounds and bounds[0] is not None]
+    if not cote_rue_ids and not extra_bounds:
+        return None
+    try:
+        with db_conn.cursor() as cur:
+            bounds_list = (get_street_bounds(cur, list(cote_rue_ids)) if cote_rue_ids else []) + extra_bounds
+            tiles = dirty_tiles(bounds_list, min_zoom, max_zoom)
+            cells = dirty_cells(bounds_list, cell_size)
+            cur.execute("""
+                INSERT INTO tile_invalidations (cote_rue_ids, tiles, cells, min_zoom, max_zoom, cell_size)
+                VALUES (%s, %s, %s, %s, %s, %s)
+                RETURNING id
+            """, (sorted(cote_rue_ids), tiles, cells, min_zoom, max_zoom, cell_size))
+            feed_id = cur.fetchone()[0]
+            cur.execute("SELECT pg_notify(%s, %s)", (CHANNEL, notify_payload(feed_id, tiles, cells)))
+            cur.execute(
+                "DELETE FROM tile_invalidations WHERE created_at < now() - make_interval(days => %s) RETURNING id",
+                (FEED_RETENTION_DAYS,)
+            )
+            pruned = [row[0] for row in cur.fetchall()]
+            if pruned:
+                cur.execute("""
+                    INSERT INTO ingest_state (key, value, updated_at)
+                    VALUES (%s, %s, now())
+                    ON CONFLICT (key) DO UPDATE SET
+                        value = GREATEST(ingest_state.value::bigint, EXCLUDED.value::bigint)::text,
+                        updated_at = now()
+                """, (build_tiles.FEED_PRUNED_KEY, str(max(pruned))))
+        db_conn.commit()
+    except Exception:
+        db_conn.rollback()
+        raise
+    return {"id": feed_id, "tiles": len(tiles), "cells": len(cells)}
+
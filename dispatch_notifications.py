@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""Dispatch unsent notifications: claim them in batches, send one digest per user and mark them sent in bulk"""
+from typing import Optional, Dict, Any, List, Tuple
+import os
+import sys
+import time
+import threading
+import argparse
+import psycopg2
+import requests
+from dotenv import load_dotenv
+from deneigement_status import get_etat_deneig_status
+
+load_dotenv()
+
+# Digests are POSTed as JSON to this URL (required unless --dry-run)
+NOTIFY_WEBHOOK_URL = os.environ.get("NOTIFY_WEBHOOK_URL")
+
+DEFAULT_BATCH_SIZE = int(os.environ.get("NOTIFY_BATCH_SIZE", "5000"))
+
+# Seconds after which a claim that was neither sent nor released (dispatcher killed mid-batch) expires
+CLAIM_TIMEOUT = int(os.environ.get("NOTIFY_CLAIM_TIMEOUT", "900"))
+
+# Oldest unclaimed unsent notifications first; rows being claimed by another dispatcher are skipped, not waited on.
+# The claim is committed before delivery, so no lock is held while the webhook is called
+CLAIM_SQL = """
+    WITH claimed AS (
+        UPDATE notifications
+        SET claimed_at = now()
+        WHERE id IN (
+            SELECT id FROM notifications
+            WHERE NOT sent AND (claimed_at IS NULL OR claimed_at < now() - make_interval(secs => %s))
+            ORDER BY id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, user_id, cote_rue_id, old_etat, new_etat, created_at
+    )
+    SELECT c.id, c.user_id, c.cote_rue_id, c.old_etat, c.new_etat, c.created_at,
+           s.nom_voie, s.nom_ville, s.debut_adresse, s.fin_adresse
+    FROM claimed c
+    LEFT JOIN streets s ON s.cote_rue_id = c.cote_rue_id
+    ORDER BY c.id
+"""
+
+# Same rows as a claim, read without claiming them (--dry-run)
+PEEK_SQL = """
+    SELECT n.id, n.user_id, n.cote_rue_id, n.old_etat, n.new_etat, n.created_at,
+           s.nom_voie, s.nom_ville, s.debut_adresse, s.fin_adresse
+    FROM notifications n
+    LEFT JOIN streets s ON s.cote_rue_id = n.cote_rue_id
+    WHERE NOT n.sent AND (n.claimed_at IS NULL OR n.claimed_at < now() - make_interval(secs => %s))
+    ORDER BY n.id
+    LIMIT %s
+"""
+
+
+def build_digests(rows: List[tuple]) -> Dict[Any, Dict[str, Any]]:
+    """
+    Group claimed notifications per user.
+
+    A street side that changed several times is reported once, from its first
+    old state to its last new state.
+
+    Args:
+        rows: Rows returned by CLAIM_SQL or PEEK_SQL, in id order
+
+    Returns:
+        Mapping of user_id to {"ids": [...], "changes": [...]}
+    """
+    digests = {}
+    for (notification_id, user_id, cote_rue_id, old_etat, new_etat, created_at,
+         nom_voie, nom_ville, debut_adresse, fin_adresse) in rows:
+        digest = digests.setdefault(user_id, {"ids": [], "changes": {}})
+        digest["ids"].append(notification_id)
+        change = digest["changes"].get(cote_rue_id)
+        if change is None:
+            digest["changes"][cote_rue_id] = {
+                "cote_rue_id": cote_rue_id,
+                "nom_voie": nom_voie,
+                "nom_ville": nom_ville,
+                "debut_adresse": debut_adresse,
+                "fin_adresse": fin_adresse,
+                "old_etat": old_etat,
+                "new_etat": new_etat,
+                "changed_at": created_at.isoformat() if created_at else None,
+            }
+        else:
+            change["new_etat"] = new_etat
+            change["changed_at"] = created_at.isoformat() if created_at else change["changed_at"]
+
+    for digest in digests.values():
+        changes = list(digest["changes"].values())
+        for change in changes:
+            change["old_status"] = get_etat_deneig_status(change["old_etat"]) if change["old_etat"] is not None else None
+            change["new_status"] = get_etat_deneig_status(change["new_etat"]) if change["new_etat"] is not None else None
+        digest["changes"] = changes
+    return digests
+
+
+def print_digest(user_id, changes: List[Dict[str, Any]]) -> None:
+    """Print one user's digest (--dry-run)"""
+    streets = ", ".join(f"{change['nom_voie'] or change['cote_rue_id']} → {change['new_status']}" for change in changes)
+    print(f"  {user_id}: {len(changes)} street(s): {streets}")
+
+
+def send_digest(session: requests.Session, user_id, changes: List[Dict[str, Any]]) -> bool:
+    """
+    Deliver one user's digest.
+
+    Returns:
+        True if the digest was delivered (its notifications can be marked sent)
+    """
+    try:
+        response = session.post(NOTIFY_WEBHOOK_URL, json={"user_id": str(user_id), "changes": changes}, timeout=30)
+        response.raise_for_status()
+        return True
+    except Exception as e:
+        print(f"✗ Failed to send digest to user {user_id}: {str(e)}")
+        return False
+
+
+def dispatch_batch(db_conn, session: Optional[requests.Session], batch_size: int) -> Tuple[int, int, int]:
+    """
+    Claim up to batch_size unsent notifications, send the digests and mark the delivered ones sent.
+
+    The claim (claimed_at) is committed before the digests are sent, so concurrent dispatchers
+    never send the same notification and no transaction stays open during delivery. Notifications
+    of a failed digest are released for the next run; a claim left behind by a dispatcher that
+    died mid-batch expires after CLAIM_TIMEOUT seconds.
+    Without a session (--dry-run) the digests of the next batch are only printed, nothing is claimed.
+
+    Returns:
+        Tuple of (claimed, marked sent, digests sent)
+    """
+    try:
+        with db_conn.cursor() as cur:
+            cur.execute(PEEK_SQL if session is None else CLAIM_SQL, (CLAIM_TIMEOUT, batch_size))
+            rows = cur.fetchall()
+        db_conn.commit()
+    except Exception:
+        db_conn.rollback()
+        raise
+    if not rows:
+        return 0, 0, 0
+
+    if session is None:
+        for user_id, digest in build_digests(rows).items():
+            print_digest(user_id, digest["changes"])
+        return len(rows), 0, 0
+
+    sent_ids = []
+    sent_digests = 0
+    for user_id, digest in build_digests(rows).items():
+        if send_digest(session, user_id, digest["changes"]):
+            sent_ids.extend(digest["ids"])
+            sent_digests += 1
+    failed_ids = sorted(set(row[0] for row in rows) - set(sent_ids))
+
+    try:
+        with db_conn.cursor() as cur:
+            if sent_ids:
+                cur.execute("UPDATE notifications SET sent = true, claimed_at = NULL WHERE id = ANY(%s)", (sent_ids,))
+            if failed_ids:
+                cur.execute("UPDATE notifications SET claimed_at = NULL WHERE id = ANY(%s)", (failed_ids,))
+        db_conn.commit()
+    except Exception:
+        db_conn.rollback()
+        raise
+
+    return len(rows), len(sent_ids), sent_digests
+
+
+def run_worker(database_url: str, batch_size: int, totals: Dict[str, int], lock: threading.Lock, dry_run: bool = False) -> None:
+    """Dispatch batches on one connection until no unsent notification is left to claim"""
+    session = None
+    if not dry_run:
+        session = requests.Session()
+        session.headers.update({"User-Agent": "PlanifNeige-Notifications/1.0"})
+
+    db_conn = psycopg2.connect(database_url)
+    try:
+        while True:
+            try:
+                claimed, marked, digests = dispatch_batch(db_conn, session, batch_size)
+            except Exception as e:
+                print(f"✗ [{threading.current_thread().name}] Batch failed: {str(e)}")
+                with lock:
+                    totals["batches_failed"] += 1
+                return
+            if claimed == 0:
+                return
+            with lock:
+                totals["claimed"] += claimed
+                totals["sent"] += marked
+                totals["digests"] += digests
+            print(f"✓ [{threading.current_thread().name}] {claimed} notification(s) claimed, "
+                  f"{marked} sent in {digests} digest(s)")
+            # A batch with undeliverable digests would be claimed again right away
+            if marked < claimed or claimed < batch_size:
+                return
+    finally:
+        db_conn.close()
+
+
+def parse_args(argv=None):
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Send unsent notifications as one digest per user")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="notifications claimed per transaction (env NOTIFY_BATCH_SIZE, default: 5000)")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("NOTIFY_WORKERS", "1")),
+                        help="dispatchers run in parallel, each on its own connection (env NOTIFY_WORKERS)")
+    parser.add_argument("--loop", type=float, default=None, metavar="SECONDS",
+                        help="keep running, polling for new notifications every SECONDS")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="print the digests of the next batch instead of sending them; nothing is marked sent")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Main function to dispatch notifications"""
+    args = parse_args(argv)
+
+    database_url = os.environ.get("DATABASE_URL") or os.environ.get("SUPABASE_DB_URL")
+    if not database_url:
+        print("ERROR: DATABASE_URL or SUPABASE_DB_URL not set in .env file")
+        return 1
+
+    # Without a webhook nothing can be delivered, so nothing may be marked sent
+    if args.dry_run:
+        print("Dry run: digests are only printed, no notification is marked sent")
+    elif not NOTIFY_WEBHOOK_URL:
+        print("ERROR: NOTIFY_WEBHOOK_URL not set (use --dry-run to only print the digests)")
+        return 1
+
+    while True:
+        start = time.monotonic()
+        totals = {"claimed": 0, "sent": 0, "digests": 0, "batches_failed": 0}
+        lock = threading.Lock()
+        workers = [
+            threading.Thread(target=run_worker, args=(database_url, args.batch_size, totals, lock, args.dry_run), name=f"dispatch-{i + 1}")
+            for i in range(max(1, args.workers))
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        if totals["claimed"] or totals["batches_failed"]:
+            print(f"Dispatched {totals['sent']}/{totals['claimed']} notification(s) in {totals['digests']} digest(s) "
+                  f"in {time.monotonic() - start:.1f}s")
+        if args.loop is None:
+            if args.dry_run:
+                return 1 if totals["batches_failed"] else 0
+            return 1 if totals["batches_failed"] or totals["sent"] < totals["claimed"] else 0
+        time.sleep(args.loop)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
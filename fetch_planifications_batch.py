@@ -1,27 +1,54 @@
 #!/usr/bin/env python3
 """Script to fetch all planifications from the last 60 days and upsert streets to Supabase"""
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Tuple
 import os
+import io
+import csv
+import time
 import json
+import pickle
+import hashlib
+import bisect
+from array import array
 import zeep
+from zeep.cache import SqliteCache
 from dotenv import load_dotenv
 from supabase import create_client
-from shapely.geometry import shape, LineString, MultiLineString
-from shapely.ops import linemerge
+from shapely.geometry import LineString
 import psycopg2
-from psycopg2.extras import Json as PGJson
+from psycopg2.extras import Json as PGJson, execute_values
 from psycopg2 import pool
 import pathlib
-from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Optional: only needed for INGEST_MODE=async
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
 import threading
-import requests
+import queue
+import asyncio
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import geobase
+from geobase import normalize_to_linestring
+from deneigement_status import get_etat_deneig_status
+import planif_raw
+import geometry_encoding
+import dirty_tiles
+import status_snapshot
 
 # Load environment variables from .env file
 load_dotenv()
 
 DEFAULT_URL = ('https://servicesenligne2.ville.montreal.qc.ca/api/infoneige/InfoneigeWebService?WSDL')
 
+# On-disk cache of the WSDL/XSD documents, so startup does not wait on the city's WSDL endpoint
+WSDL_CACHE_PATH = os.environ.get("WSDL_CACHE_PATH", os.path.join(geobase.GEOBASE_CACHE_DIR, "wsdl_cache.db"))
+WSDL_CACHE_TTL = int(os.environ.get("WSDL_CACHE_TTL", str(7 * 24 * 3600)))  # seconds
+
 # Initialize Supabase client
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SUPABASE_SERVICE_KEY = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
@@ -38,66 +65,117 @@ thread_local = threading.local()
 # Connection pool for database connections (initialized in main)
 db_pool = None
 
+# Memo of normalized street geometries (initialized in main)
+geometry_cache = None
+
+# Ids present in the streets table, loaded once per run (initialized in main)
+known_streets = None
+
+# Geobase seen by process-pool workers: inherited on fork, loaded from the street store on spawn
+process_geobase = None
+
+# ingest_state key of the fetch high-water mark (max dateMaj of the last committed run)
+WATERMARK_KEY = "planifications_date_maj"
+
+# streets table columns and the gbdouble property each one is read from
+STREET_PROPERTIES = {
+    "cote_rue_id": "COTE_RUE_ID",
+    "id_trc": "ID_TRC",
+    "id_voie": "ID_VOIE",
+    "nom_voie": "NOM_VOIE",
+    "nom_ville": "NOM_VILLE",
+    "debut_adresse": "DEBUT_ADRESSE",
+    "fin_adresse": "FIN_ADRESSE",
+    "cote": "COTE",
+    "type_f": "TYPE_F",
+    "sens_cir": "SENS_CIR",
+}
+STREET_COLUMNS = list(STREET_PROPERTIES)
+
+# Store a slim street_feature (the STREET_PROPERTIES and the normalized geometry, with coordinates and the
+# geometry columns quantized to COORDINATE_PRECISION) instead of the full geobase feature
+SLIM_STREET_FEATURES = os.environ.get("SLIM_STREET_FEATURES", "0") == "1"
+
+# Simplified copies of the street geometry stored for low zooms: column -> highest zoom it serves.
+# Each is simplified to half a screen pixel at that zoom (see simplify_tolerance and get_streets_in_bbox)
+SIMPLIFIED_GEOMETRIES = {
+    "geometry_z11": 11,
+    "geometry_z13": 13,
+    "geometry_z15": 15,
+}
+SIMPLIFIED_COLUMNS = list(SIMPLIFIED_GEOMETRIES)
+
+# deneigement_current columns and the planification field each one is read from
+CURRENT_FIELDS = {
+    "cote_rue_id": "coteRueId",
+    "etat_deneig": "etatDeneig",
+    "status": "status",
+    "date_debut_planif": "dateDebutPlanif",
+    "date_fin_planif": "dateFinPlanif",
+    "date_debut_replanif": "dateDebutReplanif",
+    "date_fin_replanif": "dateFinReplanif",
+    "date_maj": "dateMaj",
+}
+CURRENT_COLUMNS = list(CURRENT_FIELDS)
+
+# ON CONFLICT ... DO UPDATE condition of the deneigement_current upserts: only rewrite a row
+# whose fields differ (NULL planif dates keep the stored value, so they never count as a change)
+CURRENT_CHANGED_SQL = """
+    (deneigement_current.etat_deneig, deneigement_current.status,
+     deneigement_current.date_debut_planif, deneigement_current.date_fin_planif,
+     deneigement_current.date_debut_replanif, deneigement_current.date_fin_replanif,
+     deneigement_current.date_maj)
+    IS DISTINCT FROM
+    (EXCLUDED.etat_deneig, EXCLUDED.status,
+     COALESCE(EXCLUDED.date_debut_planif, deneigement_current.date_debut_planif),
+     COALESCE(EXCLUDED.date_fin_planif, deneigement_current.date_fin_planif),
+     COALESCE(EXCLUDED.date_debut_replanif, deneigement_current.date_debut_replanif),
+     COALESCE(EXCLUDED.date_fin_replanif, deneigement_current.date_fin_replanif),
+     EXCLUDED.date_maj)
+"""
+
+# deneigement_events columns, as built by build_event()
+EVENT_COLUMNS = ["cote_rue_id", "old_etat", "new_etat", "old_status", "new_status", "event_date"]
+
+
+def linestring_to_wkt(normalized):
+    """Convert a normalized GeoJSON LineString to WKT, or None if it has no coordinates"""
+    if not normalized:
+        return None
+    
+    coordinates = normalized.get("coordinates")
+    if not coordinates:
+        return None
+    
+    return LineString(coordinates).wkt
+
+
+def simplify_tolerance(zoom: int) -> float:
+    """Half the width of a 256px tile pixel at the zoom, in degrees"""
+    return 360.0 / 256 / 2 ** zoom / 2
+
 
-def normalize_to_linestring(geometry):
+def simplify_linestring(normalized) -> Dict[str, Optional[Dict[str, Any]]]:
     """
-    Normalize geometry to LineString.
-    Converts MultiLineString to LineString by merging connected segments.
-    If segments cannot be merged, uses the longest segment.
+    Topology-preserving simplifications of a normalized LineString, one per SIMPLIFIED_GEOMETRIES column.
     
     Args:
-        geometry: GeoJSON geometry object with 'type' and 'coordinates' keys
+        normalized: GeoJSON LineString returned by normalize_to_linestring, or None
     
     Returns:
-        GeoJSON geometry object with type 'LineString', or None if conversion fails
+        Mapping of column to simplified GeoJSON LineString (None for every column if there is no line)
     """
-    geom_type = geometry.get("type")
-    coordinates = geometry.get("coordinates")
-    
-    if not coordinates:
-        return None
+    coordinates = normalized.get("coordinates") if normalized else None
+    if not coordinates or len(coordinates) < 2:
+        return {column: None for column in SIMPLIFIED_COLUMNS}
     
-    if geom_type == "LineString":
-        return geometry
-    elif geom_type == "MultiLineString":
-        # Convert MultiLineString to LineString
-        try:
-            # Create MultiLineString object
-            multi_linestring = MultiLineString(coordinates)
-            
-            # Try to merge connected segments
-            merged = linemerge(multi_linestring)
-            
-            if isinstance(merged, LineString):
-                # Successfully merged into a single LineString
-                return {
-                    "type": "LineString",
-                    "coordinates": list(merged.coords)
-                }
-            else:
-                # Could not merge completely (segments are disconnected)
-                # Use the longest segment from the merged result as fallback
-                if isinstance(merged, MultiLineString):
-                    longest_line = max(merged.geoms, key=lambda g: g.length)
-                else:
-                    # Fallback to original if merged is unexpected type
-                    longest_line = max(multi_linestring.geoms, key=lambda g: g.length)
-                return {
-                    "type": "LineString",
-                    "coordinates": list(longest_line.coords)
-                }
-        except Exception as e:
-            # If merging fails, use the first segment
-            print(f"Warning: Could not merge MultiLineString, using first segment: {str(e)}")
-            if coordinates and len(coordinates) > 0:
-                return {
-                    "type": "LineString",
-                    "coordinates": coordinates[0]
-                }
-            return None
-    else:
-        # Unsupported geometry type
-        return None
+    line = LineString(coordinates)
+    simplified = {}
+    for column, zoom in SIMPLIFIED_GEOMETRIES.items():
+        # Endpoints are always kept, so the result stays a valid LineString
+        simple = line.simplify(simplify_tolerance(zoom), preserve_topology=True)
+        simplified[column] = {"type": "LineString", "coordinates": [list(coord) for coord in simple.coords]}
+    return simplified
 
 
 def geojson_to_wkt(geometry):
@@ -112,16 +190,201 @@ def geojson_to_wkt(geometry):
         WKT string if geometry type is supported, None otherwise
     """
     # Normalize to LineString first
+    return linestring_to_wkt(normalize_to_linestring(geometry))
+
+
+class GeometryCache:
+    """
+    Persistent memo of normalize_to_linestring() results, their WKT and their simplified
+    copies (simplify_linestring), keyed by a hash of the source GeoJSON geometry.
+    
+    A geometry that changes in the geobase hashes to a new key, so stale results are never
+    returned; entries that have not been used for `max_age_runs` runs are dropped on save.
+    
+    Process-pool workers use their own copy: they track() what they compute and hit, and
+    the parent merge()s each take_delta() back before saving.
+    """
+    
+    # Bumped when the entry layout changes; a cache written with another version starts empty
+    VERSION = 2
+    
+    def __init__(self, path: Optional[str] = None, max_age_runs: int = 168):
+        self.path = path
+        self.max_age_runs = max_age_runs
+        self.hits = 0
+        self.misses = 0
+        self._run = 0
+        self._entries = {}  # key -> (normalized geometry, wkt, simplified geometries, last run used)
+        self._lock = threading.Lock()
+        self._used = None  # keys hit since the last take_delta(), when tracking
+        self._new = None  # keys computed since the last take_delta(), when tracking
+    
+    @staticmethod
+    def key(geometry: Dict[str, Any]) -> bytes:
+        """Hash of the source geometry"""
+        encoded = json.dumps(geometry, separators=(",", ":")).encode("utf-8")
+        return hashlib.blake2b(encoded, digest_size=16).digest()
+    
+    def normalize(self, geometry: Dict[str, Any]):
+        """
+        Return (normalized LineString geometry, WKT, simplified geometries) for a GeoJSON geometry,
+        computing them on a miss. The returned geometries are shared between calls and must not be modified.
+        """
+        key = self.key(geometry)
+        entry = self._entries.get(key)
+        if entry is not None:
+            normalized, wkt, simplified, _ = entry
+            self._entries[key] = (normalized, wkt, simplified, self._run)
+            with self._lock:
+                self.hits += 1
+                if self._used is not None:
+                    self._used.add(key)
+            return normalized, wkt, simplified
+        
+        normalized = normalize_to_linestring(geometry)
+        wkt = linestring_to_wkt(normalized)
+        simplified = simplify_linestring(normalized)
+        self._entries[key] = (normalized, wkt, simplified, self._run)
+        with self._lock:
+            self.misses += 1
+            if self._new is not None:
+                self._new.add(key)
+        return normalized, wkt, simplified
+    
+    def track(self) -> None:
+        """Start recording the keys hit and computed, and count from zero (process-pool workers)"""
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self._used = set()
+            self._new = set()
+    
+    def take_delta(self) -> Dict[str, Any]:
+        """Counters, keys hit and entries computed since track() or the last call, for merge() in the parent"""
+        with self._lock:
+            delta = {
+                "hits": self.hits,
+                "misses": self.misses,
+                "used": list(self._used),
+                "entries": {key: self._entries[key][:3] for key in self._new},
+            }
+            self.hits = 0
+            self.misses = 0
+            self._used = set()
+            self._new = set()
+        return delta
+    
+    def merge(self, delta: Dict[str, Any]) -> None:
+        """Fold a worker's take_delta() into this cache, marking its entries as used in this run"""
+        with self._lock:
+            self.hits += delta["hits"]
+            self.misses += delta["misses"]
+            for key, entry in delta["entries"].items():
+                self._entries[key] = (*entry, self._run)
+            for key in delta["used"]:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries[key] = (*entry[:3], self._run)
+    
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        ratio = self.hits / total * 100 if total else 0.0
+        return f"{self.hits} hit(s), {self.misses} miss(es) ({ratio:.1f}% hit rate), {len(self._entries)} entries"
+    
+    @classmethod
+    def load(cls, path: str, max_age_runs: int = 168) -> "GeometryCache":
+        """Load the cache from disk, or start an empty one if the file is missing or unreadable"""
+        cache = cls(path, max_age_runs)
+        try:
+            with open(path, "rb") as f:
+                data = pickle.load(f)
+            if data.get("version") == cls.VERSION:
+                cache._run = data["run"] + 1
+                cache._entries = data["entries"]
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Warning: Could not read geometry cache {path}, starting empty: {str(e)}")
+        return cache
+    
+    def save(self) -> None:
+        """Write the cache to disk, dropping entries unused for more than max_age_runs runs"""
+        if not self.path:
+            return
+        oldest = self._run - self.max_age_runs
+        entries = {key: entry for key, entry in self._entries.items() if entry[3] >= oldest}
+        tmp_path = self.path + ".part"
+        with open(tmp_path, "wb") as f:
+            pickle.dump({"version": self.VERSION, "run": self._run, "entries": entries}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+
+
+def normalize_geometry(geometry: Dict[str, Any]):
+    """
+    Normalize a geometry to a LineString, convert it to WKT and simplify it for low zooms,
+    through the geometry cache when enabled.
+    
+    Returns:
+        Tuple of (normalized GeoJSON geometry or None, WKT string or None, simplify_linestring() mapping)
+    """
+    if geometry_cache is not None:
+        return geometry_cache.normalize(geometry)
     normalized = normalize_to_linestring(geometry)
+    return normalized, linestring_to_wkt(normalized), simplify_linestring(normalized)
+
+
+class KnownStreets:
+    """
+    In-memory set of the cote_rue_ids present in the streets table.
+    Ids loaded at startup are kept in a sorted int64 array (8 bytes per street side, looked up
+    with bisect); streets inserted during the run are added to a small set.
+    """
     
-    if not normalized:
-        return None
+    def __init__(self, cote_rue_ids=()):
+        self._ids = array("q", sorted(cote_rue_ids))
+        self._added = set()
+        self._lock = threading.Lock()
     
-    coordinates = normalized.get("coordinates")
-    if not coordinates:
-        return None
+    def __contains__(self, cote_rue_id) -> bool:
+        ids = self._ids
+        i = bisect.bisect_left(ids, cote_rue_id)
+        if i < len(ids) and ids[i] == cote_rue_id:
+            return True
+        return cote_rue_id in self._added
     
-    return LineString(coordinates).wkt
+    def __len__(self) -> int:
+        return len(self._ids) + len(self._added)
+    
+    def add(self, cote_rue_id: int) -> None:
+        """Record a street written during the run"""
+        if cote_rue_id not in self:
+            with self._lock:
+                self._added.add(cote_rue_id)
+    
+    @classmethod
+    def load(cls, db_conn=None, local_supabase=None, page_size: int = 1000) -> "KnownStreets":
+        """
+        Load every cote_rue_id of the streets table, with one query on the psycopg2 path
+        or page by page through the Supabase client.
+        """
+        if db_conn:
+            with db_conn.cursor() as cur:
+                cur.execute("SELECT cote_rue_id FROM streets")
+                return cls(row[0] for row in cur.fetchall())
+        
+        client = local_supabase or get_supabase_client()
+        if client is None:
+            raise RuntimeError("No database connection or Supabase client to load streets from")
+        cote_rue_ids = []
+        while True:
+            res = client.table("streets") \
+                .select("cote_rue_id") \
+                .order("cote_rue_id") \
+                .range(len(cote_rue_ids), len(cote_rue_ids) + page_size - 1) \
+                .execute()
+            cote_rue_ids.extend(row["cote_rue_id"] for row in res.data or [])
+            if len(res.data or []) < page_size:
+                return cls(cote_rue_ids)
 
 
 def convert_datetime_to_string(obj):
@@ -138,23 +401,58 @@ def convert_datetime_to_string(obj):
 class PlanifNeigeClient:
     """Client class for the PlanifNeige API"""
     
-    def __init__(self, token: str, url: str = None):
-        self.transport = zeep.Transport()
-        self.transport.session.headers['User-Agent'] = (
-            "planif-neige-client https://github.com/poboisvert"
-        )
+    def __init__(self, token: str, url: str = None, raw: bool = False,
+                 cache_path: Optional[str] = WSDL_CACHE_PATH, cache_ttl: int = WSDL_CACHE_TTL):
+        self.cache_path = cache_path
+        self.cache_ttl = cache_ttl
+        self.transport = self._make_transport(cache_ttl)
         
         if url is None:
             url = DEFAULT_URL
         self.wsdl = url
-        self.client = zeep.Client(wsdl=self.wsdl, transport=self.transport)
+        self.raw = raw
+        self._client = None
         self.token = token
     
+    def _make_transport(self, ttl: Optional[int], session=None):
+        """Build a transport with the WSDL cache when enabled (ttl None = never expire), reusing session if given"""
+        cache = None
+        if self.cache_path:
+            cache_dir = os.path.dirname(self.cache_path)
+            if cache_dir:
+                pathlib.Path(cache_dir).mkdir(parents=True, exist_ok=True)
+            cache = SqliteCache(path=self.cache_path, timeout=ttl)
+        transport = zeep.Transport(cache=cache, session=session)
+        transport.session.headers['User-Agent'] = (
+            "planif-neige-client https://github.com/poboisvert"
+        )
+        return transport
+    
+    @property
+    def client(self):
+        """
+        zeep client, built on first use and then reused for every call.
+        Raw mode never needs it, so it does not fetch the WSDL at all.
+        """
+        if self._client is None:
+            try:
+                self._client = zeep.Client(wsdl=self.wsdl, transport=self.transport)
+            except Exception as e:
+                if not self.cache_path:
+                    raise
+                # WSDL endpoint unreachable and the cached copy expired: fall back to the stale copy
+                print(f"Warning: Could not fetch WSDL ({str(e)}), using the cached copy regardless of its age")
+                self.transport = self._make_transport(None, session=self.transport.session)
+                self._client = zeep.Client(wsdl=self.wsdl, transport=self.transport)
+        return self._client
+    
     def get_planification_for_date(self, from_date: str = None):
         """Get planification data from API for all streets since a specified date"""
         if from_date is None:
             raise ValueError("from_date parameter is required")
         print('from_date', from_date)
+        if self.raw:
+            return self.get_planification_for_date_raw(from_date)
         request = {'fromDate': str(from_date), 'tokenString': self.token}
         response = self.client.service.GetPlanificationsForDate(request)
         result = zeep.helpers.serialize_object(response)
@@ -174,20 +472,14 @@ class PlanifNeigeClient:
         planification_list = convert_datetime_to_string(planification_list)
         
         return planification_list, result
-
-
-def get_etat_deneig_status(etat: int) -> str:
-    """Convert etatDeneig number to human-readable status string"""
-    status_map = {
-        0: "Enneigé",
-        1: "Déneigé",
-        2: "Planifié",
-        3: "Replanifié",
-        4: "Sera replanifié ultérieurement",
-        5: "Chargement en cours",
-        10: "Dégagé (entre 2 chargements de neige)"
-    }
-    return status_map.get(etat, f"État inconnu ({etat})")
+    
+    def get_planification_for_date_raw(self, from_date: str):
+        """
+        Same as get_planification_for_date, but posts the SOAP envelope directly and
+        stream-parses the <planification> elements instead of building zeep objects,
+        serializing them and walking them again to convert the dates.
+        """
+        return planif_raw.fetch_planifications(self.transport.session, self.wsdl, from_date, self.token)
 
 
 def get_supabase_client():
@@ -223,7 +515,10 @@ def return_db_connection(conn):
 
 
 def street_exists(cote_rue_id: int, db_conn=None, local_supabase=None) -> bool:
-    """Check if a street exists in the streets table"""
+    """Check if a street exists in the streets table (in memory once known_streets is loaded)"""
+    if known_streets is not None:
+        return cote_rue_id in known_streets
+    
     if db_conn:
         try:
             with db_conn.cursor() as cur:
@@ -266,36 +561,232 @@ def get_current_state(cote_rue_id: int, local_supabase=None) -> Optional[Dict[st
         return None
 
 
-def insert_event(cote_rue_id: int, old: Optional[Dict[str, Any]], new: Dict[str, Any], local_supabase=None):
-    """Insert an event into deneigement_events table when state changes"""
+def get_current_states(cote_rue_ids: List[int], db_conn=None, local_supabase=None, chunk_size: int = 200) -> Dict[int, Dict[str, Any]]:
+    """
+    Load the current state of many street sides at once from deneigement_current.
+    Uses a single `cote_rue_id = ANY(...)` query on the psycopg2 path, or chunked
+    `in_` filters through the Supabase client.
+    
+    Args:
+        cote_rue_ids: Street side ids to look up
+        db_conn: Optional psycopg2 connection
+        local_supabase: Optional thread-local Supabase client
+        chunk_size: Number of ids per PostgREST request (keeps the URL short)
+    
+    Returns:
+        Mapping of cote_rue_id to its current {etat_deneig, status, date_maj}; ids without a row are absent
+    """
+    ids = sorted({cote_rue_id for cote_rue_id in cote_rue_ids if cote_rue_id})
+    states = {}
+    if not ids:
+        return states
+    
+    if db_conn:
+        try:
+            with db_conn.cursor() as cur:
+                cur.execute(
+                    "SELECT cote_rue_id, etat_deneig, status, date_maj FROM deneigement_current WHERE cote_rue_id = ANY(%s)",
+                    (ids,)
+                )
+                for cote_rue_id, etat_deneig, status, date_maj in cur.fetchall():
+                    states[cote_rue_id] = {"etat_deneig": etat_deneig, "status": status, "date_maj": date_maj}
+            return states
+        except Exception as e:
+            db_conn.rollback()
+            print(f"Warning: Could not load current states from database, falling back to Supabase client: {str(e)}")
+    
     client = local_supabase or get_supabase_client()
     if client is None:
-        return
+        return states
+    
+    for i in range(0, len(ids), chunk_size):
+        chunk = ids[i:i + chunk_size]
+        res = client.table("deneigement_current") \
+            .select("cote_rue_id, etat_deneig, status, date_maj") \
+            .in_("cote_rue_id", chunk) \
+            .execute()
+        for row in res.data or []:
+            states[row["cote_rue_id"]] = {
+                "etat_deneig": row.get("etat_deneig"),
+                "status": row.get("status"),
+                "date_maj": row.get("date_maj")
+            }
+    return states
+
+
+def feature_hash(feature: Dict[str, Any], slim: Optional[bool] = None) -> str:
+    """
+    Content hash of a gbdouble feature, stored in streets.feature_hash to skip unchanged rewrites.
+    Slim rows hash differently (and per precision), so switching SLIM_STREET_FEATURES rewrites every street once.
+    """
+    encoded = json.dumps(feature, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    digest = hashlib.blake2b(encoded, digest_size=16)
+    if slim is None:
+        slim = SLIM_STREET_FEATURES
+    if slim:
+        digest.update(f"slim:{geometry_encoding.COORDINATE_PRECISION}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def get_previous_bounds(cote_rue_ids: List[int], db_conn=None) -> List[Tuple[float, float, float, float]]:
+    """
+    Bounds of the stored geometry of streets about to be rewritten, so the tiles they were drawn in
+    can be invalidated too (see publish_tile_invalidations). Empty without a database connection.
+    """
+    if not db_conn or not cote_rue_ids:
+        return []
+    try:
+        with db_conn.cursor() as cur:
+            bounds = dirty_tiles.get_street_bounds(cur, list(cote_rue_ids))
+        db_conn.commit()
+        return bounds
+    except Exception as e:
+        db_conn.rollback()
+        print(f"Warning: Could not load street bounds, their previous tiles will not be invalidated: {str(e)}")
+        return []
+
+
+def get_street_hashes(cote_rue_ids: List[int], db_conn=None, local_supabase=None, chunk_size: int = 200) -> Dict[int, Optional[str]]:
+    """
+    Load streets.feature_hash for many street sides at once.
+    
+    Args:
+        cote_rue_ids: Street side ids to look up
+        db_conn: Optional psycopg2 connection
+        local_supabase: Optional thread-local Supabase client
+        chunk_size: Number of ids per PostgREST request
+    
+    Returns:
+        Mapping of cote_rue_id to its stored feature hash; ids without a street row are absent
+    """
+    ids = sorted({cote_rue_id for cote_rue_id in cote_rue_ids if cote_rue_id})
+    hashes = {}
+    if not ids:
+        return hashes
+    
+    if db_conn:
+        try:
+            with db_conn.cursor() as cur:
+                cur.execute("SELECT cote_rue_id, feature_hash FROM streets WHERE cote_rue_id = ANY(%s)", (ids,))
+                hashes.update(cur.fetchall())
+            return hashes
+        except Exception as e:
+            db_conn.rollback()
+            print(f"Warning: Could not load street hashes from database, falling back to Supabase client: {str(e)}")
+    
+    client = local_supabase or get_supabase_client()
+    if client is None:
+        return hashes
+    
+    for i in range(0, len(ids), chunk_size):
+        chunk = ids[i:i + chunk_size]
+        res = client.table("streets") \
+            .select("cote_rue_id, feature_hash") \
+            .in_("cote_rue_id", chunk) \
+            .execute()
+        for row in res.data or []:
+            hashes[row["cote_rue_id"]] = row.get("feature_hash")
+    return hashes
+
+
+def build_event(cote_rue_id: int, old: Optional[Dict[str, Any]], new: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Build a deneigement_events row if the state changed.
     
-    event = {
+    Args:
+        cote_rue_id: Street side id
+        old: Current state ({etat_deneig, status}) or None if the street side has no state yet
+        new: Planification item from the API
+    
+    Returns:
+        Event dictionary, or None if etat_deneig did not change
+    """
+    has_changed = (
+        old is None or
+        old.get("etat_deneig") != new.get("etatDeneig")
+    )
+    if not has_changed:
+        return None
+    
+    return {
         "cote_rue_id": cote_rue_id,
         "old_etat": old["etat_deneig"] if old else None,
-        "new_etat": new["etatDeneig"],
+        "new_etat": new.get("etatDeneig"),
         "old_status": old["status"] if old else None,
-        "new_status": new["status"],
-        "event_date": new["dateMaj"]
+        "new_status": new.get("status"),
+        "event_date": new.get("dateMaj")
     }
+
+
+def build_current_record(item: Dict[str, Any]) -> Dict[str, Any]:
+    """Build a deneigement_current row from a planification item, without None values"""
+    record = {column: item.get(field) for column, field in CURRENT_FIELDS.items()}
+    return {k: v for k, v in record.items() if v is not None}
+
+
+def is_writable_state(etat_deneig, date_maj) -> bool:
+    """True if a planification has the fields stored in NOT NULL columns (etat_deneig and date_maj / event_date)"""
+    return etat_deneig is not None and bool(date_maj)
+
+
+def detect_changes(items: List[Dict[str, Any]], current_states: Dict[int, Dict[str, Any]]):
+    """
+    Detect state changes in memory for a list of planification items.
+    Items are walked in order against a running copy of the current states, so a
+    street side listed twice is compared with its previous item, not the stored state.
+    
+    Args:
+        items: Planification items (with 'status' already set)
+        current_states: Mapping returned by get_current_states()
+    
+    Returns:
+        Tuple of (events, records): deneigement_events rows to insert and
+        deneigement_current rows to upsert, both in item order
+    """
+    states = dict(current_states)
+    events = []
+    records = []
+    
+    for item in items:
+        cote_rue_id = item.get("coteRueId")
+        if not cote_rue_id:
+            continue
+        
+        event = build_event(cote_rue_id, states.get(cote_rue_id), item)
+        if event:
+            events.append(event)
+        records.append(build_current_record(item))
+        states[cote_rue_id] = {
+            "etat_deneig": item.get("etatDeneig"),
+            "status": item.get("status"),
+            "date_maj": item.get("dateMaj")
+        }
+    
+    return events, records
+
+
+def insert_event(event: Dict[str, Any], local_supabase=None) -> bool:
+    """Insert an event built by build_event() into deneigement_events table"""
+    client = local_supabase or get_supabase_client()
+    if client is None:
+        return False
     
     try:
         client.table("deneigement_events").insert(event).execute()
+        return True
     except Exception as e:
-        print(f"Error inserting event for cote_rue_id {cote_rue_id}: {str(e)}")
+        print(f"Error inserting event for cote_rue_id {event['cote_rue_id']}: {str(e)}")
+        return False
 
 
-def upsert_current(item: Dict[str, Any], db_conn=None, local_supabase=None, gbdouble_mapping: Dict[int, Dict[str, Any]] = None):
-    """Upsert current state and track events when state changes"""
-    client = local_supabase or get_supabase_client()
-    if client is None:
-        return
+def ensure_street(cote_rue_id: int, db_conn=None, local_supabase=None, gbdouble_mapping: Dict[int, Dict[str, Any]] = None) -> bool:
+    """
+    Make sure a street exists before writing rows that reference it.
     
-    cote_rue_id = item.get("coteRueId")
-    if not cote_rue_id:
-        return
+    Returns:
+        False if the street does not exist and could not be created from gbdouble_mapping
+    """
+    client = local_supabase or get_supabase_client()
     
     # Check if street exists, if not try to create it
     if not street_exists(cote_rue_id, db_conn=db_conn, local_supabase=client):
@@ -314,35 +805,20 @@ def upsert_current(item: Dict[str, Any], db_conn=None, local_supabase=None, gbdo
             # Check one more time if it exists (maybe it was just created)
             if not street_exists(cote_rue_id, db_conn=db_conn, local_supabase=client):
                 print(f"✗ Skipping deneigement_current insert for cote_rue_id {cote_rue_id}: street does not exist")
-                return
-    
-    current = get_current_state(cote_rue_id, local_supabase=client)
-    
-    # Check if state has changed
-    has_changed = (
-        current is None or
-        current.get("etat_deneig") != item.get("etatDeneig") 
-    )
-    
-    if has_changed:
-        insert_event(cote_rue_id, current, item, local_supabase=client)
-    
-    record = {
-        "cote_rue_id": cote_rue_id,
-        "etat_deneig": item.get("etatDeneig"),
-        "status": item.get("status"),
-        "date_debut_planif": item.get("dateDebutPlanif"),
-        "date_fin_planif": item.get("dateFinPlanif"),
-        "date_debut_replanif": item.get("dateDebutReplanif"),
-        "date_fin_replanif": item.get("dateFinReplanif"),
-        "date_maj": item.get("dateMaj")
-    }
-    
-    # Remove None values
-    record = {k: v for k, v in record.items() if v is not None}
+                return False
+    return True
+
+
+def write_current(record: Dict[str, Any], db_conn=None, local_supabase=None, gbdouble_mapping: Dict[int, Dict[str, Any]] = None) -> bool:
+    """Upsert a deneigement_current row, inserting the street and retrying on a foreign key violation"""
+    client = local_supabase or get_supabase_client()
+    if client is None:
+        return False
     
+    cote_rue_id = record["cote_rue_id"]
     try:
         client.table("deneigement_current").upsert(record, on_conflict="cote_rue_id").execute()
+        return True
     except Exception as e:
         error_str = str(e)
         # Check if it's a foreign key constraint violation
@@ -358,6 +834,7 @@ def upsert_current(item: Dict[str, Any], db_conn=None, local_supabase=None, gbdo
                     try:
                         client.table("deneigement_current").upsert(record, on_conflict="cote_rue_id").execute()
                         print(f"  ✓ Successfully upserted deneigement_current after inserting street")
+                        return True
                     except Exception as e2:
                         print(f"  ✗ Still failed after inserting street: {str(e2)}")
                 else:
@@ -366,23 +843,71 @@ def upsert_current(item: Dict[str, Any], db_conn=None, local_supabase=None, gbdo
                 print(f"  ✗ Street {cote_rue_id} not found in gbdouble mapping, cannot create it")
         else:
             print(f"Error upserting current state for cote_rue_id {cote_rue_id}: {error_str}")
+        return False
+
+
+def upsert_current(item: Dict[str, Any], db_conn=None, local_supabase=None, gbdouble_mapping: Dict[int, Dict[str, Any]] = None):
+    """Upsert current state and track events when state changes"""
+    client = local_supabase or get_supabase_client()
+    if client is None:
+        return
+    
+    cote_rue_id = item.get("coteRueId")
+    if not cote_rue_id:
+        return
+    
+    if not ensure_street(cote_rue_id, db_conn=db_conn, local_supabase=client, gbdouble_mapping=gbdouble_mapping):
+        return
+    
+    current = get_current_state(cote_rue_id, local_supabase=client)
+    events, records = detect_changes([item], {cote_rue_id: current} if current else {})
+    
+    for event in events:
+        insert_event(event, local_supabase=client)
+    for record in records:
+        write_current(record, db_conn=db_conn, local_supabase=client, gbdouble_mapping=gbdouble_mapping)
 
 
-def ingest(api_response: list, gbdouble_mapping: Dict[int, Dict[str, Any]] = None, db_conn=None, local_supabase=None):
+def ingest(api_response: list, gbdouble_mapping: Dict[int, Dict[str, Any]] = None, db_conn=None, local_supabase=None,
+           prepared_streets: Optional[Dict[int, Dict[str, Any]]] = None):
     """
     Process API response and upsert both streets and current states.
+    The current state of every street side in the batch is loaded with one query
+    and state changes are detected in memory before anything is written.
     
     Args:
         api_response: List of planification items from the API
         gbdouble_mapping: Optional mapping of cote_rue_id to GeoJSON features
         db_conn: Optional database connection for PostGIS support
         local_supabase: Optional thread-local Supabase client
+        prepared_streets: Optional streets already prepared by prepare_batch_streets(), by cote_rue_id
+    
+    Returns:
+        Summary dictionary; 'rows_failed' counts the street sides whose street or current state
+        could not be written, 'failed_date_maj' is the earliest dateMaj among them (see cap_watermark),
+        'street_ids' and 'street_bounds' are the rewritten streets and their bounds before the rewrite
     """
     upserted_streets_count = 0
     skipped_streets_count = 0
+    unchanged_streets_count = 0
     upserted_current_count = 0
+    unchanged_current_count = 0
+    changed_ids = []
+    street_ids = []
+    street_bounds = []
+    failed_ids = set()
     # https://donnees.montreal.ca/dataset/geobase-double/resource/16f7fa0a-9ce6-4b29-a7fc-00842c593927
     
+    cote_rue_ids = list(dict.fromkeys(item.get('coteRueId') for item in api_response if item.get('coteRueId')))
+    
+    # Streets whose stored feature hash matches the geobase feature are not rewritten
+    street_hashes = {}
+    if gbdouble_mapping is not None or prepared_streets is not None:
+        try:
+            street_hashes = get_street_hashes(cote_rue_ids, db_conn=db_conn, local_supabase=local_supabase)
+        except Exception as e:
+            print(f"Warning: Could not load street hashes for batch, every street will be upserted: {str(e)}")
+    
     for item in api_response:
         cote_rue_id = item.get('coteRueId')
         
@@ -391,71 +916,826 @@ def ingest(api_response: list, gbdouble_mapping: Dict[int, Dict[str, Any]] = Non
         item['status'] = get_etat_deneig_status(etat_deneig) if etat_deneig is not None else "État inconnu"
         
         # Upsert street feature if available
-        if cote_rue_id and gbdouble_mapping and cote_rue_id in gbdouble_mapping:
+        if cote_rue_id and prepared_streets is not None and cote_rue_id in prepared_streets:
+            prepared = prepared_streets[cote_rue_id]
+            content_hash = prepared["feature_hash"]
+            if street_hashes.get(cote_rue_id) == content_hash:
+                unchanged_streets_count += 1
+                continue
+            
+            previous_bounds = get_previous_bounds([cote_rue_id], db_conn) if cote_rue_id in street_hashes else []
+            result = upsert_street(prepared["street_feature"], db_conn, local_supabase=local_supabase, prepared=prepared)
+            
+            if result:
+                upserted_streets_count += 1
+                street_hashes[cote_rue_id] = content_hash
+                street_ids.append(cote_rue_id)
+                street_bounds.extend(previous_bounds)
+                print(f"✓ Upserted street: cote_rue_id={cote_rue_id}, status={item['status']}")
+            else:
+                skipped_streets_count += 1
+                failed_ids.add(cote_rue_id)
+                print(f"✗ Failed to upsert street: cote_rue_id={cote_rue_id}")
+        elif cote_rue_id and gbdouble_mapping and cote_rue_id in gbdouble_mapping:
             feature = gbdouble_mapping[cote_rue_id]
+            content_hash = feature_hash(feature)
+            if street_hashes.get(cote_rue_id) == content_hash:
+                unchanged_streets_count += 1
+                continue
+            
+            previous_bounds = get_previous_bounds([cote_rue_id], db_conn) if cote_rue_id in street_hashes else []
             result = upsert_street(feature, db_conn, local_supabase=local_supabase)
             
             if result:
                 upserted_streets_count += 1
+                street_hashes[cote_rue_id] = content_hash
+                street_ids.append(cote_rue_id)
+                street_bounds.extend(previous_bounds)
                 print(f"✓ Upserted street: cote_rue_id={cote_rue_id}, status={item['status']}")
             else:
                 skipped_streets_count += 1
+                failed_ids.add(cote_rue_id)
                 print(f"✗ Failed to upsert street: cote_rue_id={cote_rue_id}")
-        else:
-            if cote_rue_id:
-                skipped_streets_count += 1
-                if gbdouble_mapping is None:
-                    print(f"⚠ Skipped street: No gbdouble mapping available for coteRueId={cote_rue_id}")
-                else:
-                    print(f"⚠ Skipped street: No matching feature for coteRueId={cote_rue_id}")
+        elif cote_rue_id and gbdouble_mapping is not None:
+            # Without a geobase (--skip-streets), streets are managed by sync_geobase.py
+            skipped_streets_count += 1
+            print(f"⚠ Skipped street: No matching feature for coteRueId={cote_rue_id}")
+    
+    if unchanged_streets_count:
+        print(f"Skipped {unchanged_streets_count} unchanged street(s)")
+    
+    # Load current states for the whole batch, then detect changes in memory
+    try:
+        current_states = get_current_states(cote_rue_ids, db_conn=db_conn, local_supabase=local_supabase)
+    except Exception as e:
+        print(f"Warning: Could not load current states for batch, falling back to per-item lookups: {str(e)}")
+        current_states = {}
+        for cote_rue_id in cote_rue_ids:
+            current = get_current_state(cote_rue_id, local_supabase=local_supabase)
+            if current:
+                current_states[cote_rue_id] = current
+    
+    events, records = detect_changes(api_response, current_states)
+    print(f"Detected {len(events)} state change(s) for {len(cote_rue_ids)} street side(s)")
+    
+    # Upsert current state and track events
+    # Ensure street exists first
+    missing_streets = set()
+    for cote_rue_id in cote_rue_ids:
+        if not ensure_street(cote_rue_id, db_conn=db_conn, local_supabase=local_supabase, gbdouble_mapping=gbdouble_mapping):
+            missing_streets.add(cote_rue_id)
+    failed_ids.update(missing_streets)
+    
+    # Rows without etatDeneig or dateMaj would violate NOT NULL constraints on any write path
+    events = [
+        event for event in events
+        if event["cote_rue_id"] not in missing_streets and is_writable_state(event["new_etat"], event["event_date"])
+    ]
+    writable_records = []
+    for record in records:
+        if record["cote_rue_id"] in missing_streets:
+            print(f"⚠ Skipped current state update: street {record['cote_rue_id']} does not exist")
+            continue
+        if not is_writable_state(record.get("etat_deneig"), record.get("date_maj")):
+            print(f"⚠ Skipped current state update: cote_rue_id={record['cote_rue_id']} has no etatDeneig or dateMaj")
+            continue
+        writable_records.append(record)
+    
+    # Events and current states of the batch are committed together
+    try:
+        upserted_current_count, unchanged_current_count, changed_ids = write_batch(
+            events, writable_records, db_conn=db_conn, local_supabase=local_supabase
+        )
+        print(f"✓ Wrote {len(events)} event(s) and {upserted_current_count} changed current state(s) in one transaction, "
+              f"{unchanged_current_count} seen unchanged")
+    except Exception as e:
+        print(f"Warning: Batched write failed, falling back to per-row writes: {str(e)}")
+        for event in events:
+            if not insert_event(event, local_supabase=local_supabase):
+                failed_ids.add(event["cote_rue_id"])
         
-        # Upsert current state and track events
-        # Ensure street exists first (upsert_current will handle this)
-        if cote_rue_id:
+        for record in writable_records:
+            cote_rue_id = record["cote_rue_id"]
             try:
-                upsert_current(item, db_conn=db_conn, local_supabase=local_supabase, gbdouble_mapping=gbdouble_mapping)
+                if not write_current(record, db_conn=db_conn, local_supabase=local_supabase, gbdouble_mapping=gbdouble_mapping):
+                    failed_ids.add(cote_rue_id)
                 # Check if street exists before counting as success
-                if street_exists(cote_rue_id, db_conn=db_conn, local_supabase=local_supabase):
+                elif street_exists(cote_rue_id, db_conn=db_conn, local_supabase=local_supabase):
                     upserted_current_count += 1
-                    print(f"✓ Updated current state: cote_rue_id={cote_rue_id}, status={item['status']}")
+                    changed_ids.append(cote_rue_id)
+                    print(f"✓ Updated current state: cote_rue_id={cote_rue_id}, status={record['status']}")
                 else:
+                    failed_ids.add(cote_rue_id)
                     print(f"⚠ Skipped current state update: street {cote_rue_id} does not exist")
             except Exception as e:
+                failed_ids.add(cote_rue_id)
                 print(f"✗ Failed to upsert current state for cote_rue_id={cote_rue_id}: {str(e)}")
     
     return {
         "total": len(api_response),
         "streets_upserted": upserted_streets_count,
         "streets_skipped": skipped_streets_count,
-        "current_upserted": upserted_current_count
+        "streets_unchanged": unchanged_streets_count,
+        "current_upserted": upserted_current_count,
+        "current_unchanged": unchanged_current_count,
+        "changed_ids": changed_ids,
+        "street_ids": street_ids,
+        "street_bounds": street_bounds,
+        "rows_failed": len(failed_ids),
+        "failed_date_maj": earliest_date_maj(api_response, failed_ids)
     }
 
 
-def upsert_street(feature: Dict[str, Any], db_conn=None, local_supabase=None) -> Optional[Dict[str, Any]]:
+def copy_rows(cur, table: str, columns: List[str], rows) -> int:
     """
-    Upsert a street feature into the Supabase streets table.
-    
+    Stream rows into a table with COPY ... FROM STDIN (CSV format).
+    None values are written as empty unquoted fields, which COPY reads as NULL.
+
     Args:
-        feature: GeoJSON feature object with properties and geometry
-        db_conn: Optional psycopg2 connection for direct database access
-        local_supabase: Optional thread-local Supabase client
-    
+        cur: psycopg2 cursor
+        table: Target table name
+        columns: Column names, in the order of each row
+        rows: Iterable of row tuples
+
     Returns:
-        True if successful, False otherwise
+        Number of rows copied
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    buffer.seek(0)
+    cur.copy_expert(
+        f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+        buffer
+    )
+    return count
+
+
+def write_batch(events: List[Dict[str, Any]], records: List[Dict[str, Any]], db_conn=None,
+                local_supabase=None) -> Tuple[int, int, Optional[List[int]]]:
+    """
+    Write the events and current states of a batch in one transaction: COPY plus one
+    multi-row upsert on the psycopg2 path, or the apply_deneigement_batch() function
+    through the Supabase client. Either everything is written or nothing is.
+    
+    Args:
+        events: deneigement_events rows built by build_event(); events without new_etat or
+            event_date are skipped, like their records
+        records: deneigement_current rows built by build_current_record(); for a street side
+            listed more than once the last record wins, records without etat_deneig or
+            date_maj (NOT NULL columns) are skipped
+        db_conn: Optional psycopg2 connection
+        local_supabase: Optional thread-local Supabase client
+    
+    Only rows whose fields changed are rewritten; the other street sides seen in the batch
+    only get their last_seen_at touched, with one UPDATE.
+    
+    Returns:
+        Tuple of (deneigement_current rows written, rows seen unchanged, ids of the written rows);
+        the ids are None through apply_deneigement_batch(), which only returns counts
     """
+    events = [event for event in events if is_writable_state(event["new_etat"], event["event_date"])]
+    latest = {
+        record["cote_rue_id"]: record
+        for record in records
+        if is_writable_state(record.get("etat_deneig"), record.get("date_maj"))
+    }
+    
+    if db_conn:
+        try:
+            with db_conn.cursor() as cur:
+                if events:
+                    copy_rows(cur, "deneigement_events", EVENT_COLUMNS,
+                              (tuple(event[column] for column in EVENT_COLUMNS) for event in events))
+                changed_ids = []
+                touched = 0
+                if latest:
+                    # NULL planif dates keep the stored value, like the PostgREST upsert that drops None fields
+                    changed_rows = execute_values(cur, """
+                        INSERT INTO deneigement_current (
+                            cote_rue_id, etat_deneig, status,
+                            date_debut_planif, date_fin_planif, date_debut_replanif, date_fin_replanif,
+                            date_maj, last_seen_at
+                        ) VALUES %s
+                        ON CONFLICT (cote_rue_id) DO UPDATE SET
+                            etat_deneig = EXCLUDED.etat_deneig,
+                            status = EXCLUDED.status,
+                            date_debut_planif = COALESCE(EXCLUDED.date_debut_planif, deneigement_current.date_debut_planif),
+                            date_fin_planif = COALESCE(EXCLUDED.date_fin_planif, deneigement_current.date_fin_planif),
+                            date_debut_replanif = COALESCE(EXCLUDED.date_debut_replanif, deneigement_current.date_debut_replanif),
+                            date_fin_replanif = COALESCE(EXCLUDED.date_fin_replanif, deneigement_current.date_fin_replanif),
+                            date_maj = EXCLUDED.date_maj,
+                            last_seen_at = now()
+                        WHERE """ + CURRENT_CHANGED_SQL + """
+                        RETURNING cote_rue_id
+                    """,
+                        [tuple(record.get(column) for column in CURRENT_COLUMNS) for record in latest.values()],
+                        template="(%s, %s, %s, %s, %s, %s, %s, %s, now())",
+                        page_size=len(latest),
+                        fetch=True
+                    )
+                    changed_ids = [row[0] for row in changed_rows]
+                    unchanged = list(set(latest) - set(changed_ids))
+                    if unchanged:
+                        cur.execute(
+                            "UPDATE deneigement_current SET last_seen_at = now() WHERE cote_rue_id = ANY(%s)",
+                            (unchanged,)
+                        )
+                        touched = cur.rowcount
+            db_conn.commit()
+            return len(changed_ids), touched, changed_ids
+        except Exception:
+            db_conn.rollback()
+            raise
+    
     client = local_supabase or get_supabase_client()
-    if client is None and db_conn is None:
-        return None
+    if client is None:
+        return 0, 0, None
+    res = client.rpc("apply_deneigement_batch", {"events": events, "currents": list(latest.values())}).execute()
+    # Before 20251222_apply_deneigement_batch_change_only the function returned a plain count
+    if isinstance(res.data, int):
+        return res.data, 0, None
+    row = res.data[0] if res.data else {}
+    return row.get("written", 0), row.get("touched", 0), None
+
+
+def has_linestring(prepared: Dict[str, Any]) -> bool:
+    """
+    True if a prepare_street() result has a non-empty LineString geometry. Others (empty or missing
+    coordinates in the geobase) would fail the NOT NULL geography(LineString) column of a staged upsert.
+    """
+    geometry = prepared.get("geometry")
+    return bool(geometry) and geometry.get("type") == "LineString" and len(geometry.get("coordinates") or []) >= 2
+
+
+def street_row(prepared: Dict[str, Any]) -> tuple:
+    """Row of STREET_STAGING_COLUMNS for a prepare_street() result"""
+    return (
+        *(prepared[column] for column in STREET_COLUMNS),
+        prepared["feature_hash"],
+        json.dumps(prepared["geometry"]),
+        json.dumps(prepared["street_feature"]),
+        *(json.dumps(prepared["simplified"][column]) if prepared["simplified"][column] else None
+          for column in SIMPLIFIED_COLUMNS),
+    )
+
+
+# Columns of the staging_streets temp table, in street_row() order
+STREET_STAGING_COLUMNS = STREET_COLUMNS + ["feature_hash", "geometry", "street_feature"] + SIMPLIFIED_COLUMNS
+
+
+def bulk_upsert_streets(cur, street_rows) -> Tuple[List[int], int, List[Tuple[float, float, float, float]]]:
+    """
+    COPY street rows into a staging table and upsert them into streets with one statement.
+    Runs in the caller's transaction; streets whose stored feature_hash matches are left untouched.
+    
+    Args:
+        cur: psycopg2 cursor
+        street_rows: Rows built by street_row()
     
+    Returns:
+        Tuple of (cote_rue_ids written, streets unchanged, bounds of the rewritten streets before the upsert)
+    """
+    cur.execute("""
+        CREATE TEMP TABLE staging_streets (
+            cote_rue_id bigint,
+            id_trc bigint,
+            id_voie bigint,
+            nom_voie text,
+            nom_ville text,
+            debut_adresse int,
+            fin_adresse int,
+            cote text,
+            type_f text,
+            sens_cir int,
+            feature_hash text,
+            geometry text,
+            street_feature jsonb,
+            geometry_z11 text,
+            geometry_z13 text,
+            geometry_z15 text
+        ) ON COMMIT DROP
+    """)
+    copy_rows(cur, "staging_streets", STREET_STAGING_COLUMNS, street_rows)
+    
+    # Tiles the previous geometry was drawn in must be invalidated along with the new ones
+    cur.execute("""
+        SELECT ST_XMin(g), ST_YMin(g), ST_XMax(g), ST_YMax(g)
+        FROM (
+            SELECT s.geometry::geometry AS g
+            FROM streets s
+            WHERE s.geometry IS NOT NULL AND EXISTS (
+                SELECT 1 FROM staging_streets st
+                WHERE st.cote_rue_id = s.cote_rue_id AND st.feature_hash IS DISTINCT FROM s.feature_hash
+            )
+        ) previous
+    """)
+    previous_bounds = cur.fetchall()
+    
+    cur.execute("""
+        INSERT INTO streets (
+            cote_rue_id, id_trc, id_voie, nom_voie, nom_ville,
+            debut_adresse, fin_adresse, cote, type_f, sens_cir,
+            geometry, street_feature, feature_hash,
+            geometry_z11, geometry_z13, geometry_z15, updated_at
+        )
+        SELECT DISTINCT ON (cote_rue_id)
+            cote_rue_id, id_trc, id_voie, nom_voie, nom_ville,
+            debut_adresse, fin_adresse, cote, type_f, sens_cir,
+            ST_GeomFromGeoJSON(geometry)::geography, street_feature, feature_hash,
+            ST_GeomFromGeoJSON(geometry_z11)::geography,
+            ST_GeomFromGeoJSON(geometry_z13)::geography,
+            ST_GeomFromGeoJSON(geometry_z15)::geography,
+            now()
+        FROM staging_streets
+        ORDER BY cote_rue_id
+        ON CONFLICT (cote_rue_id) DO UPDATE SET
+            id_trc = EXCLUDED.id_trc,
+            id_voie = EXCLUDED.id_voie,
+            nom_voie = EXCLUDED.nom_voie,
+            nom_ville = EXCLUDED.nom_ville,
+            debut_adresse = EXCLUDED.debut_adresse,
+            fin_adresse = EXCLUDED.fin_adresse,
+            cote = EXCLUDED.cote,
+            type_f = EXCLUDED.type_f,
+            sens_cir = EXCLUDED.sens_cir,
+            geometry = EXCLUDED.geometry,
+            street_feature = EXCLUDED.street_feature,
+            feature_hash = EXCLUDED.feature_hash,
+            geometry_z11 = EXCLUDED.geometry_z11,
+            geometry_z13 = EXCLUDED.geometry_z13,
+            geometry_z15 = EXCLUDED.geometry_z15,
+            updated_at = now()
+        WHERE streets.feature_hash IS DISTINCT FROM EXCLUDED.feature_hash
+        RETURNING cote_rue_id
+    """)
+    street_ids = [row[0] for row in cur.fetchall()]
+    cur.execute("SELECT count(DISTINCT cote_rue_id) FROM staging_streets")
+    return street_ids, cur.fetchone()[0] - len(street_ids), previous_bounds
+
+
+def ingest_bulk(api_response: list, gbdouble_mapping: Dict[int, Dict[str, Any]] = None, db_conn=None, watermark: Optional[str] = None) -> Dict[str, int]:
+    """
+    Process API response with a handful of set-based statements in a single transaction.
+    Planifications and street features are COPY'd into temporary staging tables, then the
+    streets upsert, event detection and deneigement_current upsert each run once for the whole run.
+
+    Args:
+        api_response: List of planification items from the API
+        gbdouble_mapping: Optional mapping of cote_rue_id to GeoJSON features
+        db_conn: psycopg2 connection (required)
+        watermark: Optional new fetch high-water mark, stored in the same transaction as the data
+            (capped at the earliest dateMaj of the street sides skipped for a missing street)
+
+    Returns:
+        Summary dictionary with the same keys as ingest(), plus 'events_inserted' and the 'watermark' stored
+    """
+    if db_conn is None:
+        raise ValueError("ingest_bulk requires a database connection (DATABASE_URL)")
+
+    start = time.monotonic()
+
+    planification_rows = []
+    street_rows = []
+    skipped_streets_count = 0
+    for item in api_response:
+        cote_rue_id = item.get('coteRueId')
+        if not cote_rue_id:
+            continue
+
+        etat_deneig = item.get('etatDeneig')
+        item['status'] = get_etat_deneig_status(etat_deneig) if etat_deneig is not None else "État inconnu"
+        planification_rows.append(tuple(item.get(field) for field in CURRENT_FIELDS.values()))
+
+        # Without a geobase, streets are managed by sync_geobase.py
+        if gbdouble_mapping is None:
+            continue
+        feature = gbdouble_mapping.get(cote_rue_id)
+        prepared = prepare_street(feature) if feature else None
+        # One street without a usable geometry must not roll back the whole run
+        if prepared is None or not has_linestring(prepared):
+            skipped_streets_count += 1
+            continue
+        street_rows.append(street_row(prepared))
+
+    try:
+        with db_conn.cursor() as cur:
+            cur.execute("""
+                CREATE TEMP TABLE staging_planifications (
+                    cote_rue_id bigint,
+                    etat_deneig smallint,
+                    status text,
+                    date_debut_planif timestamptz,
+                    date_fin_planif timestamptz,
+                    date_debut_replanif timestamptz,
+                    date_fin_replanif timestamptz,
+                    date_maj timestamptz
+                ) ON COMMIT DROP
+            """)
+            copy_rows(cur, "staging_planifications", CURRENT_COLUMNS, planification_rows)
+
+            # The same street side can appear more than once in a response: keep the latest update
+            cur.execute("""
+                CREATE TEMP TABLE staging_latest ON COMMIT DROP AS
+                SELECT DISTINCT ON (cote_rue_id) *
+                FROM staging_planifications
+                WHERE etat_deneig IS NOT NULL AND date_maj IS NOT NULL
+                ORDER BY cote_rue_id, date_maj DESC
+            """)
+
+            street_ids, unchanged_streets_count, street_bounds = (
+                bulk_upsert_streets(cur, street_rows) if street_rows else ([], 0, [])
+            )
+            upserted_streets_count = len(street_ids)
+
+            # Events must be detected against the state before the deneigement_current upsert
+            cur.execute("""
+                INSERT INTO deneigement_events (
+                    cote_rue_id, old_etat, new_etat, old_status, new_status, event_date
+                )
+                SELECT p.cote_rue_id, dc.etat_deneig, p.etat_deneig, dc.status, p.status, p.date_maj
+                FROM staging_latest p
+                JOIN streets s ON s.cote_rue_id = p.cote_rue_id
+                LEFT JOIN deneigement_current dc ON dc.cote_rue_id = p.cote_rue_id
+                WHERE dc.cote_rue_id IS NULL OR dc.etat_deneig IS DISTINCT FROM p.etat_deneig
+            """)
+            events_count = cur.rowcount
+
+            # NULL planif dates keep the stored value, like the PostgREST upsert that drops None fields
+            cur.execute("""
+                INSERT INTO deneigement_current (
+                    cote_rue_id, etat_deneig, status,
+                    date_debut_planif, date_fin_planif, date_debut_replanif, date_fin_replanif,
+                    date_maj, last_seen_at
+                )
+                SELECT
+                    p.cote_rue_id, p.etat_deneig, p.status,
+                    p.date_debut_planif, p.date_fin_planif, p.date_debut_replanif, p.date_fin_replanif,
+                    p.date_maj, now()
+                FROM staging_latest p
+                JOIN streets s ON s.cote_rue_id = p.cote_rue_id
+                ON CONFLICT (cote_rue_id) DO UPDATE SET
+                    etat_deneig = EXCLUDED.etat_deneig,
+                    status = EXCLUDED.status,
+                    date_debut_planif = COALESCE(EXCLUDED.date_debut_planif, deneigement_current.date_debut_planif),
+                    date_fin_planif = COALESCE(EXCLUDED.date_fin_planif, deneigement_current.date_fin_planif),
+                    date_debut_replanif = COALESCE(EXCLUDED.date_debut_replanif, deneigement_current.date_debut_replanif),
+                    date_fin_replanif = COALESCE(EXCLUDED.date_fin_replanif, deneigement_current.date_fin_replanif),
+                    date_maj = EXCLUDED.date_maj,
+                    last_seen_at = now()
+                WHERE """ + CURRENT_CHANGED_SQL + """
+                RETURNING cote_rue_id
+            """)
+            changed_ids = [row[0] for row in cur.fetchall()]
+            upserted_current_count = len(changed_ids)
+
+            # Rows written above already carry this transaction's now(); touch the unchanged ones
+            cur.execute("""
+                UPDATE deneigement_current dc
+                SET last_seen_at = now()
+                FROM staging_latest p
+                WHERE dc.cote_rue_id = p.cote_rue_id
+                  AND dc.last_seen_at IS DISTINCT FROM now()
+            """)
+            unchanged_current_count = cur.rowcount
+
+            # Street sides without a street were not written: keep them above the watermark
+            cur.execute("""
+                SELECT p.cote_rue_id
+                FROM staging_latest p
+                WHERE NOT EXISTS (SELECT 1 FROM streets s WHERE s.cote_rue_id = p.cote_rue_id)
+            """)
+            failed_ids = {row[0] for row in cur.fetchall()}
+            failed_date_maj = earliest_date_maj(api_response, failed_ids)
+            watermark = cap_watermark(watermark, failed_date_maj)
+        if watermark:
+            set_watermark(watermark, db_conn=db_conn)
+        db_conn.commit()
+    except Exception:
+        db_conn.rollback()
+        raise
+
+    elapsed = time.monotonic() - start
+    rate = len(api_response) / elapsed if elapsed > 0 else 0.0
+    print(f"Bulk ingest committed {len(api_response)} planification(s) in {elapsed:.2f}s ({rate:.0f} rows/sec)")
+
+    return {
+        "total": len(api_response),
+        "streets_upserted": upserted_streets_count,
+        "streets_skipped": skipped_streets_count,
+        "streets_unchanged": unchanged_streets_count,
+        "current_upserted": upserted_current_count,
+        "current_unchanged": unchanged_current_count,
+        "changed_ids": changed_ids,
+        "street_ids": street_ids,
+        "street_bounds": street_bounds,
+        "events_inserted": events_count,
+        "rows_failed": len(failed_ids),
+        "failed_date_maj": failed_date_maj,
+        "watermark": watermark
+    }
+
+
+# Statements of the async ingest engine (asyncpg numbered parameters; dates are passed
+# as the API's ISO strings and cast server-side)
+ASYNC_STREET_SQL = """
+    INSERT INTO streets (
+        cote_rue_id, id_trc, id_voie, nom_voie, nom_ville,
+        debut_adresse, fin_adresse, cote, type_f, sens_cir,
+        geometry, street_feature, feature_hash,
+        geometry_z11, geometry_z13, geometry_z15, updated_at
+    ) VALUES (
+        $1, $2, $3, $4, $5, $6, $7, $8, $9, $10,
+        ST_GeomFromGeoJSON($11::text)::geography, $12::jsonb, $13,
+        ST_GeomFromGeoJSON($14::text)::geography,
+        ST_GeomFromGeoJSON($15::text)::geography,
+        ST_GeomFromGeoJSON($16::text)::geography,
+        now()
+    )
+    ON CONFLICT (cote_rue_id) DO UPDATE SET
+        id_trc = EXCLUDED.id_trc,
+        id_voie = EXCLUDED.id_voie,
+        nom_voie = EXCLUDED.nom_voie,
+        nom_ville = EXCLUDED.nom_ville,
+        debut_adresse = EXCLUDED.debut_adresse,
+        fin_adresse = EXCLUDED.fin_adresse,
+        cote = EXCLUDED.cote,
+        type_f = EXCLUDED.type_f,
+        sens_cir = EXCLUDED.sens_cir,
+        geometry = COALESCE(EXCLUDED.geometry, streets.geometry),
+        street_feature = EXCLUDED.street_feature,
+        feature_hash = EXCLUDED.feature_hash,
+        geometry_z11 = EXCLUDED.geometry_z11,
+        geometry_z13 = EXCLUDED.geometry_z13,
+        geometry_z15 = EXCLUDED.geometry_z15,
+        updated_at = now()
+"""
+
+ASYNC_EVENT_SQL = """
+    INSERT INTO deneigement_events (
+        cote_rue_id, old_etat, new_etat, old_status, new_status, event_date
+    ) VALUES ($1, $2, $3, $4, $5, $6::text::timestamptz)
+"""
+
+ASYNC_CURRENT_SQL = """
+    INSERT INTO deneigement_current (
+        cote_rue_id, etat_deneig, status,
+        date_debut_planif, date_fin_planif, date_debut_replanif, date_fin_replanif,
+        date_maj, last_seen_at
+    ) VALUES (
+        $1, $2, $3,
+        $4::text::timestamptz, $5::text::timestamptz, $6::text::timestamptz, $7::text::timestamptz,
+        $8::text::timestamptz, now()
+    )
+    ON CONFLICT (cote_rue_id) DO UPDATE SET
+        etat_deneig = EXCLUDED.etat_deneig,
+        status = EXCLUDED.status,
+        date_debut_planif = COALESCE(EXCLUDED.date_debut_planif, deneigement_current.date_debut_planif),
+        date_fin_planif = COALESCE(EXCLUDED.date_fin_planif, deneigement_current.date_fin_planif),
+        date_debut_replanif = COALESCE(EXCLUDED.date_debut_replanif, deneigement_current.date_debut_replanif),
+        date_fin_replanif = COALESCE(EXCLUDED.date_fin_replanif, deneigement_current.date_fin_replanif),
+        date_maj = EXCLUDED.date_maj,
+        last_seen_at = now()
+    WHERE """ + CURRENT_CHANGED_SQL + """
+    RETURNING cote_rue_id
+"""
+
+
+async def ingest_async(api_response: list, gbdouble_mapping: Dict[int, Dict[str, Any]], pool, concurrency: int = 50) -> Dict[str, int]:
+    """
+    Async counterpart of ingest(): same flow and summary, but every write is a coroutine
+    on an asyncpg pool and at most `concurrency` DB operations are in flight at once.
+    
+    Args:
+        api_response: List of planification items from the API
+        gbdouble_mapping: Optional mapping of cote_rue_id to GeoJSON features
+        pool: asyncpg pool
+        concurrency: Maximum number of in-flight DB operations
+    
+    Returns:
+        Summary dictionary with the ingest() keys
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    skipped_streets_count = 0
+    unchanged_streets_count = 0
+    
+    for item in api_response:
+        etat_deneig = item.get('etatDeneig')
+        item['status'] = get_etat_deneig_status(etat_deneig) if etat_deneig is not None else "État inconnu"
+    
+    cote_rue_ids = list(dict.fromkeys(item.get('coteRueId') for item in api_response if item.get('coteRueId')))
+    
+    # Without a geobase (--skip-streets) no street is written, so their hashes are not needed
+    street_hashes = {}
+    if gbdouble_mapping is not None:
+        rows = await pool.fetch("SELECT cote_rue_id, feature_hash FROM streets WHERE cote_rue_id = ANY($1::bigint[])", cote_rue_ids)
+        street_hashes = {row["cote_rue_id"]: row["feature_hash"] for row in rows}
+    rows = await pool.fetch(
+        "SELECT cote_rue_id, etat_deneig, status, date_maj FROM deneigement_current WHERE cote_rue_id = ANY($1::bigint[])",
+        cote_rue_ids
+    )
+    current_states = {
+        row["cote_rue_id"]: {"etat_deneig": row["etat_deneig"], "status": row["status"], "date_maj": row["date_maj"]}
+        for row in rows
+    }
+    
+    async def write_street(prepared):
+        async with semaphore:
+            try:
+                await pool.execute(
+                    ASYNC_STREET_SQL,
+                    *(prepared[column] for column in STREET_COLUMNS),
+                    json.dumps(prepared["geometry"]) if prepared["geometry"] else None,
+                    json.dumps(prepared["street_feature"]),
+                    prepared["feature_hash"],
+                    *(json.dumps(prepared["simplified"][column]) if prepared["simplified"][column] else None
+                      for column in SIMPLIFIED_COLUMNS)
+                )
+                if known_streets is not None:
+                    known_streets.add(prepared["cote_rue_id"])
+                return True
+            except Exception as e:
+                print(f"✗ Failed to upsert street: cote_rue_id={prepared['cote_rue_id']}: {str(e)}")
+                return False
+    
+    street_ids = []
+    street_writes = []
+    # Without a geobase (--skip-streets), streets are managed by sync_geobase.py
+    for cote_rue_id in (cote_rue_ids if gbdouble_mapping is not None else []):
+        feature = gbdouble_mapping.get(cote_rue_id)
+        if feature is None:
+            skipped_streets_count += 1
+            continue
+        if street_hashes.get(cote_rue_id) == feature_hash(feature):
+            unchanged_streets_count += 1
+            continue
+        prepared = prepare_street(feature)
+        if prepared is None:
+            skipped_streets_count += 1
+            continue
+        street_ids.append(cote_rue_id)
+        street_writes.append(write_street(prepared))
+    
+    # Bounds of the geometries about to be replaced, so the tiles they were drawn in are invalidated too
+    rewritten_ids = [cote_rue_id for cote_rue_id in street_ids if cote_rue_id in street_hashes]
+    rows = await pool.fetch("""
+        SELECT ST_XMin(g), ST_YMin(g), ST_XMax(g), ST_YMax(g)
+        FROM (SELECT geometry::geometry AS g FROM streets WHERE cote_rue_id = ANY($1::bigint[]) AND geometry IS NOT NULL) s
+    """, rewritten_ids) if rewritten_ids else []
+    street_bounds = [tuple(row) for row in rows]
+    
+    street_results = await asyncio.gather(*street_writes)
+    failed_ids = {cote_rue_id for cote_rue_id, result in zip(street_ids, street_results) if not result}
+    upserted_streets_count = sum(street_results)
+    skipped_streets_count += len(street_results) - upserted_streets_count
+    if unchanged_streets_count:
+        print(f"Skipped {unchanged_streets_count} unchanged street(s)")
+    
+    # Rows referencing a street that still does not exist would violate the foreign keys
+    if known_streets is not None:
+        existing_streets = {cote_rue_id for cote_rue_id in cote_rue_ids if cote_rue_id in known_streets}
+    else:
+        rows = await pool.fetch("SELECT cote_rue_id FROM streets WHERE cote_rue_id = ANY($1::bigint[])", cote_rue_ids)
+        existing_streets = {row["cote_rue_id"] for row in rows}
+    
+    events, records = detect_changes(api_response, current_states)
+    print(f"Detected {len(events)} state change(s) for {len(cote_rue_ids)} street side(s)")
+    
+    # One transaction per street side: its events, then its latest current state.
+    # Rows without etatDeneig or dateMaj are skipped, as in write_batch()
+    side_events = {}
+    for event in events:
+        if is_writable_state(event["new_etat"], event["event_date"]):
+            side_events.setdefault(event["cote_rue_id"], []).append(event)
+    latest_items = {}
+    for item in api_response:
+        if item.get('coteRueId') and is_writable_state(item.get('etatDeneig'), item.get('dateMaj')):
+            latest_items[item['coteRueId']] = item
+    
+    async def write_side(cote_rue_id, item):
+        async with semaphore:
+            try:
+                async with pool.acquire() as conn:
+                    async with conn.transaction():
+                        event_rows = [
+                            (event["cote_rue_id"], event["old_etat"], event["new_etat"],
+                             event["old_status"], event["new_status"], event["event_date"])
+                            for event in side_events.get(cote_rue_id, [])
+                        ]
+                        if event_rows:
+                            await conn.executemany(ASYNC_EVENT_SQL, event_rows)
+                        written = await conn.fetchval(ASYNC_CURRENT_SQL, *(item.get(field) for field in CURRENT_FIELDS.values()))
+                return "changed" if written is not None else "unchanged"
+            except Exception as e:
+                print(f"✗ Failed to upsert current state for cote_rue_id={cote_rue_id}: {str(e)}")
+                return None
+    
+    side_ids = []
+    side_writes = []
+    for cote_rue_id, item in latest_items.items():
+        if cote_rue_id not in existing_streets:
+            failed_ids.add(cote_rue_id)
+            print(f"⚠ Skipped current state update: street {cote_rue_id} does not exist")
+            continue
+        side_ids.append(cote_rue_id)
+        side_writes.append(write_side(cote_rue_id, item))
+    
+    side_results = await asyncio.gather(*side_writes)
+    upserted_current_count = side_results.count("changed")
+    failed_ids.update(cote_rue_id for cote_rue_id, result in zip(side_ids, side_results) if result is None)
+    
+    # Street sides seen without changes only get last_seen_at touched, in one statement
+    unchanged_ids = [cote_rue_id for cote_rue_id, result in zip(side_ids, side_results) if result == "unchanged"]
+    unchanged_current_count = 0
+    if unchanged_ids:
+        status = await pool.execute(
+            "UPDATE deneigement_current SET last_seen_at = now() WHERE cote_rue_id = ANY($1::bigint[])",
+            unchanged_ids
+        )
+        unchanged_current_count = int(status.split()[-1])
+    
+    return {
+        "total": len(api_response),
+        "streets_upserted": upserted_streets_count,
+        "streets_skipped": skipped_streets_count,
+        "streets_unchanged": unchanged_streets_count,
+        "current_upserted": upserted_current_count,
+        "current_unchanged": unchanged_current_count,
+        "changed_ids": [cote_rue_id for cote_rue_id, result in zip(side_ids, side_results) if result == "changed"],
+        "street_ids": [cote_rue_id for cote_rue_id, result in zip(street_ids, street_results) if result],
+        "street_bounds": street_bounds,
+        "rows_failed": len(failed_ids),
+        "failed_date_maj": earliest_date_maj(api_response, failed_ids)
+    }
+
+
+def run_ingest_async(api_response: list, gbdouble_mapping: Dict[int, Dict[str, Any]], database_url: str, concurrency: int = 50) -> Dict[str, int]:
+    """
+    Run ingest_async() on its own event loop and asyncpg pool.
+    
+    Raises:
+        RuntimeError: If asyncpg is not installed
+    """
+    if asyncpg is None:
+        raise RuntimeError("INGEST_MODE=async requires asyncpg (pip install asyncpg)")
+    
+    async def run():
+        # No prepared statement cache: Supabase's pooler (transaction mode) does not keep them
+        pool = await asyncpg.create_pool(database_url, min_size=1, max_size=concurrency, statement_cache_size=0)
+        try:
+            return await ingest_async(api_response, gbdouble_mapping, pool, concurrency=concurrency)
+        finally:
+            await pool.close()
+    
+    start = time.monotonic()
+    summary = asyncio.run(run())
+    elapsed = time.monotonic() - start
+    rate = len(api_response) / elapsed if elapsed > 0 else 0.0
+    print(f"Async ingest processed {len(api_response)} planification(s) in {elapsed:.2f}s ({rate:.0f} rows/sec, concurrency {concurrency})")
+    return summary
+
+
+def slim_street_feature(feature: Dict[str, Any], geometry: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Feature with only the STREET_PROPERTIES the client reads and the given geometry"""
+    properties = feature.get("properties", {})
+    return {
+        "type": "Feature",
+        "geometry": geometry,
+        "properties": {prop: properties.get(prop) for prop in STREET_PROPERTIES.values()},
+    }
+
+
+def prepare_street(feature: Dict[str, Any], encode: bool = False, slim: Optional[bool] = None) -> Optional[Dict[str, Any]]:
+    """
+    Map a gbdouble feature to the streets table columns.
+
+    Args:
+        feature: GeoJSON feature object with properties and geometry
+        encode: Also JSON-encode the geometry and feature ('geometry_json', 'street_feature_json'),
+            so the caller can write them without encoding again
+        slim: Quantize the geometries and keep only the STREET_PROPERTIES in 'street_feature'
+            (default: SLIM_STREET_FEATURES)
+
+    Returns:
+        Dictionary with the STREET_COLUMNS values, the 'feature_hash' of the source feature,
+        the normalized 'geometry', its 'wkt', its 'simplified' copies (SIMPLIFIED_COLUMNS -> GeoJSON)
+        and the normalized 'street_feature', or None if the feature has no COTE_RUE_ID
+    """
     properties = feature.get("properties", {})
     cote_rue_id = properties.get("COTE_RUE_ID")
-    
+
     if cote_rue_id is None:
         return None
+    if slim is None:
+        slim = SLIM_STREET_FEATURES
+    content_hash = feature_hash(feature, slim)
     geom = feature["geometry"]
-    
+
     # Normalize geometry to LineString (convert MultiLineString to LineString)
-    normalized_geometry = normalize_to_linestring(geom)
+    normalized_geometry, wkt, simplified = normalize_geometry(geom) if geom else (None, None, simplify_linestring(None))
     if normalized_geometry is None:
         print(f"Warning: Could not normalize geometry for cote_rue_id {cote_rue_id}, using original geometry")
         normalized_geometry = geom
@@ -464,23 +1744,101 @@ def upsert_street(feature: Dict[str, Any], db_conn=None, local_supabase=None) ->
         feature_copy = feature.copy()
         feature_copy["geometry"] = normalized_geometry
         feature = feature_copy
+    if slim:
+        # New objects: the cached geometries are shared and must not be modified
+        normalized_geometry = geometry_encoding.quantize_geometry(normalized_geometry)
+        if wkt is not None:
+            wkt = linestring_to_wkt(normalized_geometry)
+        simplified = {column: geometry_encoding.quantize_geometry(geometry) for column, geometry in simplified.items()}
+        feature = slim_street_feature(feature, normalized_geometry)
 
     # Extract fields from properties (matching table column names)
+    prepared = {column: properties.get(prop) for column, prop in STREET_PROPERTIES.items()}
+    prepared["feature_hash"] = content_hash
+    prepared["geometry"] = normalized_geometry
+    prepared["wkt"] = wkt
+    prepared["simplified"] = simplified
+    prepared["street_feature"] = feature
+    if encode:
+        prepared["geometry_json"] = json.dumps(normalized_geometry) if normalized_geometry else None
+        prepared["street_feature_json"] = json.dumps(feature)
+    return prepared
+
+
+def init_process_worker(use_geometry_cache: bool = False):
+    """
+    ProcessPoolExecutor initializer: load the geobase from the street store if it was not inherited
+    by fork, and track the worker's copy of the geometry cache (an empty one on spawn) so its
+    new entries and counters can be sent back to the parent.
+    """
+    global process_geobase, geometry_cache
+    if process_geobase is None:
+        process_geobase = geobase.StreetStore.load(os.path.join(geobase.GEOBASE_CACHE_DIR, geobase.STORE_FILENAME))
+    if use_geometry_cache and geometry_cache is None:
+        geometry_cache = GeometryCache()
+    if geometry_cache is not None:
+        geometry_cache.track()
+
+
+def prepare_batch_streets(cote_rue_ids: List[int]) -> Tuple[Dict[int, Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """
+    Process-pool task: build, normalize, hash and JSON-encode the street rows of a batch.
+    Only ids cross the process boundary on the way in; the geobase is read from process_geobase.
+    
+    Returns:
+        Tuple of (mapping of cote_rue_id to prepare_street(..., encode=True) output for ids found
+        in the geobase, geometry cache delta to merge in the parent or None without a cache)
+    """
+    prepared_streets = {}
+    for cote_rue_id in cote_rue_ids:
+        if cote_rue_id not in process_geobase:
+            continue
+        prepared = prepare_street(process_geobase[cote_rue_id], encode=True)
+        if prepared is not None:
+            prepared_streets[cote_rue_id] = prepared
+    return prepared_streets, geometry_cache.take_delta() if geometry_cache is not None else None
+
+
+def upsert_street(feature: Dict[str, Any], db_conn=None, local_supabase=None, prepared: Optional[Dict[str, Any]] = None,
+                  slim: Optional[bool] = None) -> Optional[Dict[str, Any]]:
+    """
+    Upsert a street feature into the Supabase streets table.
+    
+    Args:
+        feature: GeoJSON feature object with properties and geometry
+        db_conn: Optional psycopg2 connection for direct database access
+        local_supabase: Optional thread-local Supabase client
+        prepared: Optional prepare_street() output for the feature, to skip preparing it again
+        slim: Store a slim, quantized street_feature (see prepare_street; default: SLIM_STREET_FEATURES)
+    
+    Returns:
+        True if successful, False otherwise
+    """
+    client = local_supabase or get_supabase_client()
+    if client is None and db_conn is None:
+        return None
+
+    if prepared is None:
+        prepared = prepare_street(feature, slim=slim)
+    if prepared is None:
+        return None
+    cote_rue_id = prepared["cote_rue_id"]
+    feature = prepared["street_feature"]
+    geometry = prepared["geometry"]
+
     street_data = {
-        "cote_rue_id": cote_rue_id,
-        "id_trc": properties.get("ID_TRC"),
-        "id_voie": properties.get("ID_VOIE"),
-        "nom_voie": properties.get("NOM_VOIE"),
-        "nom_ville": properties.get("NOM_VILLE"),
-        "debut_adresse": properties.get("DEBUT_ADRESSE"),
-        "fin_adresse": properties.get("FIN_ADRESSE"),
-        "cote": properties.get("COTE"),
-        "type_f": properties.get("TYPE_F"),
-        "sens_cir": properties.get("SENS_CIR"),
-        "geometry": f"SRID=4326;{geojson_to_wkt(normalized_geometry)}",
-        "street_feature": PGJson(feature),  # Store the entire feature as jsonb
+        **{column: prepared[column] for column in STREET_COLUMNS},
+        "feature_hash": prepared["feature_hash"],
+        "geometry": f"SRID=4326;{prepared['wkt']}",
+        "street_feature": PGJson(feature),  # Store the feature (full or slim) as jsonb
+        **{
+            column: json.dumps(prepared["simplified"][column]) if prepared["simplified"][column] else None
+            for column in SIMPLIFIED_COLUMNS
+        },
     }
-    geometry = normalized_geometry
+    if "street_feature_json" in prepared:
+        # Already encoded (process executor)
+        street_data["street_feature"] = PGJson(prepared["street_feature_json"], dumps=lambda encoded: encoded)
     
     try:
         if db_conn:
@@ -493,11 +1851,16 @@ def upsert_street(feature: Dict[str, Any], db_conn=None, local_supabase=None) ->
                         INSERT INTO streets (
                             cote_rue_id, id_trc, id_voie, nom_voie, nom_ville,
                             debut_adresse, fin_adresse, cote, type_f, sens_cir,
-                            geometry, street_feature, updated_at
+                            geometry, street_feature, feature_hash,
+                            geometry_z11, geometry_z13, geometry_z15, updated_at
                         ) VALUES (
                             %(cote_rue_id)s, %(id_trc)s, %(id_voie)s, %(nom_voie)s, %(nom_ville)s,
                             %(debut_adresse)s, %(fin_adresse)s, %(cote)s, %(type_f)s, %(sens_cir)s,
-                            ST_GeomFromGeoJSON(%(geometry)s)::geography, %(street_feature)s, now()
+                            ST_GeomFromGeoJSON(%(geometry)s)::geography, %(street_feature)s, %(feature_hash)s,
+                            ST_GeomFromGeoJSON(%(geometry_z11)s)::geography,
+                            ST_GeomFromGeoJSON(%(geometry_z13)s)::geography,
+                            ST_GeomFromGeoJSON(%(geometry_z15)s)::geography,
+                            now()
                         )
                         ON CONFLICT (cote_rue_id) DO UPDATE SET
                             id_trc = EXCLUDED.id_trc,
@@ -511,10 +1874,14 @@ def upsert_street(feature: Dict[str, Any], db_conn=None, local_supabase=None) ->
                             sens_cir = EXCLUDED.sens_cir,
                             geometry = EXCLUDED.geometry,
                             street_feature = EXCLUDED.street_feature,
+                            feature_hash = EXCLUDED.feature_hash,
+                            geometry_z11 = EXCLUDED.geometry_z11,
+                            geometry_z13 = EXCLUDED.geometry_z13,
+                            geometry_z15 = EXCLUDED.geometry_z15,
                             updated_at = now()
                     """, {
                         **street_data,
-                        'geometry': json.dumps(geometry)
+                        'geometry': prepared.get("geometry_json") or json.dumps(geometry)
                     })
                 else:
                     # Upsert without geometry
@@ -522,11 +1889,11 @@ def upsert_street(feature: Dict[str, Any], db_conn=None, local_supabase=None) ->
                         INSERT INTO streets (
                             cote_rue_id, id_trc, id_voie, nom_voie, nom_ville,
                             debut_adresse, fin_adresse, cote, type_f, sens_cir,
-                            street_feature, updated_at
+                            street_feature, feature_hash, updated_at
                         ) VALUES (
                             %(cote_rue_id)s, %(id_trc)s, %(id_voie)s, %(nom_voie)s, %(nom_ville)s,
                             %(debut_adresse)s, %(fin_adresse)s, %(cote)s, %(type_f)s, %(sens_cir)s,
-                            %(street_feature)s, now()
+                            %(street_feature)s, %(feature_hash)s, now()
                         )
                         ON CONFLICT (cote_rue_id) DO UPDATE SET
                             id_trc = EXCLUDED.id_trc,
@@ -539,9 +1906,12 @@ def upsert_street(feature: Dict[str, Any], db_conn=None, local_supabase=None) ->
                             type_f = EXCLUDED.type_f,
                             sens_cir = EXCLUDED.sens_cir,
                             street_feature = EXCLUDED.street_feature,
+                            feature_hash = EXCLUDED.feature_hash,
                             updated_at = now()
                     """, street_data)
                 db_conn.commit()
+                if known_streets is not None:
+                    known_streets.add(cote_rue_id)
                 return True
         else:
             # Fallback to Supabase client (without geometry for now)
@@ -552,13 +1922,20 @@ def upsert_street(feature: Dict[str, Any], db_conn=None, local_supabase=None) ->
             # Remove None values
             street_data_clean = {k: v for k, v in street_data.items() if v is not None and k != 'street_feature'}
             street_data_clean['street_feature'] = feature
+            for column in SIMPLIFIED_COLUMNS:
+                if prepared["simplified"][column]:
+                    street_data_clean[column] = f"SRID=4326;{linestring_to_wkt(prepared['simplified'][column])}"
             
             result = client.table("streets").upsert(
                 street_data_clean,
                 on_conflict="cote_rue_id"
             ).execute()
             
-            return result.data is not None
+            if result.data is None:
+                return False
+            if known_streets is not None:
+                known_streets.add(cote_rue_id)
+            return True
     except Exception as e:
         print(f"Error upserting street {cote_rue_id}: {str(e)}")
         if db_conn:
@@ -566,61 +1943,232 @@ def upsert_street(feature: Dict[str, Any], db_conn=None, local_supabase=None) ->
         return False
 
 
-def split_planifications_into_batches(
-    planification_list: List[Dict[str, Any]], 
-    batch_size: int = 100,
-    output_dir: str = "planification_batches"
-) -> List[str]:
+def parse_api_datetime(value: str) -> datetime:
+    """Parse an ISO date string as returned by the API (naive Montreal local time)"""
+    return datetime.fromisoformat(value)
+
+
+def get_watermark(local_supabase=None) -> Optional[str]:
     """
-    Split planification list into smaller batches and save each to a JSON file.
+    Read the fetch high-water mark: the max dateMaj of the last successfully committed run.
     
-    Args:
-        planification_list: List of planification items
-        batch_size: Number of items per batch
-        output_dir: Directory to save batch files
+    Returns:
+        ISO date string as returned by the API, or None if no run has been committed yet
+    """
+    client = local_supabase or get_supabase_client()
+    if client is None:
+        return None
+    
+    res = client.table("ingest_state") \
+        .select("value") \
+        .eq("key", WATERMARK_KEY) \
+        .limit(1) \
+        .execute()
+    return res.data[0]["value"] if res.data else None
+
+
+def set_watermark(value: str, db_conn=None, local_supabase=None) -> None:
+    """
+    Store the fetch high-water mark.
+    With db_conn the write joins the caller's open transaction; the caller commits.
+    """
+    if db_conn:
+        with db_conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO ingest_state (key, value, updated_at)
+                VALUES (%s, %s, now())
+                ON CONFLICT (key) DO UPDATE SET
+                    value = EXCLUDED.value,
+                    updated_at = now()
+            """, (WATERMARK_KEY, value))
+        return
+    
+    client = local_supabase or get_supabase_client()
+    if client is None:
+        return
+    client.table("ingest_state").upsert(
+        {"key": WATERMARK_KEY, "value": value, "updated_at": datetime.now().astimezone().isoformat()},
+        on_conflict="key"
+    ).execute()
+
+
+def report_watermark(new_watermark: Optional[str], stored: Optional[str], previous: Optional[str], rows_failed: int) -> None:
+    """Log where the fetch watermark ended up after a run"""
+    if not new_watermark:
+        return
+    if stored and (not previous or parse_api_datetime(stored) > parse_api_datetime(previous)):
+        held = f" (held back from {new_watermark}: {rows_failed} row(s) failed)" if stored != new_watermark else ""
+        print(f"Fetch watermark advanced to {stored}{held}")
+    else:
+        print(f"⚠ Fetch watermark not advanced: {rows_failed} row(s) failed")
+
+
+def advance_watermark(new_watermark: Optional[str], previous: Optional[str], summary: Dict[str, Any]) -> None:
+    """
+    Store the new fetch watermark once the run's writes are committed, capped at the earliest
+    dateMaj whose rows failed (cap_watermark), so those rows are fetched and retried next run.
+    """
+    if not new_watermark:
+        return
+    capped = cap_watermark(new_watermark, summary.get("failed_date_maj"))
+    if previous and parse_api_datetime(capped) <= parse_api_datetime(previous):
+        report_watermark(new_watermark, None, previous, summary.get("rows_failed", 0))
+        return
+    try:
+        set_watermark(capped)
+        report_watermark(new_watermark, capped, previous, summary.get("rows_failed", 0))
+    except Exception as e:
+        print(f"Warning: Could not store fetch watermark: {str(e)}")
+
+
+def publish_tile_invalidations(summary: Dict[str, Any]) -> None:
+    """
+    Publish the tile keys and bbox cells covering the street sides whose current state or
+    geometry the run changed, old geometry included (see dirty_tiles.py), so downstream caches only drop those.
+    """
+    if os.getenv("TILE_INVALIDATIONS", "1") == "0":
+        return
+    changed_ids = sorted(set(summary.get("changed_ids") or ()) | set(summary.get("street_ids") or ()))
+    street_bounds = summary.get("street_bounds") or []
+    if not changed_ids:
+        if summary.get("current_upserted") or summary.get("streets_upserted"):
+            print("⚠ Tile invalidations not published: changed street sides are only known with DATABASE_URL")
+        return
+    
+    db_conn = get_db_connection()
+    if db_conn is None:
+        print("⚠ Tile invalidations not published: no database connection")
+        return
+    try:
+        feed = dirty_tiles.publish(db_conn, changed_ids, extra_bounds=street_bounds)
+        print(f"✓ Published tile invalidation #{feed['id']}: {feed['tiles']} tile(s), "
+              f"{feed['cells']} bbox cell(s) for {len(changed_ids)} street side(s)")
+    except Exception as e:
+        print(f"Warning: Could not publish tile invalidations: {str(e)}")
+    finally:
+        return_db_connection(db_conn)
+
+
+def export_status_snapshot(summary: Dict[str, Any]) -> None:
+    """
+    Write a new status snapshot version (see status_snapshot.py) once the run's writes are committed.
+    Opt-in (STATUS_SNAPSHOT=1); a run that changed no current state does not scan deneigement_current.
+    """
+    if os.getenv("STATUS_SNAPSHOT", "0") != "1":
+        return
+    if not summary.get("current_upserted") and not summary.get("changed_ids"):
+        print("Status snapshot not exported: no current state changed")
+        return
+    db_conn = get_db_connection()
+    if db_conn is None:
+        print("⚠ Status snapshot not exported: no database connection")
+        return
+    try:
+        manifest = status_snapshot.export_snapshot(db_conn)
+        db_conn.rollback()  # read-only, end the transaction before the connection goes back to the pool
+        if manifest is None:
+            print("Status snapshot unchanged")
+        else:
+            print(f"✓ Exported status snapshot {manifest['version']}: {manifest['count']} street side(s), "
+                  f"{manifest['bin_bytes'] / 1024:.1f} KB binary, {manifest['json_bytes'] / 1024:.1f} KB gzip JSON")
+    except Exception as e:
+        db_conn.rollback()
+        print(f"Warning: Could not export status snapshot: {str(e)}")
+    finally:
+        return_db_connection(db_conn)
+
+
+def max_date_maj(planification_list: List[Dict[str, Any]]) -> Optional[str]:
+    """Latest dateMaj in a list of planifications, or None if none has one"""
+    dates = [item["dateMaj"] for item in planification_list if item.get("dateMaj")]
+    return max(dates, key=parse_api_datetime) if dates else None
+
+
+def earliest_date_maj(planification_list: List[Dict[str, Any]], cote_rue_ids) -> Optional[str]:
+    """Earliest dateMaj among the planifications of the given street sides, or None if none has one"""
+    dates = [
+        item["dateMaj"] for item in planification_list
+        if item.get("dateMaj") and item.get("coteRueId") in cote_rue_ids
+    ]
+    return min(dates, key=parse_api_datetime) if dates else None
+
+
+def cap_watermark(watermark: Optional[str], failed_date_maj: Optional[str]) -> Optional[str]:
+    """
+    Hold a new watermark back to the earliest dateMaj that failed to be written, so the next
+    run fetches that row again (drop_before_watermark keeps items at the watermark).
+    Every fetched item is at or after the previous watermark, so the mark never moves backwards.
+    """
+    if not watermark or not failed_date_maj:
+        return watermark
+    return min(watermark, failed_date_maj, key=parse_api_datetime)
+
+
+def drop_before_watermark(planification_list: List[Dict[str, Any]], watermark: Optional[str]):
+    """
+    Drop the items of the overlap window that were already committed by a previous run.
+    Items updated strictly before the watermark are dropped; items at the watermark are kept,
+    rewriting them is harmless.
     
     Returns:
-        List of file paths for the created batch files
+        Tuple of (kept items, number of dropped items)
     """
-    # Create output directory if it doesn't exist
-    pathlib.Path(output_dir).mkdir(parents=True, exist_ok=True)
+    if not watermark:
+        return planification_list, 0
     
-    batch_files = []
-    total_items = len(planification_list)
-    num_batches = (total_items + batch_size - 1) // batch_size  # Ceiling division
+    mark = parse_api_datetime(watermark)
+    kept = [
+        item for item in planification_list
+        if not item.get("dateMaj") or parse_api_datetime(item["dateMaj"]) >= mark
+    ]
+    return kept, len(planification_list) - len(kept)
+
+
+def collapse_planifications(planification_list: List[Dict[str, Any]]):
+    """
+    Keep one planification per coteRueId: the one with the latest dateMaj (the later one in
+    the list on a tie). The result is sorted by coteRueId, so consecutive batches cover
+    disjoint id ranges and no two workers ever write the same street side.
     
-    print(f"Splitting {total_items} planifications into {num_batches} batch(es) of up to {batch_size} items each...")
+    Items without a coteRueId are never written and are dropped.
     
-    for i in range(0, total_items, batch_size):
-        batch_num = (i // batch_size) + 1
-        batch = planification_list[i:i + batch_size]
-        
-        batch_filename = f"planification_batch_{batch_num:04d}.json"
-        batch_filepath = os.path.join(output_dir, batch_filename)
-        
-        try:
-            with open(batch_filepath, "w", encoding="utf-8") as f:
-                json.dump(batch, f, ensure_ascii=False, indent=2)
-            
-            batch_files.append(batch_filepath)
-            print(f"  ✓ Created batch {batch_num}/{num_batches}: {batch_filename} ({len(batch)} items)")
-        except Exception as e:
-            print(f"  ✗ Error creating batch {batch_num}: {str(e)}")
+    Returns:
+        Tuple of (collapsed items, number of duplicates dropped, i.e. writes saved)
+    """
+    latest = {}
+    latest_dates = {}
+    for item in planification_list:
+        cote_rue_id = item.get("coteRueId")
+        if not cote_rue_id:
+            continue
+        date_maj = parse_api_datetime(item["dateMaj"]) if item.get("dateMaj") else None
+        if cote_rue_id in latest:
+            previous = latest_dates[cote_rue_id]
+            if previous is not None and (date_maj is None or date_maj < previous):
+                continue
+        latest[cote_rue_id] = item
+        latest_dates[cote_rue_id] = date_maj
     
-    return batch_files
+    with_id = sum(1 for item in planification_list if item.get("coteRueId"))
+    collapsed = [latest[cote_rue_id] for cote_rue_id in sorted(latest)]
+    return collapsed, with_id - len(collapsed)
 
 
-def process_batch_file(
-    batch_filepath: str,
-    gbdouble_mapping: Dict[int, Dict[str, Any]] = None
+def process_batch(
+    batch_data: List[Dict[str, Any]],
+    gbdouble_mapping: Dict[int, Dict[str, Any]] = None,
+    label: str = "batch",
+    prepared_streets: Optional[Dict[int, Dict[str, Any]]] = None
 ) -> Dict[str, int]:
     """
-    Process a single batch file and update streets, deneigement_current, and events.
+    Process one batch of planifications and update streets, deneigement_current, and events.
     This function is designed to be called in parallel and creates its own connections.
     
     Args:
-        batch_filepath: Path to the batch JSON file
+        batch_data: List of planification items
         gbdouble_mapping: Optional mapping of cote_rue_id to GeoJSON features
+        label: Name of the batch used in log messages
+        prepared_streets: Optional streets already prepared by prepare_batch_streets()
     
     Returns:
         Summary dictionary with processing statistics
@@ -632,29 +2180,27 @@ def process_batch_file(
     db_conn = get_db_connection()
     
     try:
-        with open(batch_filepath, "r", encoding="utf-8") as f:
-            batch_data = json.load(f)
-        
-        # Ensure batch_data is a list
-        if isinstance(batch_data, dict):
-            batch_data = [batch_data]
-        
-        print(f"\n[Thread {threading.current_thread().name}] Processing batch: {os.path.basename(batch_filepath)} ({len(batch_data)} items)")
+        print(f"\n[Thread {threading.current_thread().name}] Processing batch: {label} ({len(batch_data)} items)")
         print("-" * 80)
         
-        result = ingest(batch_data, gbdouble_mapping, db_conn, local_supabase=local_supabase)
+        result = ingest(batch_data, gbdouble_mapping, db_conn, local_supabase=local_supabase, prepared_streets=prepared_streets)
         
-        print(f"[Thread {threading.current_thread().name}] Completed batch: {os.path.basename(batch_filepath)}")
+        print(f"[Thread {threading.current_thread().name}] Completed batch: {label}")
         return result
     except Exception as e:
-        print(f"Error processing batch file {batch_filepath}: {str(e)}")
+        print(f"Error processing batch {label}: {str(e)}")
         import traceback
         traceback.print_exc()
         return {
             "total": 0,
             "streets_upserted": 0,
             "streets_skipped": 0,
-            "current_upserted": 0
+            "streets_unchanged": 0,
+            "current_upserted": 0,
+            "current_unchanged": 0,
+            "batches_failed": 1,
+            "rows_failed": len(batch_data),
+            "failed_date_maj": earliest_date_maj(batch_data, {item.get("coteRueId") for item in batch_data})
         }
     finally:
         # Return connection to pool
@@ -662,8 +2208,194 @@ def process_batch_file(
             return_db_connection(db_conn)
 
 
-def main():
+def process_batch_file(
+    batch_filepath: str,
+    gbdouble_mapping: Dict[int, Dict[str, Any]] = None
+) -> Dict[str, int]:
+    """
+    Process a single batch file (e.g. one spilled by run_pipeline) with process_batch.
+    
+    Args:
+        batch_filepath: Path to the batch JSON file
+        gbdouble_mapping: Optional mapping of cote_rue_id to GeoJSON features
+    
+    Returns:
+        Summary dictionary with processing statistics
+    """
+    with open(batch_filepath, "r", encoding="utf-8") as f:
+        batch_data = json.load(f)
+    
+    # Ensure batch_data is a list
+    if isinstance(batch_data, dict):
+        batch_data = [batch_data]
+    
+    return process_batch(batch_data, gbdouble_mapping, label=os.path.basename(batch_filepath))
+
+
+def run_pipeline(
+    planification_list,
+    gbdouble_mapping: Dict[int, Dict[str, Any]] = None,
+    batch_size: int = 100,
+    max_workers: int = 5,
+    spill_dir: Optional[str] = None,
+    process_pool: Optional[ProcessPoolExecutor] = None
+) -> Dict[str, int]:
+    """
+    Ingest planifications through a bounded in-memory queue: the calling thread groups
+    records into batches and pushes them, max_workers threads consume them directly.
+    The queue holds at most two batches per worker, so the producer blocks (backpressure)
+    when the database is the bottleneck.
+    
+    With a process_pool, street preparation (geometry normalization, hashing, JSON encoding)
+    is submitted to it as each batch is queued, and the threads only do the DB writes.
+    
+    Args:
+        planification_list: Iterable of planification items
+        gbdouble_mapping: Optional mapping of cote_rue_id to GeoJSON features
+        batch_size: Number of items per batch
+        max_workers: Number of consumer threads
+        spill_dir: Optional directory where each batch is also written as JSON (debugging)
+        process_pool: Optional ProcessPoolExecutor running prepare_batch_streets()
+    
+    Returns:
+        Aggregated summary dictionary, with the number of batches, the sorted 'changed_ids' and 'street_ids',
+        the 'street_bounds' and the earliest 'failed_date_maj' of all batches
+    """
+    total_summary = {
+        "total": 0,
+        "streets_upserted": 0,
+        "streets_skipped": 0,
+        "streets_unchanged": 0,
+        "current_upserted": 0,
+        "current_unchanged": 0,
+        "batches_failed": 0,
+        "rows_failed": 0,
+        "batches": 0
+    }
+    changed_ids = set()
+    street_ids = set()
+    street_bounds = []
+    failed_dates = []
+    summary_lock = threading.Lock()
+    batch_queue = queue.Queue(maxsize=max_workers * 2)
+    
+    def worker():
+        while True:
+            item = batch_queue.get()
+            try:
+                if item is None:
+                    return
+                label, batch, prepared_future = item
+                prepared_streets = None
+                if prepared_future is not None:
+                    try:
+                        prepared_streets, cache_delta = prepared_future.result()
+                        if cache_delta is not None and geometry_cache is not None:
+                            geometry_cache.merge(cache_delta)
+                    except Exception as e:
+                        print(f"Warning: Street preparation failed for {label}, preparing in thread: {str(e)}")
+                batch_summary = process_batch(batch, gbdouble_mapping, label=label, prepared_streets=prepared_streets)
+                with summary_lock:
+                    for key in total_summary:
+                        total_summary[key] += batch_summary.get(key, 0)
+                    changed_ids.update(batch_summary.get("changed_ids") or ())
+                    street_ids.update(batch_summary.get("street_ids") or ())
+                    street_bounds.extend(batch_summary.get("street_bounds") or ())
+                    if batch_summary.get("failed_date_maj"):
+                        failed_dates.append(batch_summary["failed_date_maj"])
+                    total_summary["batches"] += 1
+                    print(f"\n[Progress] {total_summary['batches']} batches completed, {total_summary['total']} items")
+            finally:
+                batch_queue.task_done()
+    
+    if spill_dir:
+        pathlib.Path(spill_dir).mkdir(parents=True, exist_ok=True)
+        print(f"Spilling batches to {spill_dir}")
+    
+    workers = [
+        threading.Thread(target=worker, name=f"ingest-{i + 1}", daemon=True)
+        for i in range(max_workers)
+    ]
+    for thread in workers:
+        thread.start()
+    
+    def push(batch_num, batch):
+        label = f"planification_batch_{batch_num:04d}"
+        if spill_dir:
+            with open(os.path.join(spill_dir, f"{label}.json"), "w", encoding="utf-8") as f:
+                json.dump(batch, f, ensure_ascii=False)
+        prepared_future = None
+        if process_pool is not None:
+            cote_rue_ids = list(dict.fromkeys(item.get('coteRueId') for item in batch if item.get('coteRueId')))
+            prepared_future = process_pool.submit(prepare_batch_streets, cote_rue_ids)
+        batch_queue.put((label, batch, prepared_future))
+    
+    try:
+        batch = []
+        batch_num = 0
+        for item in planification_list:
+            batch.append(item)
+            if len(batch) >= batch_size:
+                batch_num += 1
+                push(batch_num, batch)
+                batch = []
+        if batch:
+            batch_num += 1
+            push(batch_num, batch)
+    finally:
+        for _ in workers:
+            batch_queue.put(None)
+        for thread in workers:
+            thread.join()
+    
+    total_summary["changed_ids"] = sorted(changed_ids)
+    total_summary["street_ids"] = sorted(street_ids)
+    total_summary["street_bounds"] = street_bounds
+    total_summary["failed_date_maj"] = min(failed_dates, key=parse_api_datetime) if failed_dates else None
+    return total_summary
+
+
+def save_geometry_cache():
+    """Persist the geometry cache and report its hit/miss counters"""
+    if geometry_cache is None:
+        return
+    print(f"Geometry cache: {geometry_cache.stats()}")
+    try:
+        geometry_cache.save()
+    except Exception as e:
+        print(f"Warning: Could not save geometry cache: {str(e)}")
+
+
+def parse_args(argv=None):
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Fetch planifications and upsert streets and current states to Supabase")
+    parser.add_argument(
+        "--executor",
+        choices=("thread", "process"),
+        default=os.getenv("EXECUTOR", "thread"),
+        help="batch mode: 'thread' prepares streets in the I/O threads, 'process' prepares them "
+             "in a process pool and keeps only the DB writes in the threads"
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=int(os.getenv("PROCESS_WORKERS", "0")) or os.cpu_count(),
+        help="number of worker processes for --executor=process (default: number of CPUs)"
+    )
+    parser.add_argument(
+        "--skip-streets",
+        action="store_true",
+        default=os.getenv("SKIP_STREETS", "0") == "1",
+        help="do not load the geobase or write streets (they are kept in sync by sync_geobase.py); "
+             "current states of street sides missing from streets are skipped"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
     """Main function to fetch planifications and upsert streets to Supabase"""
+    args = parse_args(argv)
+    
     # Get token from environment
     token = os.getenv("TokenString") or os.getenv("PLANIF_NEIGE_TOKEN", "")
     if not token:
@@ -679,14 +2411,31 @@ def main():
     batch_size = int(os.getenv("BATCH_SIZE", "100"))
     batch_output_dir = os.getenv("BATCH_OUTPUT_DIR", "planification_batches")
     
+    # Ingest mode: "batch" (per-item, parallel batches), "bulk" (COPY + set-based statements)
+    # or "async" (asyncpg, semaphore-bounded concurrent writes)
+    ingest_mode = os.getenv("INGEST_MODE", "batch").lower()
+    if ingest_mode not in ("batch", "bulk", "async"):
+        print(f"ERROR: Unknown INGEST_MODE '{ingest_mode}' (expected 'batch', 'bulk' or 'async')")
+        return 1
+    async_concurrency = int(os.getenv("ASYNC_CONCURRENCY", "50"))
+    
+    # SOAP mode: "zeep" (zeep objects) or "raw" (post the envelope directly and stream-parse the reply)
+    soap_mode = os.getenv("SOAP_MODE", "zeep").lower()
+    if soap_mode not in ("zeep", "raw"):
+        print(f"ERROR: Unknown SOAP_MODE '{soap_mode}' (expected 'zeep' or 'raw')")
+        return 1
+    
     # Get max workers for parallel processing (default: 5, max: 20 to avoid overwhelming DB)
     max_workers = min(int(os.getenv("MAX_WORKERS", "5")), 20)
     print(f"Parallel processing enabled with max {max_workers} workers")
     
     # Initialize database connection pool if DATABASE_URL is available
-    global db_pool
+    global db_pool, geometry_cache, process_geobase, known_streets
     database_url = os.environ.get("DATABASE_URL") or os.environ.get("SUPABASE_DB_URL")
-    if database_url:
+    if ingest_mode in ("bulk", "async") and not database_url:
+        print(f"ERROR: INGEST_MODE={ingest_mode} requires DATABASE_URL or SUPABASE_DB_URL")
+        return 1
+    if database_url and ingest_mode != "async":
         try:
             # Create a connection pool with min 2, max max_workers connections
             db_pool = psycopg2.pool.ThreadedConnectionPool(
@@ -701,116 +2450,186 @@ def main():
             db_pool = None
     
     # Initialize client
-    client = PlanifNeigeClient(token)
+    client = PlanifNeigeClient(token, raw=soap_mode == "raw")
     
-    # Use current date to get all recent planifications
-    from_date = datetime.now().replace(microsecond=0, second=0).isoformat()
+    # Fetch from the high-water mark of the last committed run (minus a safety overlap),
+    # or from the current date if there is none
+    use_watermark = os.getenv("FETCH_WATERMARK", "1") != "0"
+    overlap_minutes = int(os.getenv("WATERMARK_OVERLAP_MINUTES", "15"))
+    watermark = None
+    if use_watermark:
+        try:
+            watermark = get_watermark()
+        except Exception as e:
+            print(f"Warning: Could not read fetch watermark, fetching from the current date: {str(e)}")
+    if watermark:
+        from_date = (parse_api_datetime(watermark) - timedelta(minutes=overlap_minutes)).replace(microsecond=0).isoformat()
+        print(f"Fetch watermark: {watermark} (overlap: {overlap_minutes} min)")
+    else:
+        from_date = datetime.now().replace(microsecond=0, second=0).isoformat()
     print(f"Fetching planifications from date: {from_date}")
     print("=" * 80)
     
-    # Load gbdouble.json to get street features
-    gbdouble_mapping = {}
-    try:
-        # https://donnees.montreal.ca/dataset/geobase-double
-        gbdouble_url = "https://donnees.montreal.ca/dataset/88493b16-220f-4709-b57b-1ea57c5ba405/resource/16f7fa0a-9ce6-4b29-a7fc-00842c593927/download/gbdouble.json"
-        print("Downloading the latest gbdouble.json...")
-
+    # Load gbdouble.json to get street features (cached locally, re-downloaded only when it changes),
+    # unless streets are kept in sync separately by sync_geobase.py
+    if args.skip_streets:
+        gbdouble_mapping = None
+        print("Skipping street upserts (--skip-streets): streets are managed by sync_geobase.py")
+    else:
         try:
-            response = requests.get(gbdouble_url)
-            response.raise_for_status()
-            geojson_data = response.json()
-            print("Successfully downloaded latest gbdouble.json")
+            gbdouble_mapping = geobase.load_geobase()
+            print(f"Loaded {len(gbdouble_mapping)} features from gbdouble.json")
+            geometry_cache = GeometryCache.load(os.path.join(geobase.GEOBASE_CACHE_DIR, "geometry_cache.pkl"))
         except Exception as e:
-            print(f"ERROR: Failed to download gbdouble.json: {e}")
+            print(f"ERROR: Error loading gbdouble.json: {str(e)}")
             return 1
-        
-        features = geojson_data.get("features", [])
-        for idx, feature in enumerate(features):
-            properties = feature.get("properties", {})
-            geometry = feature.get("geometry", {})
-            coordinates = geometry.get("coordinates", [])
-            cote_rue_id = properties.get("COTE_RUE_ID")
-            if not coordinates:
-                print(f"Empty coordinates at gbdouble.json ({6338 + idx}-{6338 + idx + 24}): cote_rue_id={cote_rue_id}")
-            if cote_rue_id is not None:
-                gbdouble_mapping[cote_rue_id] = feature
-        
-        print(f"Loaded {len(gbdouble_mapping)} features from gbdouble.json")
-    except FileNotFoundError:
-        print("ERROR: gbdouble.json not found.")
-        return 1
-    except Exception as e:
-        print(f"ERROR: Error loading gbdouble.json: {str(e)}")
-        return 1
     
     try:
         # Get all planifications
         planifications, raw_result = client.get_planification_for_date(from_date)
         
         print(f"\nFound {len(planifications)} planification(s)")
+        
+        planifications, overlap_dropped = drop_before_watermark(planifications, watermark)
+        if overlap_dropped:
+            print(f"Dropped {overlap_dropped} planification(s) already committed before the watermark")
+        
+        # Several records for the same street side (e.g. a planif and a replanif) collapse to the latest one
+        planifications, writes_saved = collapse_planifications(planifications)
+        if writes_saved:
+            print(f"Collapsed duplicate planifications: {len(planifications)} street side(s), {writes_saved} write(s) saved")
         print("=" * 80)
         
-        # Split planifications into batches and save to JSON files
-        batch_files = split_planifications_into_batches(
-            planifications,
-            batch_size=batch_size,
-            output_dir=batch_output_dir
-        )
+        if not planifications:
+            print("No new planifications since the last run")
+            save_geometry_cache()
+            if db_pool:
+                db_pool.closeall()
+            return 0
         
-        if not batch_files:
-            print("ERROR: No batch files were created")
-            return 1
+        # Only advance the mark when the run is committed, and never move it backwards
+        new_watermark = max_date_maj(planifications) if use_watermark else None
+        if new_watermark and watermark and parse_api_datetime(new_watermark) <= parse_api_datetime(watermark):
+            new_watermark = None
         
-        print(f"\nCreated {len(batch_files)} batch file(s)")
-        print("=" * 80)
+        # Street existence checks are answered from memory for the rest of the run
+        if ingest_mode != "bulk":
+            db_conn = get_db_connection()
+            try:
+                known_streets = KnownStreets.load(db_conn=db_conn)
+                print(f"Loaded {len(known_streets)} known street(s)")
+            except Exception as e:
+                print(f"Warning: Could not load known streets, existence checks will query the database: {str(e)}")
+                if db_conn:
+                    db_conn.rollback()
+            finally:
+                return_db_connection(db_conn)
         
-        # Process batch files in parallel using ThreadPoolExecutor
-        total_summary = {
-            "total": 0,
-            "streets_upserted": 0,
-            "streets_skipped": 0,
-            "current_upserted": 0
-        }
+        if ingest_mode == "bulk":
+            db_conn = get_db_connection()
+            try:
+                total_summary = ingest_bulk(planifications, gbdouble_mapping, db_conn, watermark=new_watermark)
+            finally:
+                return_db_connection(db_conn)
+            report_watermark(new_watermark, total_summary["watermark"], watermark, total_summary["rows_failed"])
+            publish_tile_invalidations(total_summary)
+            export_status_snapshot(total_summary)
+            
+            print("\n" + "=" * 80)
+            print("FINAL SUMMARY (bulk):")
+            print(f"  Total planifications processed: {total_summary['total']}")
+            print(f"  Duplicate planifications collapsed (writes saved): {writes_saved}")
+            print(f"  Streets upserted: {total_summary['streets_upserted']}")
+            print(f"  Streets skipped: {total_summary['streets_skipped']}")
+            print(f"  Streets unchanged (write skipped): {total_summary['streets_unchanged']}")
+            print(f"  Current states changed (written): {total_summary['current_upserted']}")
+            print(f"  Current states seen unchanged (last_seen_at touched): {total_summary['current_unchanged']}")
+            print(f"  Events inserted: {total_summary['events_inserted']}")
+            print(f"  Rows failed (kept above the watermark): {total_summary['rows_failed']}")
+            print("=" * 80)
+            
+            save_geometry_cache()
+            if db_pool:
+                db_pool.closeall()
+                print("Database connection pool closed")
+            
+            return 0
         
-        print(f"\nProcessing {len(batch_files)} batch file(s) in parallel (max {max_workers} workers)...")
+        if ingest_mode == "async":
+            total_summary = run_ingest_async(planifications, gbdouble_mapping, database_url, concurrency=async_concurrency)
+            
+            # Writes are committed per street side, so the mark stops before the earliest one that failed
+            advance_watermark(new_watermark, watermark, total_summary)
+            publish_tile_invalidations(total_summary)
+            export_status_snapshot(total_summary)
+            
+            print("\n" + "=" * 80)
+            print("FINAL SUMMARY (async):")
+            print(f"  Total planifications processed: {total_summary['total']}")
+            print(f"  Duplicate planifications collapsed (writes saved): {writes_saved}")
+            print(f"  Streets upserted: {total_summary['streets_upserted']}")
+            print(f"  Streets skipped: {total_summary['streets_skipped']}")
+            print(f"  Streets unchanged (write skipped): {total_summary['streets_unchanged']}")
+            print(f"  Current states changed (written): {total_summary['current_upserted']}")
+            print(f"  Current states seen unchanged (last_seen_at touched): {total_summary['current_unchanged']}")
+            print(f"  Rows failed (kept above the watermark): {total_summary['rows_failed']}")
+            print("=" * 80)
+            
+            save_geometry_cache()
+            return 0
+        
+        # Stream batches through an in-memory queue to parallel workers
+        # (BATCH_SPILL=1 also writes each batch to BATCH_OUTPUT_DIR for debugging)
+        spill_dir = batch_output_dir if os.getenv("BATCH_SPILL", "0") == "1" else None
+        print(f"\nProcessing {len(planifications)} planification(s) in batches of {batch_size} (max {max_workers} workers)...")
         print("=" * 80)
         
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            # Submit all batch processing tasks
-            future_to_batch = {
-                executor.submit(process_batch_file, batch_file, gbdouble_mapping): batch_file
-                for batch_file in batch_files
-            }
-            
-            # Process completed tasks as they finish
-            completed = 0
-            for future in as_completed(future_to_batch):
-                batch_file = future_to_batch[future]
-                completed += 1
-                try:
-                    batch_summary = future.result()
-                    
-                    # Aggregate statistics
-                    total_summary["total"] += batch_summary["total"]
-                    total_summary["streets_upserted"] += batch_summary["streets_upserted"]
-                    total_summary["streets_skipped"] += batch_summary["streets_skipped"]
-                    total_summary["current_upserted"] += batch_summary["current_upserted"]
-                    
-                    print(f"\n[Progress] {completed}/{len(batch_files)} batches completed")
-                except Exception as e:
-                    print(f"\n✗ Error processing batch {os.path.basename(batch_file)}: {str(e)}")
-                    import traceback
-                    traceback.print_exc()
+        process_pool = None
+        if args.executor == "process" and gbdouble_mapping is not None:
+            # Workers forked after this point share the loaded geobase copy-on-write instead of receiving a pickled copy
+            process_geobase = gbdouble_mapping
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("fork" if "fork" in methods else methods[0])
+            process_pool = ProcessPoolExecutor(max_workers=args.processes, mp_context=context, initializer=init_process_worker, initargs=(geometry_cache is not None,))
+            # Start the workers now, before the I/O threads exist (fork with running threads is unsafe)
+            process_pool.submit(int).result()
+            print(f"Preparing streets in {args.processes} process(es) ({context.get_start_method()}), DB writes in {max_workers} thread(s)")
+        
+        try:
+            total_summary = run_pipeline(
+                planifications,
+                gbdouble_mapping,
+                batch_size=batch_size,
+                max_workers=max_workers,
+                spill_dir=spill_dir,
+                process_pool=process_pool
+            )
+        finally:
+            if process_pool is not None:
+                process_pool.shutdown()
+        
+        # Batches are committed independently, so the mark stops before the earliest row that failed
+        advance_watermark(new_watermark, watermark, total_summary)
+        # Committed batches are published even if others failed
+        publish_tile_invalidations(total_summary)
+        export_status_snapshot(total_summary)
         
         print("\n" + "=" * 80)
         print("FINAL SUMMARY:")
         print(f"  Total planifications processed: {total_summary['total']}")
+        print(f"  Duplicate planifications collapsed (writes saved): {writes_saved}")
         print(f"  Streets upserted: {total_summary['streets_upserted']}")
         print(f"  Streets skipped: {total_summary['streets_skipped']}")
-        print(f"  Current states upserted: {total_summary['current_upserted']}")
-        print(f"  Batch files created: {len(batch_files)}")
+        print(f"  Streets unchanged (write skipped): {total_summary['streets_unchanged']}")
+        print(f"  Current states changed (written): {total_summary['current_upserted']}")
+        print(f"  Current states seen unchanged (last_seen_at touched): {total_summary['current_unchanged']}")
+        print(f"  Batches processed: {total_summary['batches']}")
+        print(f"  Batches failed: {total_summary['batches_failed']}")
+        print(f"  Rows failed (kept above the watermark): {total_summary['rows_failed']}")
         print("=" * 80)
         
+        save_geometry_cache()
+        
         # Close connection pool if it was created
         if db_pool:
             db_pool.closeall()
@@ -823,6 +2642,8 @@ def main():
         import traceback
         traceback.print_exc()
         
+        save_geometry_cache()
+        
         # Close connection pool if it was created
         if db_pool:
             db_pool.closeall()
@@ -0,0 +1,490 @@
+#!/usr/bin/env python3
+"""Local cache of the Montreal geobase-double (gbdouble.json), compact street store and street geometry normalization"""
+from array import array
+from collections.abc import Mapping
+from typing import Optional, Dict, Any, List, Tuple, Iterable, Iterator
+import os
+import codecs
+import json
+import pickle
+import struct
+import requests
+from shapely.geometry import LineString, MultiLineString
+from shapely.ops import linemerge
+
+# https://donnees.montreal.ca/dataset/geobase-double
+GBDOUBLE_URL = "https://donnees.montreal.ca/dataset/88493b16-220f-4709-b57b-1ea57c5ba405/resource/16f7fa0a-9ce6-4b29-a7fc-00842c593927/download/gbdouble.json"
+
+# Directory holding gbdouble.json, its HTTP validators and the street store
+GEOBASE_CACHE_DIR = os.environ.get("GEOBASE_CACHE_DIR", "data")
+
+GEOBASE_FILENAME = "gbdouble.json"
+META_FILENAME = "gbdouble.meta.json"
+STORE_FILENAME = "gbdouble.store"
+
+# Read size for streaming gbdouble.json from the network or disk
+CHUNK_SIZE = 256 * 1024
+
+# Street store file layout: header, the StreetStore arrays, then the pickled properties
+STORE_MAGIC = b"GBST"
+STORE_VERSION = 1
+STORE_HEADER = struct.Struct("<4sIqqqq")  # magic, version, rows, part offsets, coordinates, size of gbdouble.json
+
+# Geometry type codes in StreetStore
+GEOM_RAW = 0  # anything else, kept as the original GeoJSON object
+GEOM_LINESTRING = 1
+GEOM_MULTILINESTRING = 2
+
+
+def _read_meta(cache_dir: str) -> Dict[str, Any]:
+    """Read the saved HTTP validators (ETag / Last-Modified) for the cached file"""
+    try:
+        with open(os.path.join(cache_dir, META_FILENAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _write_meta(cache_dir: str, meta: Dict[str, Any]) -> None:
+    with open(os.path.join(cache_dir, META_FILENAME), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+
+
+def iter_features(chunks: Iterable[bytes]) -> Iterator[Dict[str, Any]]:
+    """
+    Incrementally parse a GeoJSON FeatureCollection, yielding features one at a time.
+    Only the current feature and the unread part of the last chunk are held in memory.
+
+    Args:
+        chunks: Iterable of raw (already decompressed) UTF-8 byte chunks
+
+    Yields:
+        GeoJSON feature dictionaries, in document order
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+
+    buf = ""
+    pos = 0  # parse position in buf
+    eof = False
+    in_features = False
+
+    while True:
+        if not in_features:
+            # Skip everything up to the opening bracket of the "features" array
+            key = buf.find('"features"', pos)
+            bracket = buf.find("[", key) if key >= 0 else -1
+            if bracket >= 0:
+                pos = bracket + 1
+                in_features = True
+                continue
+        else:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if buf.startswith("]", pos):
+                return
+            if pos < len(buf):
+                try:
+                    feature, end = decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError:
+                    # Incomplete feature at the end of the buffer: read more
+                    if eof:
+                        raise
+                else:
+                    pos = end
+                    yield feature
+                    continue
+
+        if eof:
+            if in_features:
+                raise ValueError("Unexpected end of GeoJSON document: unterminated features array")
+            raise ValueError("GeoJSON document has no features array")
+        chunk = next(chunks, None)
+        if chunk is None:
+            eof = True
+            text = utf8.decode(b"", final=True)
+        else:
+            text = utf8.decode(chunk)
+        # Drop what was already parsed, keep the partial feature
+        buf = buf[pos:] + text
+        pos = 0
+
+
+def normalize_to_linestring(geometry):
+    """
+    Normalize geometry to LineString.
+    Converts MultiLineString to LineString by merging connected segments.
+    If segments cannot be merged, uses the longest segment.
+
+    Args:
+        geometry: GeoJSON geometry object with 'type' and 'coordinates' keys
+
+    Returns:
+        GeoJSON geometry object with type 'LineString', or None if conversion fails
+    """
+    geom_type = geometry.get("type")
+    coordinates = geometry.get("coordinates")
+
+    if not coordinates:
+        return None
+
+    if geom_type == "LineString":
+        return geometry
+    elif geom_type == "MultiLineString":
+        # Convert MultiLineString to LineString
+        try:
+            # Create MultiLineString object
+            multi_linestring = MultiLineString(coordinates)
+
+            # Try to merge connected segments
+            merged = linemerge(multi_linestring)
+
+            if isinstance(merged, LineString):
+                # Successfully merged into a single LineString
+                return {
+                    "type": "LineString",
+                    "coordinates": list(merged.coords)
+                }
+            else:
+                # Could not merge completely (segments are disconnected)
+                # Use the longest segment from the merged result as fallback
+                if isinstance(merged, MultiLineString):
+                    longest_line = max(merged.geoms, key=lambda g: g.length)
+                else:
+                    # Fallback to original if merged is unexpected type
+                    longest_line = max(multi_linestring.geoms, key=lambda g: g.length)
+                return {
+                    "type": "LineString",
+                    "coordinates": list(longest_line.coords)
+                }
+        except Exception as e:
+            # If merging fails, use the first segment
+            print(f"Warning: Could not merge MultiLineString, using first segment: {str(e)}")
+            if coordinates and len(coordinates) > 0:
+                return {
+                    "type": "LineString",
+                    "coordinates": coordinates[0]
+                }
+            return None
+    else:
+        # Unsupported geometry type
+        return None
+
+
+def iter_file_chunks(path: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """Read a file in fixed-size chunks"""
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+def _tee_to_file(chunks: Iterable[bytes], f) -> Iterator[bytes]:
+    """Write every chunk to an open file while passing it through"""
+    for chunk in chunks:
+        f.write(chunk)
+        yield chunk
+
+
+class StreetStore(Mapping):
+    """
+    Compact, read-mostly store of the geobase street sides.
+
+    Properties are kept as one tuple of values per street plus a shared tuple of keys,
+    coordinates as a single contiguous float64 array sliced by part and street offsets.
+    Lookup by COTE_RUE_ID is a dict hit; the GeoJSON feature is only rebuilt when
+    a street is accessed through __getitem__ (i.e. when it actually has to be written).
+    """
+
+    def __init__(self):
+        self._ids = array("q")
+        self._index = {}  # cote_rue_id -> row
+        self._keys = []  # distinct property key tuples
+        self._keys_lookup = {}
+        self._row_keys = array("H")  # row -> position in _keys
+        self._values = []  # row -> tuple of property values
+        self._geom_types = array("B")
+        self._dims = array("B")
+        self._row_parts = array("q", [0])  # row r owns parts _row_parts[r]:_row_parts[r + 1]
+        self._part_offsets = array("q", [0])  # part p owns _coords[_part_offsets[p]:_part_offsets[p + 1]]
+        self._coords = array("d")
+        self._raw_geometries = {}  # row -> geometry that is not a (Multi)LineString
+        self._strings = {}  # interning table for repeated property values
+
+    # Building
+
+    def add(self, feature: Dict[str, Any]) -> None:
+        """Append a GeoJSON feature; a later feature with the same COTE_RUE_ID replaces the earlier one"""
+        properties = feature.get("properties") or {}
+        cote_rue_id = properties.get("COTE_RUE_ID")
+        if cote_rue_id is None:
+            return
+        row = len(self._ids)
+
+        keys = tuple(properties)
+        position = self._keys_lookup.get(keys)
+        if position is None:
+            position = self._keys_lookup[keys] = len(self._keys)
+            self._keys.append(keys)
+        self._row_keys.append(position)
+        self._values.append(tuple(
+            self._strings.setdefault(value, value) if isinstance(value, str) else value
+            for value in properties.values()
+        ))
+
+        geometry = feature.get("geometry")
+        geom_type = geometry.get("type") if geometry else None
+        coordinates = geometry.get("coordinates") if geometry else None
+        if geom_type == "LineString" and coordinates:
+            parts = [coordinates]
+            code = GEOM_LINESTRING
+        elif geom_type == "MultiLineString" and coordinates and all(coordinates):
+            parts = coordinates
+            code = GEOM_MULTILINESTRING
+        else:
+            parts = []
+            code = GEOM_RAW
+            self._raw_geometries[row] = geometry
+
+        dims = len(parts[0][0]) if parts else 0
+        if any(len(point) != dims for part in parts for point in part):
+            parts = []
+            code = GEOM_RAW
+            self._raw_geometries[row] = geometry
+            dims = 0
+
+        for part in parts:
+            for point in part:
+                self._coords.extend(point)
+            self._part_offsets.append(len(self._coords))
+        self._row_parts.append(len(self._part_offsets) - 1)
+        self._geom_types.append(code)
+        self._dims.append(dims)
+
+        self._ids.append(cote_rue_id)
+        self._index[cote_rue_id] = row
+
+    @classmethod
+    def from_features(cls, features: Iterable[Dict[str, Any]]) -> "StreetStore":
+        store = cls()
+        for feature in features:
+            store.add(feature)
+        return store
+
+    # Lookups
+
+    def _row(self, cote_rue_id) -> int:
+        try:
+            return self._index[cote_rue_id]
+        except (KeyError, TypeError):
+            raise KeyError(cote_rue_id)
+
+    def properties(self, cote_rue_id) -> Dict[str, Any]:
+        row = self._row(cote_rue_id)
+        return dict(zip(self._keys[self._row_keys[row]], self._values[row]))
+
+    def coordinate_parts(self, cote_rue_id) -> List[array]:
+        """Coordinates of each LineString part as flat float64 arrays (x, y[, z], x, y, ...)"""
+        row = self._row(cote_rue_id)
+        offsets = self._part_offsets
+        return [
+            self._coords[offsets[part]:offsets[part + 1]]
+            for part in range(self._row_parts[row], self._row_parts[row + 1])
+        ]
+
+    def geometry(self, cote_rue_id) -> Optional[Dict[str, Any]]:
+        """Rebuild the GeoJSON geometry of a street side"""
+        row = self._row(cote_rue_id)
+        code = self._geom_types[row]
+        if code == GEOM_RAW:
+            return self._raw_geometries.get(row)
+
+        dims = self._dims[row]
+        lines = []
+        for flat in self.coordinate_parts(cote_rue_id):
+            values = flat.tolist()
+            lines.append([values[i:i + dims] for i in range(0, len(values), dims)])
+        if code == GEOM_LINESTRING:
+            return {"type": "LineString", "coordinates": lines[0]}
+        return {"type": "MultiLineString", "coordinates": lines}
+
+    def __getitem__(self, cote_rue_id) -> Dict[str, Any]:
+        return {
+            "type": "Feature",
+            "properties": self.properties(cote_rue_id),
+            "geometry": self.geometry(cote_rue_id),
+        }
+
+    def __contains__(self, cote_rue_id) -> bool:
+        return cote_rue_id in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    # Persistence
+
+    def save(self, path: str, source_size: int = 0) -> None:
+        """
+        Write the store to disk: a fixed header, the raw arrays, then the properties (pickled).
+        `source_size` is the size of the gbdouble.json the store was built from.
+        """
+        tmp_path = path + ".part"
+        with open(tmp_path, "wb") as f:
+            f.write(STORE_HEADER.pack(
+                STORE_MAGIC, STORE_VERSION, len(self._ids), len(self._part_offsets),
+                len(self._coords), source_size
+            ))
+            for values in (self._ids, self._row_keys, self._geom_types, self._dims,
+                           self._row_parts, self._part_offsets, self._coords):
+                values.tofile(f)
+            pickle.dump((self._keys, self._values, self._raw_geometries), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, source_size: Optional[int] = None) -> "StreetStore":
+        """
+        Load a store written by save().
+        Raises ValueError if the file has another format or was built from a different source size.
+        """
+        store = cls()
+        with open(path, "rb") as f:
+            magic, version, rows, parts, coords, size = STORE_HEADER.unpack(f.read(STORE_HEADER.size))
+            if magic != STORE_MAGIC or version != STORE_VERSION:
+                raise ValueError(f"Unsupported geobase store: {path}")
+            if source_size is not None and size != source_size:
+                raise ValueError(f"Geobase store {path} is stale")
+            store._ids.fromfile(f, rows)
+            store._row_keys.fromfile(f, rows)
+            store._geom_types.fromfile(f, rows)
+            store._dims.fromfile(f, rows)
+            store._row_parts = array("q")
+            store._row_parts.fromfile(f, rows + 1)
+            store._part_offsets = array("q")
+            store._part_offsets.fromfile(f, parts)
+            store._coords.fromfile(f, coords)
+            store._keys, store._values, store._raw_geometries = pickle.load(f)
+        store._index = {cote_rue_id: row for row, cote_rue_id in enumerate(store._ids)}
+        store._strings = {}
+        return store
+
+
+def _build_store(features: Iterable[Dict[str, Any]], source: str) -> StreetStore:
+    """Consume the features yielded by iter_features() into a StreetStore"""
+    store = StreetStore()
+    empty_coordinates = 0
+    for feature in features:
+        if not (feature.get("geometry") or {}).get("coordinates"):
+            empty_coordinates += 1
+        store.add(feature)
+    store._strings = {}
+
+    if empty_coordinates:
+        print(f"Warning: {empty_coordinates} feature(s) with empty coordinates in {source}")
+    return store
+
+
+def download_geobase(url: str = GBDOUBLE_URL, cache_dir: str = GEOBASE_CACHE_DIR, timeout: int = 300) -> Tuple[str, Optional[StreetStore]]:
+    """
+    Download gbdouble.json into the cache directory, skipping the transfer when unchanged.
+    Sends If-None-Match / If-Modified-Since from the previous download; a 304 keeps the cached file.
+    A new version is requested gzip-encoded and parsed while it streams to disk, so the street
+    store is built and saved as soon as the download completes.
+
+    Args:
+        url: gbdouble.json download URL
+        cache_dir: Cache directory
+        timeout: Request timeout in seconds
+
+    Returns:
+        Tuple of (path to the cached gbdouble.json, the new StreetStore or None if not modified)
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, GEOBASE_FILENAME)
+    store_path = os.path.join(cache_dir, STORE_FILENAME)
+    meta = _read_meta(cache_dir)
+
+    headers = {"Accept-Encoding": "gzip"}
+    if os.path.exists(path) and meta.get("url") == url:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    with requests.get(url, headers=headers, stream=True, timeout=timeout) as response:
+        if response.status_code == 304:
+            return path, None
+        response.raise_for_status()
+
+        # Write to a temporary file first so an interrupted download never replaces a good cache.
+        # iter_content() transparently decompresses a gzip Content-Encoding.
+        tmp_path = path + ".part"
+        with open(tmp_path, "wb") as f:
+            chunks = _tee_to_file(response.iter_content(chunk_size=CHUNK_SIZE), f)
+            store = _build_store(iter_features(chunks), url)
+        os.replace(tmp_path, path)
+        store.save(store_path, os.path.getsize(path))
+
+        _write_meta(cache_dir, {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        })
+    return path, store
+
+
+def build_store(json_path: str, store_path: str) -> StreetStore:
+    """
+    Stream gbdouble.json once into a StreetStore and save it next to the file.
+
+    Args:
+        json_path: Path to gbdouble.json
+        store_path: Path of the store file to write
+
+    Returns:
+        The new StreetStore
+    """
+    store = _build_store(iter_features(iter_file_chunks(json_path)), json_path)
+    store.save(store_path, os.path.getsize(json_path))
+    return store
+
+
+def iter_geobase(path: str) -> Iterator[Dict[str, Any]]:
+    """Yield the features of a gbdouble.json file one at a time without loading the whole document"""
+    yield from iter_features(iter_file_chunks(path))
+
+
+def load_geobase(url: str = GBDOUBLE_URL, cache_dir: str = GEOBASE_CACHE_DIR) -> StreetStore:
+    """
+    Return the geobase as a StreetStore, downloading gbdouble.json only if it changed
+    and rebuilding the store only when the cached file changed.
+    Falls back to the cached copy if the download fails.
+    """
+    json_path = os.path.join(cache_dir, GEOBASE_FILENAME)
+    store_path = os.path.join(cache_dir, STORE_FILENAME)
+
+    try:
+        json_path, store = download_geobase(url, cache_dir)
+        if store is not None:
+            print("Downloaded a new version of gbdouble.json")
+            return store
+        print("gbdouble.json not modified, using cached copy")
+    except Exception as e:
+        if not os.path.exists(json_path):
+            raise
+        print(f"Warning: Could not download gbdouble.json ({str(e)}), using cached copy")
+
+    try:
+        return StreetStore.load(store_path, os.path.getsize(json_path))
+    except (FileNotFoundError, ValueError, EOFError, pickle.UnpicklingError):
+        pass
+
+    print("Building gbdouble.json street store...")
+    store = build_store(json_path, store_path)
+    print(f"Stored {len(store)} street sides")
+    return store
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""Fixed-precision street coordinates: quantized GeoJSON and encoded polylines"""
+from typing import Optional, Dict, Any, List
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Decimal places kept in stored and served coordinates; 6 is ~0.1 m, well under the geobase accuracy
+COORDINATE_PRECISION = int(os.environ.get("COORDINATE_PRECISION", "6"))
+
+
+def quantize_coordinates(coordinates, precision: int = COORDINATE_PRECISION) -> List[List[float]]:
+    """
+    Round the positions of a line to `precision` decimal places.
+    Consecutive positions that become equal are merged, but a line keeps at least two positions.
+    """
+    quantized = []
+    for position in coordinates:
+        point = [round(value, precision) for value in position[:2]]
+        if not quantized or point != quantized[-1]:
+            quantized.append(point)
+    if len(quantized) == 1 and len(coordinates) > 1:
+        quantized.append(list(quantized[0]))
+    return quantized
+
+
+def quantize_geometry(geometry: Optional[Dict[str, Any]], precision: int = COORDINATE_PRECISION) -> Optional[Dict[str, Any]]:
+    """Copy of a LineString or MultiLineString GeoJSON geometry with quantized coordinates (other types are returned as is)"""
+    if not geometry or not geometry.get("coordinates"):
+        return geometry
+    if geometry.get("type") == "LineString":
+        return {"type": "LineString", "coordinates": quantize_coordinates(geometry["coordinates"], precision)}
+    if geometry.get("type") == "MultiLineString":
+        return {
+            "type": "MultiLineString",
+            "coordinates": [quantize_coordinates(line, precision) for line in geometry["coordinates"]],
+        }
+    return geometry
+
+
+def _encode_value(value: int, chunks: List[str]) -> None:
+    value = ~(value << 1) if value < 0 else value << 1
+    while value >= 0x20:
+        chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+        value >>= 5
+    chunks.append(chr(value + 63))
+
+
+def encode_polyline(coordinates, precision: int = COORDINATE_PRECISION) -> str:
+    """
+    Encoded polyline of [lng, lat] positions, as PostGIS ST_AsEncodedPolyline(geom, precision) writes it:
+    latitude first, each position stored as the zigzag varint delta from the previous one.
+    """
+    factor = 10 ** precision
+    chunks = []
+    previous_lat = previous_lng = 0
+    for position in coordinates:
+        lat = round(position[1] * factor)
+        lng = round(position[0] * factor)
+        _encode_value(lat - previous_lat, chunks)
+        _encode_value(lng - previous_lng, chunks)
+        previous_lat, previous_lng = lat, lng
+    return "".join(chunks)
+
+
+def decode_polyline(encoded: str, precision: int = COORDINATE_PRECISION) -> List[List[float]]:
+    """[lng, lat] positions of an encoded polyline (inverse of encode_polyline)"""
+    factor = 10 ** precision
+    coordinates = []
+    values = []
+    value = shift = 0
+    for char in encoded:
+        byte = ord(char) - 63
+        value |= (byte & 0x1f) << shift
+        shift += 5
+        if byte < 0x20:
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            value = shift = 0
+    lat = lng = 0
+    for i in range(0, len(values) - 1, 2):
+        lat += values[i]
+        lng += values[i + 1]
+        coordinates.append([round(lng / factor, precision), round(lat / factor, precision)])
+    return coordinates
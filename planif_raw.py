@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""Raw SOAP access to the PlanifNeige API: posts the envelope directly and stream-parses the reply"""
+from datetime import datetime
+from typing import Dict, Any, List, Tuple, Iterator
+from xml.etree.ElementTree import iterparse
+from xml.sax.saxutils import escape
+import requests
+
+# Namespace of the GetPlanificationsForDate operation (same envelope as test/test.py)
+SERVICE_NAMESPACE = "https://servicesenlignedev.ville.montreal.qc.ca"
+
+XSI_NIL = "{http://www.w3.org/2001/XMLSchema-instance}nil"
+
+ENVELOPE = """<?xml version="1.0" encoding="UTF-8"?>
+<soapenv:Envelope
+    xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/"
+    xmlns:ser="{namespace}">
+  <soapenv:Header/>
+  <soapenv:Body>
+    <ser:GetPlanificationsForDate>
+        <getPlanificationsForDate>
+            <fromDate>{from_date}</fromDate>
+            <tokenString>{token}</tokenString>
+        </getPlanificationsForDate>
+    </ser:GetPlanificationsForDate>
+  </soapenv:Body>
+</soapenv:Envelope>
+"""
+
+# Planification fields typed as xsd:long/int and xsd:dateTime in the WSDL; anything else is kept as text
+INT_FIELDS = frozenset(("munid", "coteRueId", "etatDeneig"))
+DATE_FIELDS = frozenset((
+    "dateDebutPlanif", "dateFinPlanif",
+    "dateDebutReplanif", "dateFinReplanif", "dateMaj",
+))
+
+
+def endpoint_url(wsdl_url: str) -> str:
+    """SOAP endpoint of the service, i.e. the WSDL URL without its ?WSDL query"""
+    return wsdl_url.split("?", 1)[0]
+
+
+def build_envelope(from_date: str, token: str) -> bytes:
+    """Build the GetPlanificationsForDate request envelope"""
+    return ENVELOPE.format(
+        namespace=SERVICE_NAMESPACE,
+        from_date=escape(str(from_date)),
+        token=escape(token),
+    ).encode("utf-8")
+
+
+def to_iso(value: str) -> str:
+    """
+    Normalize an xsd:dateTime to the ISO string the zeep path produces
+    (datetime.replace(microsecond=0).isoformat()).
+    """
+    # Common case: already "YYYY-MM-DDTHH:MM:SS" without fraction or offset
+    if len(value) == 19:
+        return value
+    return datetime.fromisoformat(value).replace(microsecond=0).isoformat()
+
+
+def _local_name(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def iter_planifications(source) -> Iterator[Dict[str, Any]]:
+    """
+    Stream-parse a GetPlanificationsForDate reply and yield one record per <planification>.
+
+    Records are plain dicts with the same keys and value types as the zeep path
+    (integers for the id/state fields, ISO strings for dates, None for nil values).
+    Each element is dropped once read, so memory stays flat whatever the reply size.
+
+    Args:
+        source: File name or binary file-like object holding the SOAP reply
+
+    Raises:
+        Exception: On a SOAP fault or a non-zero responseStatus
+    """
+    status = None
+    container = None  # <planifications>, read records are removed from it
+    
+    for event, elem in iterparse(source, events=("start", "end")):
+        name = _local_name(elem.tag)
+        
+        if event == "start":
+            if name == "planifications":
+                container = elem
+            continue
+        
+        if name == "planification":
+            record = {}
+            for child in elem:
+                field = _local_name(child.tag)
+                text = child.text
+                if text is None or child.get(XSI_NIL) in ("true", "1"):
+                    record[field] = None
+                    continue
+                text = text.strip()
+                if field in INT_FIELDS:
+                    record[field] = int(text)
+                elif field in DATE_FIELDS:
+                    record[field] = to_iso(text) if text else None
+                else:
+                    record[field] = text
+            if container is not None:
+                container.remove(elem)
+            yield record
+        elif name == "responseStatus":
+            status = int(elem.text)
+            if status != 0:
+                raise Exception(f"API returned status code: {status}")
+        elif name == "faultstring":
+            raise Exception(f"API returned SOAP fault: {elem.text}")
+    
+    if status is None:
+        raise Exception("API returned status code: -1")
+
+
+def fetch_planifications(
+    session: requests.Session,
+    wsdl_url: str,
+    from_date: str,
+    token: str,
+    timeout: int = 300
+) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Post GetPlanificationsForDate directly and parse the reply while it downloads.
+
+    Args:
+        session: HTTP session (headers such as User-Agent are reused)
+        wsdl_url: WSDL URL of the service
+        from_date: ISO date to fetch planifications from
+        token: API token
+        timeout: Request timeout in seconds
+
+    Returns:
+        Tuple of (planification records, result dict with the responseStatus)
+    """
+    response = session.post(
+        endpoint_url(wsdl_url),
+        data=build_envelope(from_date, token),
+        headers={"Content-Type": "text/xml; charset=utf-8", "SOAPAction": '""'},
+        stream=True,
+        timeout=timeout,
+    )
+    try:
+        # SOAP faults come back as HTTP 500 with a fault envelope, parsed below
+        if response.status_code not in (200, 500):
+            response.raise_for_status()
+        response.raw.decode_content = True
+        planification_list = list(iter_planifications(response.raw))
+    finally:
+        response.close()
+
+    return planification_list, {"responseStatus": 0, "planifications": {"planification": planification_list}}
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""Versioned static snapshots of the current snow removal status of every street side (columnar binary + gzip JSON)"""
+from typing import Optional, Dict, Any, Tuple
+import os
+import sys
+import gzip
+import json
+import time
+import struct
+import hashlib
+import argparse
+from array import array
+from datetime import datetime, timezone
+import psycopg2
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR", "snapshots")
+# Versions kept on disk (with the patches between them) for clients polling an older one
+SNAPSHOT_KEEP = int(os.environ.get("SNAPSHOT_KEEP", "48"))
+
+MAGIC = b"PNSS"
+FORMAT_VERSION = 1
+# magic, format version, row count, snapshot version (unix seconds)
+HEADER = struct.Struct("<4sHIQ")
+
+# deneigement_current date columns, stored as unix seconds (0 = NULL)
+DATE_COLUMNS = ["date_debut_planif", "date_fin_planif", "date_debut_replanif", "date_fin_replanif", "date_maj"]
+COLUMNS = ["cote_rue_id", "etat_deneig"] + DATE_COLUMNS
+
+
+def fetch_status(db_conn) -> Dict[str, list]:
+    """Current status of every street side, as columns sorted by cote_rue_id"""
+    with db_conn.cursor() as cur:
+        cur.execute("""
+            SELECT cote_rue_id, etat_deneig,
+                   extract(epoch FROM date_debut_planif)::bigint,
+                   extract(epoch FROM date_fin_planif)::bigint,
+                   extract(epoch FROM date_debut_replanif)::bigint,
+                   extract(epoch FROM date_fin_replanif)::bigint,
+                   extract(epoch FROM date_maj)::bigint
+            FROM deneigement_current
+            ORDER BY cote_rue_id
+        """)
+        rows = cur.fetchall()
+    columns = {column: [] for column in COLUMNS}
+    for row in rows:
+        for column, value in zip(COLUMNS, row):
+            columns[column].append(value)
+    return columns
+
+
+def content_hash(columns: Dict[str, list]) -> str:
+    """Hash of the status columns, independent of the snapshot version"""
+    digest = hashlib.sha256()
+    for column in COLUMNS:
+        digest.update(json.dumps(columns[column], separators=(",", ":")).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _little_endian(values: array) -> bytes:
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def encode_binary(columns: Dict[str, list], version: int) -> bytes:
+    """
+    Columnar little-endian encoding:
+    header, cote_rue_id deltas (uint32, ids are sorted), etat_deneig (int8, -1 = NULL),
+    then one uint32 column of unix seconds per DATE_COLUMNS entry (0 = NULL).
+    """
+    ids = columns["cote_rue_id"]
+    deltas = array("I", (cote_rue_id - previous for previous, cote_rue_id in zip([0] + ids[:-1], ids)))
+    parts = [
+        HEADER.pack(MAGIC, FORMAT_VERSION, len(ids), version),
+        _little_endian(deltas),
+        _little_endian(array("b", (-1 if etat is None else etat for etat in columns["etat_deneig"]))),
+    ]
+    for column in DATE_COLUMNS:
+        parts.append(_little_endian(array("I", (value or 0 for value in columns[column]))))
+    return b"".join(parts)
+
+
+def decode_binary(data: bytes) -> Tuple[int, Dict[str, list]]:
+    """
+    Decode a snapshot written by encode_binary.
+
+    Returns:
+        Tuple of (snapshot version, columns)
+    """
+    magic, format_version, count, version = HEADER.unpack_from(data)
+    if magic != MAGIC or format_version != FORMAT_VERSION:
+        raise ValueError(f"Not a status snapshot (format {format_version})")
+    offset = HEADER.size
+
+    def read(typecode):
+        nonlocal offset
+        values = array(typecode)
+        size = values.itemsize * count
+        values.frombytes(data[offset:offset + size])
+        if sys.byteorder == "big":
+            values.byteswap()
+        offset += size
+        return values
+
+    ids = []
+    current = 0
+    for delta in read("I"):
+        current += delta
+        ids.append(current)
+    columns = {
+        "cote_rue_id": ids,
+        "etat_deneig": [None if etat == -1 else etat for etat in read("b")],
+    }
+    for column in DATE_COLUMNS:
+        columns[column] = [value or None for value in read("I")]
+    return version, columns
+
+
+def encode_json(columns: Dict[str, list], version: int) -> bytes:
+    """Gzip JSON with the same columns (dates as unix seconds or null)"""
+    document = {"version": version, "count": len(columns["cote_rue_id"]), "columns": columns}
+    return gzip.compress(json.dumps(document, separators=(",", ":")).encode("utf-8"), mtime=0)
+
+
+def to_rows(columns: Dict[str, list]) -> Dict[int, tuple]:
+    """cote_rue_id -> (etat_deneig, dates...) for diffing"""
+    return {
+        cote_rue_id: tuple(columns[column][i] for column in COLUMNS[1:])
+        for i, cote_rue_id in enumerate(columns["cote_rue_id"])
+    }
+
+
+def diff_snapshots(old: Dict[str, list], new: Dict[str, list]) -> Dict[str, Any]:
+    """
+    Changes from one snapshot to another.
+
+    Returns:
+        {"changed": {cote_rue_id: [etat_deneig, dates...]}, "removed": [cote_rue_id, ...]};
+        street sides added in new are listed in changed
+    """
+    old_rows = to_rows(old)
+    new_rows = to_rows(new)
+    return {
+        "changed": {cote_rue_id: list(row) for cote_rue_id, row in new_rows.items() if old_rows.get(cote_rue_id) != row},
+        "removed": sorted(cote_rue_id for cote_rue_id in old_rows if cote_rue_id not in new_rows),
+    }
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    with open(path + ".part", "wb") as f:
+        f.write(data)
+    os.replace(path + ".part", path)
+
+
+def load_manifest(snapshot_dir: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(os.path.join(snapshot_dir, "latest.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def load_snapshot(snapshot_dir: str, version: int) -> Dict[str, list]:
+    with open(os.path.join(snapshot_dir, f"status-{version}.bin"), "rb") as f:
+        return decode_binary(f.read())[1]
+
+
+def prune(snapshot_dir: str, keep: int) -> None:
+    """Delete the files of all but the `keep` latest versions"""
+    versions = sorted(
+        int(name[len("status-"):-len(".bin")])
+        for name in os.listdir(snapshot_dir)
+        if name.startswith("status-") and name.endswith(".bin")
+    )
+    stale = set(versions[:-keep]) if keep > 0 else set()
+    for name in os.listdir(snapshot_dir):
+        if not name.startswith(("status-", "patch-")):
+            continue
+        stem = name.split(".", 1)[0]
+        if any(int(part) in stale for part in stem.split("-")[1:] if part.isdigit()):
+            os.remove(os.path.join(snapshot_dir, name))
+
+
+def export_snapshot(db_conn, snapshot_dir: str = SNAPSHOT_DIR, keep: int = SNAPSHOT_KEEP) -> Optional[Dict[str, Any]]:
+    """
+    Write a new snapshot version if the status changed since the latest one.
+
+    Files written in snapshot_dir:
+        status-{version}.bin          columnar binary (encode_binary)
+        status-{version}.json.gz      the same columns as gzip JSON
+        patch-{previous}-{version}.json.gz  diff_snapshots() from the previous version
+        latest.json                   manifest, written last so clients never see a partial version
+
+    Args:
+        db_conn: psycopg2 connection
+        snapshot_dir: Output directory
+        keep: Number of versions kept on disk
+
+    Returns:
+        The new manifest, or None if the status did not change
+    """
+    columns = fetch_status(db_conn)
+    digest = content_hash(columns)
+    manifest = load_manifest(snapshot_dir)
+    if manifest and manifest.get("sha256") == digest:
+        return None
+
+    os.makedirs(snapshot_dir, exist_ok=True)
+    version = int(time.time())
+    if manifest and version <= manifest["version"]:
+        version = manifest["version"] + 1
+    binary = encode_binary(columns, version)
+    _write_atomic(os.path.join(snapshot_dir, f"status-{version}.bin"), binary)
+    json_gz = encode_json(columns, version)
+    _write_atomic(os.path.join(snapshot_dir, f"status-{version}.json.gz"), json_gz)
+
+    new_manifest = {
+        "version": version,
+        "generated_at": datetime.fromtimestamp(version, timezone.utc).isoformat(),
+        "count": len(columns["cote_rue_id"]),
+        "sha256": digest,
+        "bin": f"status-{version}.bin",
+        "bin_bytes": len(binary),
+        "json": f"status-{version}.json.gz",
+        "json_bytes": len(json_gz),
+        "columns": COLUMNS,
+    }
+    if manifest:
+        try:
+            patch = diff_snapshots(load_snapshot(snapshot_dir, manifest["version"]), columns)
+            patch_name = f"patch-{manifest['version']}-{version}.json.gz"
+            document = {"from": manifest["version"], "to": version, "columns": COLUMNS[1:], **patch}
+            _write_atomic(
+                os.path.join(snapshot_dir, patch_name),
+                gzip.compress(json.dumps(document, separators=(",", ":")).encode("utf-8"), mtime=0)
+            )
+            new_manifest.update({"previous": manifest["version"], "patch": patch_name,
+                                 "patch_changed": len(patch["changed"]), "patch_removed": len(patch["removed"])})
+        except FileNotFoundError:
+            pass
+
+    _write_atomic(os.path.join(snapshot_dir, "latest.json"), json.dumps(new_manifest, indent=2).encode("utf-8"))
+    prune(snapshot_dir, keep)
+    return new_manifest
+
+
+def parse_args(argv=None):
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Export or diff status snapshots")
+    parser.add_argument("--snapshot-dir", default=SNAPSHOT_DIR, help="output directory (env SNAPSHOT_DIR, default: snapshots)")
+    parser.add_argument("--diff", nargs=2, type=int, metavar=("OLD", "NEW"), help="print the changes between two versions")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Export a snapshot of the current status, or diff two versions"""
+    args = parse_args(argv)
+
+    if args.diff:
+        old_version, new_version = args.diff
+        patch = diff_snapshots(load_snapshot(args.snapshot_dir, old_version), load_snapshot(args.snapshot_dir, new_version))
+        for cote_rue_id, row in patch["changed"].items():
+            print(f"  {cote_rue_id}: {dict(zip(COLUMNS[1:], row))}")
+        print(f"{len(patch['changed'])} changed/added, {len(patch['removed'])} removed")
+        return 0
+
+    database_url = os.environ.get("DATABASE_URL") or os.environ.get("SUPABASE_DB_URL")
+    if not database_url:
+        print("ERROR: DATABASE_URL or SUPABASE_DB_URL not set in .env file")
+        return 1
+
+    db_conn = psycopg2.connect(database_url)
+    try:
+        manifest = export_snapshot(db_conn, args.snapshot_dir)
+    finally:
+        db_conn.close()
+    if manifest is None:
+        print("✓ Status unchanged since the latest snapshot")
+    else:
+        print(f"✓ Snapshot {manifest['version']}: {manifest['count']} street side(s), "
+              f"{manifest['bin_bytes'] / 1024:.1f} KB binary, {manifest['json_bytes'] / 1024:.1f} KB gzip JSON")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+"""In-memory packed STR tree over the normalized geobase street geometries (bbox and nearest street side queries)"""
+from array import array
+from typing import Optional, List, Tuple, Iterable
+import os
+import sys
+import math
+import time
+import heapq
+import struct
+import argparse
+import geobase
+
+INDEX_FILENAME = "gbdouble.index"
+
+INDEX_MAGIC = b"GBIX"
+INDEX_VERSION = 1
+INDEX_HEADER = struct.Struct("<4sIIqqqq")  # magic, version, node capacity, streets, coordinates, levels, size of gbdouble.json
+
+# Children per tree node
+NODE_CAPACITY = 16
+
+# Length of a degree of latitude; nearest() measures in meters on a local equirectangular projection
+METERS_PER_DEGREE = 111320.0
+
+
+def _segment_intersects_box(x1, y1, x2, y2, min_x, min_y, max_x, max_y) -> bool:
+    """Liang-Barsky clip of the segment against the box"""
+    t0, t1 = 0.0, 1.0
+    dx = x2 - x1
+    dy = y2 - y1
+    for p, q in ((-dx, x1 - min_x), (dx, max_x - x1), (-dy, y1 - min_y), (dy, max_y - y1)):
+        if p == 0:
+            if q < 0:
+                return False
+        else:
+            t = q / p
+            if p < 0:
+                if t > t1:
+                    return False
+                t0 = max(t0, t)
+            else:
+                if t < t0:
+                    return False
+                t1 = min(t1, t)
+    return True
+
+
+def str_order(boxes: array, capacity: int) -> List[int]:
+    """
+    Sort-Tile-Recursive order of the boxes (flat min_x, min_y, max_x, max_y):
+    vertical slices of about sqrt(n / capacity) leaves sorted by center x, each sorted by center y.
+    """
+    count = len(boxes) // 4
+    if count == 0:
+        return []
+    leaves = math.ceil(count / capacity)
+    slice_size = math.ceil(math.sqrt(leaves)) * capacity
+    by_x = sorted(range(count), key=lambda i: boxes[4 * i] + boxes[4 * i + 2])
+    order = []
+    for start in range(0, count, slice_size):
+        order.extend(sorted(by_x[start:start + slice_size], key=lambda i: boxes[4 * i + 1] + boxes[4 * i + 3]))
+    return order
+
+
+class StreetIndex:
+    """
+    Packed STR tree of street side LineStrings.
+
+    The street sides are stored in STR order: their ids in an int64 array, their coordinates
+    as one float64 array (x, y, x, y, ...) sliced by offsets. Tree nodes have no pointers:
+    level 0 holds one box per street side, and node i of level L + 1 covers nodes
+    i * NODE_CAPACITY to (i + 1) * NODE_CAPACITY - 1 of level L. All boxes live in one
+    float64 array, level after level, so the whole index loads with a few array reads.
+    """
+
+    def __init__(self, node_capacity: int = NODE_CAPACITY):
+        self.node_capacity = node_capacity
+        self._ids = array("q")
+        self._coord_offsets = array("q", [0])  # street i owns _coords[_coord_offsets[i]:_coord_offsets[i + 1]]
+        self._coords = array("d")
+        self._level_starts = array("q", [0])  # level L owns nodes _level_starts[L]:_level_starts[L + 1]
+        self._boxes = array("d")  # min_x, min_y, max_x, max_y per node
+        self._index = {}  # cote_rue_id -> position
+
+    # Building
+
+    @classmethod
+    def build(cls, lines: Iterable[Tuple[int, List[List[float]]]], node_capacity: int = NODE_CAPACITY) -> "StreetIndex":
+        """
+        Build the tree from (cote_rue_id, LineString coordinates) pairs.
+        Lines with less than two positions are skipped; only x and y are kept.
+        """
+        ids = []
+        parts = []
+        boxes = array("d")
+        for cote_rue_id, coordinates in lines:
+            if not coordinates or len(coordinates) < 2:
+                continue
+            xs = [position[0] for position in coordinates]
+            ys = [position[1] for position in coordinates]
+            ids.append(cote_rue_id)
+            parts.append((xs, ys))
+            boxes.extend((min(xs), min(ys), max(xs), max(ys)))
+
+        index = cls(node_capacity)
+        for position in str_order(boxes, node_capacity):
+            xs, ys = parts[position]
+            index._ids.append(ids[position])
+            for x, y in zip(xs, ys):
+                index._coords.append(x)
+                index._coords.append(y)
+            index._coord_offsets.append(len(index._coords))
+            index._boxes.extend(boxes[4 * position:4 * position + 4])
+        index._level_starts.append(len(index._ids))
+
+        # Pack consecutive nodes of each level until a single root is left
+        size = len(index._ids)
+        while size > 1 or len(index._level_starts) == 2:
+            start = index._level_starts[-2]
+            for first in range(0, size, node_capacity):
+                last = min(first + node_capacity, size)
+                children = index._boxes[4 * (start + first):4 * (start + last)]
+                index._boxes.extend((min(children[0::4]), min(children[1::4]), max(children[2::4]), max(children[3::4])))
+            size = math.ceil(size / node_capacity)
+            index._level_starts.append(index._level_starts[-1] + size)
+            if size == 0:
+                break
+        index._index = {cote_rue_id: position for position, cote_rue_id in enumerate(index._ids)}
+        return index
+
+    @classmethod
+    def from_geobase(cls, store, node_capacity: int = NODE_CAPACITY) -> "StreetIndex":
+        """Index every street side of a geobase.StreetStore with its normalized LineString (as stored in streets.geometry)"""
+        def lines():
+            for cote_rue_id in store:
+                geometry = store.geometry(cote_rue_id)
+                normalized = geobase.normalize_to_linestring(geometry) if geometry else None
+                if normalized and normalized.get("type") == "LineString":
+                    yield cote_rue_id, normalized["coordinates"]
+        return cls.build(lines(), node_capacity)
+
+    # Queries
+
+    def _children(self, level: int, node: int) -> range:
+        size = self._level_starts[level] - self._level_starts[level - 1]
+        return range(node * self.node_capacity, min((node + 1) * self.node_capacity, size))
+
+    def _line_intersects_box(self, position: int, min_x, min_y, max_x, max_y) -> bool:
+        coords = self._coords
+        start = self._coord_offsets[position]
+        end = self._coord_offsets[position + 1]
+        x1, y1 = coords[start], coords[start + 1]
+        if min_x <= x1 <= max_x and min_y <= y1 <= max_y:
+            return True
+        for i in range(start + 2, end, 2):
+            x2, y2 = coords[i], coords[i + 1]
+            if _segment_intersects_box(x1, y1, x2, y2, min_x, min_y, max_x, max_y):
+                return True
+            x1, y1 = x2, y2
+        return False
+
+    def query(self, min_lng: float, min_lat: float, max_lng: float, max_lat: float, exact: bool = True) -> List[int]:
+        """
+        cote_rue_ids of the street sides intersecting a bounding box.
+
+        Args:
+            min_lng, min_lat, max_lng, max_lat: Bounding box in degrees
+            exact: Test the LineStrings themselves (like ST_Intersects in get_streets_in_bbox);
+                False returns every street side whose bounding box intersects
+
+        Returns:
+            List of cote_rue_ids, in index order
+        """
+        if not self._ids:
+            return []
+        boxes = self._boxes
+        starts = self._level_starts
+        results = []
+        # Nodes whose box intersects, children tested before they are pushed
+        stack = [(len(starts) - 2, 0)]
+        while stack:
+            level, node = stack.pop()
+            offset = starts[level - 1]
+            for child in self._children(level, node):
+                b = 4 * (offset + child)
+                if boxes[b] > max_lng or boxes[b + 2] < min_lng or boxes[b + 1] > max_lat or boxes[b + 3] < min_lat:
+                    continue
+                if level > 1:
+                    stack.append((level - 1, child))
+                elif not exact or self._line_intersects_box(child, min_lng, min_lat, max_lng, max_lat):
+                    results.append(self._ids[child])
+        return results
+
+    def _line_distance(self, position: int, x: float, y: float, kx: float, ky: float) -> float:
+        """Distance in meters from the point to the LineString"""
+        coords = self._coords
+        start = self._coord_offsets[position]
+        end = self._coord_offsets[position + 1]
+        best = math.inf
+        x1, y1 = (coords[start] - x) * kx, (coords[start + 1] - y) * ky
+        for i in range(start + 2, end, 2):
+            x2, y2 = (coords[i] - x) * kx, (coords[i + 1] - y) * ky
+            dx = x2 - x1
+            dy = y2 - y1
+            length = dx * dx + dy * dy
+            t = 0.0 if length == 0 else max(0.0, min(1.0, -(x1 * dx + y1 * dy) / length))
+            px = x1 + t * dx
+            py = y1 + t * dy
+            best = min(best, px * px + py * py)
+            x1, y1 = x2, y2
+        return math.sqrt(best)
+
+    def nearest(self, lng: float, lat: float, k: int = 1, max_distance: Optional[float] = None) -> List[Tuple[int, float]]:
+        """
+        The k street sides closest to a point (best-first search).
+
+        Args:
+            lng, lat: Point in degrees
+            k: Number of street sides
+            max_distance: Optional search radius in meters
+
+        Returns:
+            List of (cote_rue_id, distance in meters), closest first
+        """
+        if not self._ids or k <= 0:
+            return []
+        kx = math.cos(math.radians(lat)) * METERS_PER_DEGREE
+        ky = METERS_PER_DEGREE
+        boxes = self._boxes
+        starts = self._level_starts
+        results = []
+        # (lower bound of the distance, level, node); level -1 is a street side at its exact distance
+        heap = [(0.0, len(starts) - 2, 0)]
+        while heap and len(results) < k:
+            distance, level, node = heapq.heappop(heap)
+            if max_distance is not None and distance > max_distance:
+                break
+            if level < 0:
+                results.append((self._ids[node], distance))
+            elif level == 0:
+                heapq.heappush(heap, (self._line_distance(node, lng, lat, kx, ky), -1, node))
+            else:
+                for child in self._children(level, node):
+                    b = 4 * (starts[level - 1] + child)
+                    dx = max(boxes[b] - lng, 0.0, lng - boxes[b + 2]) * kx
+                    dy = max(boxes[b + 1] - lat, 0.0, lat - boxes[b + 3]) * ky
+                    heapq.heappush(heap, (math.sqrt(dx * dx + dy * dy), level - 1, child))
+        return results
+
+    def extent(self) -> Optional[Tuple[float, float, float, float]]:
+        """Bounding box of every indexed street side (the root box), or None if the index is empty"""
+        if not self._ids:
+            return None
+        return tuple(self._boxes[-4:])
+
+    def bounds(self, cote_rue_id) -> Tuple[float, float, float, float]:
+        """Bounding box (min_lng, min_lat, max_lng, max_lat) of a street side"""
+        try:
+            b = 4 * self._index[cote_rue_id]
+        except (KeyError, TypeError):
+            raise KeyError(cote_rue_id)
+        return tuple(self._boxes[b:b + 4])
+
+    def coordinates(self, cote_rue_id) -> List[List[float]]:
+        """LineString coordinates of a street side"""
+        try:
+            position = self._index[cote_rue_id]
+        except (KeyError, TypeError):
+            raise KeyError(cote_rue_id)
+        values = self._coords[self._coord_offsets[position]:self._coord_offsets[position + 1]].tolist()
+        return [values[i:i + 2] for i in range(0, len(values), 2)]
+
+    def __contains__(self, cote_rue_id) -> bool:
+        return cote_rue_id in self._index
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    # Persistence
+
+    def save(self, path: str, source_size: int = 0) -> None:
+        """
+        Write the index to disk: a fixed header, then the raw arrays.
+        `source_size` is the size of the gbdouble.json the index was built from.
+        """
+        tmp_path = path + ".part"
+        with open(tmp_path, "wb") as f:
+            f.write(INDEX_HEADER.pack(
+                INDEX_MAGIC, INDEX_VERSION, self.node_capacity, len(self._ids),
+                len(self._coords), len(self._level_starts), source_size
+            ))
+            for values in (self._ids, self._coord_offsets, self._coords, self._level_starts, self._boxes):
+                values.tofile(f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, source_size: Optional[int] = None) -> "StreetIndex":
+        """
+        Load an index written by save().
+        Raises ValueError if the file has another format or was built from a different source size.
+        """
+        with open(path, "rb") as f:
+            magic, version, capacity, count, coords, levels, size = INDEX_HEADER.unpack(f.read(INDEX_HEADER.size))
+            if magic != INDEX_MAGIC or version != INDEX_VERSION:
+                raise ValueError(f"Unsupported street index: {path}")
+            if source_size is not None and size != source_size:
+                raise ValueError(f"Street index {path} is stale")
+            index = cls(capacity)
+            index._ids.fromfile(f, count)
+            index._coord_offsets = array("q")
+            index._coord_offsets.fromfile(f, count + 1)
+            index._coords.fromfile(f, coords)
+            index._level_starts = array("q")
+            index._level_starts.fromfile(f, levels)
+            index._boxes.fromfile(f, 4 * index._level_starts[-1])
+        index._index = {cote_rue_id: position for position, cote_rue_id in enumerate(index._ids)}
+        return index
+
+
+def load_street_index(store=None, cache_dir: str = geobase.GEOBASE_CACHE_DIR) -> StreetIndex:
+    """
+    Load the street index saved next to gbdouble.json, or build and save it when it is
+    missing or was built from another version of the geobase.
+
+    Args:
+        store: Optional geobase mapping to build from (default: geobase.load_geobase())
+        cache_dir: Geobase cache directory
+
+    Returns:
+        The StreetIndex
+    """
+    path = os.path.join(cache_dir, INDEX_FILENAME)
+    json_path = os.path.join(cache_dir, geobase.GEOBASE_FILENAME)
+    source_size = os.path.getsize(json_path) if os.path.exists(json_path) else 0
+    try:
+        return StreetIndex.load(path, source_size)
+    except FileNotFoundError:
+        pass
+    except ValueError as e:
+        print(f"Rebuilding street index: {str(e)}")
+
+    if store is None:
+        store = geobase.load_geobase()
+    index = StreetIndex.from_geobase(store)
+    index.save(path, source_size)
+    return index
+
+
+def parse_args(argv=None):
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Build the street index or query it")
+    parser.add_argument("--bbox", nargs=4, type=float, metavar=("MIN_LNG", "MIN_LAT", "MAX_LNG", "MAX_LAT"),
+                        help="print the street sides intersecting a bounding box")
+    parser.add_argument("--nearest", nargs=2, type=float, metavar=("LNG", "LAT"),
+                        help="print the street sides closest to a point")
+    parser.add_argument("-k", type=int, default=5, help="number of street sides for --nearest (default: 5)")
+    parser.add_argument("--rebuild", action="store_true", help="rebuild the index even if it is up to date")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Build (or load) the street index and run the requested query"""
+    args = parse_args(argv)
+
+    start = time.perf_counter()
+    if args.rebuild:
+        try:
+            os.remove(os.path.join(geobase.GEOBASE_CACHE_DIR, INDEX_FILENAME))
+        except FileNotFoundError:
+            pass
+    index = load_street_index()
+    print(f"✓ Street index: {len(index)} street side(s), {len(index._level_starts) - 1} level(s), "
+          f"ready in {time.perf_counter() - start:.2f}s")
+
+    if args.bbox:
+        start = time.perf_counter()
+        ids = index.query(*args.bbox)
+        elapsed = time.perf_counter() - start
+        print(f"{len(ids)} street side(s) in the bounding box ({elapsed * 1e6:.0f} µs)")
+        for cote_rue_id in ids[:20]:
+            print(f"  {cote_rue_id}")
+    if args.nearest:
+        start = time.perf_counter()
+        nearest = index.nearest(*args.nearest, k=args.k)
+        elapsed = time.perf_counter() - start
+        print(f"{len(nearest)} nearest street side(s) ({elapsed * 1e6:.0f} µs)")
+        for cote_rue_id, distance in nearest:
+            print(f"  {cote_rue_id}: {distance:.1f} m")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
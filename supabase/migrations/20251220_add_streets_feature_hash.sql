@@ -0,0 +1,14 @@
+/*
+  # Add feature_hash to streets
+
+  1. Columns
+    - `feature_hash` (text) - Content hash of the gbdouble feature the row was written from
+
+  2. Notes
+    - The ingest loads the stored hashes of a batch in one query and only rewrites streets
+      that are new or whose geobase feature changed, instead of rewriting every street side
+      (and its geography, GIST and GIN index entries) on every run
+    - Existing rows start with a NULL hash and are rewritten once on their next ingest
+*/
+
+ALTER TABLE streets ADD COLUMN IF NOT EXISTS feature_hash text;
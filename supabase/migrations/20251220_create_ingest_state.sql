@@ -0,0 +1,27 @@
+/*
+  # Create ingest_state table
+
+  1. New Tables
+    - `ingest_state`
+      - `key` (text, primary key) - Name of the state entry
+      - `value` (text) - Stored value
+      - `updated_at` (timestamptz) - Last time the entry was written
+
+  2. Notes
+    - `planifications_date_maj` holds the fetch high-water mark: the latest `dateMaj`
+      of the last committed ingest, kept as the API's ISO string. The next run fetches
+      from this mark minus a small overlap instead of re-fetching from the current date
+    - The bulk ingest writes the mark in the same transaction as the data; the batch
+      ingest only advances it once every batch succeeded
+
+  3. Security
+    - Enable RLS; no policies, only the service role (ingest job) reads and writes it
+*/
+
+CREATE TABLE IF NOT EXISTS ingest_state (
+  key text PRIMARY KEY,
+  value text NOT NULL,
+  updated_at timestamptz NOT NULL DEFAULT now()
+);
+
+ALTER TABLE ingest_state ENABLE ROW LEVEL SECURITY;
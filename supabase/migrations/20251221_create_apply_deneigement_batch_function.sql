@@ -0,0 +1,80 @@
+/*
+  # Create function to apply a batch of events and current states in one transaction
+
+  The ingest writes the state changes of a batch (deneigement_events) and the new
+  current states (deneigement_current) through this function when it has no direct
+  database connection, so both are committed together with one request instead of
+  one PostgREST request per row.
+
+  1. Parameters
+    - `events` (jsonb) - Array of deneigement_events rows
+      (cote_rue_id, old_etat, new_etat, old_status, new_status, event_date)
+    - `currents` (jsonb) - Array of deneigement_current rows, at most one per cote_rue_id;
+      missing or null planif dates keep the stored value
+
+  2. Returns
+    - Number of deneigement_current rows written
+
+  3. Security
+    - Execute is only granted to the service role (ingest job)
+*/
+
+CREATE OR REPLACE FUNCTION apply_deneigement_batch(
+  events jsonb,
+  currents jsonb
+)
+RETURNS integer
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  written integer;
+BEGIN
+  INSERT INTO deneigement_events (
+    cote_rue_id, old_etat, new_etat, old_status, new_status, event_date
+  )
+  SELECT e.cote_rue_id, e.old_etat, e.new_etat, e.old_status, e.new_status, e.event_date
+  FROM jsonb_to_recordset(COALESCE(events, '[]'::jsonb)) AS e(
+    cote_rue_id bigint,
+    old_etat smallint,
+    new_etat smallint,
+    old_status text,
+    new_status text,
+    event_date timestamptz
+  );
+
+  INSERT INTO deneigement_current (
+    cote_rue_id, etat_deneig, status,
+    date_debut_planif, date_fin_planif, date_debut_replanif, date_fin_replanif,
+    date_maj, last_seen_at
+  )
+  SELECT
+    c.cote_rue_id, c.etat_deneig, c.status,
+    c.date_debut_planif, c.date_fin_planif, c.date_debut_replanif, c.date_fin_replanif,
+    c.date_maj, now()
+  FROM jsonb_to_recordset(COALESCE(currents, '[]'::jsonb)) AS c(
+    cote_rue_id bigint,
+    etat_deneig smallint,
+    status text,
+    date_debut_planif timestamptz,
+    date_fin_planif timestamptz,
+    date_debut_replanif timestamptz,
+    date_fin_replanif timestamptz,
+    date_maj timestamptz
+  )
+  ON CONFLICT (cote_rue_id) DO UPDATE SET
+    etat_deneig = EXCLUDED.etat_deneig,
+    status = EXCLUDED.status,
+    date_debut_planif = COALESCE(EXCLUDED.date_debut_planif, deneigement_current.date_debut_planif),
+    date_fin_planif = COALESCE(EXCLUDED.date_fin_planif, deneigement_current.date_fin_planif),
+    date_debut_replanif = COALESCE(EXCLUDED.date_debut_replanif, deneigement_current.date_debut_replanif),
+    date_fin_replanif = COALESCE(EXCLUDED.date_fin_replanif, deneigement_current.date_fin_replanif),
+    date_maj = EXCLUDED.date_maj,
+    last_seen_at = now();
+
+  GET DIAGNOSTICS written = ROW_COUNT;
+  RETURN written;
+END;
+$$;
+
+REVOKE EXECUTE ON FUNCTION apply_deneigement_batch FROM public;
+GRANT EXECUTE ON FUNCTION apply_deneigement_batch TO service_role;
@@ -0,0 +1,102 @@
+/*
+  # Only rewrite changed current states in apply_deneigement_batch
+
+  Most planifications of a run repeat the stored state of their street side. Rewriting
+  those rows produced a dead tuple and WAL per row for nothing, and woke up every
+  change listener on deneigement_current. The upsert now only updates rows whose fields
+  differ; street sides seen unchanged get their last_seen_at touched with one UPDATE.
+
+  1. Parameters
+    - unchanged (`events`, `currents`)
+
+  2. Returns
+    - `written` (integer) - Number of deneigement_current rows inserted or changed
+    - `touched` (integer) - Number of rows seen unchanged (last_seen_at only)
+
+  3. Security
+    - Execute is only granted to the service role (ingest job)
+*/
+
+DROP FUNCTION IF EXISTS apply_deneigement_batch(jsonb, jsonb);
+
+CREATE FUNCTION apply_deneigement_batch(
+  events jsonb,
+  currents jsonb
+)
+RETURNS TABLE(written integer, touched integer)
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  INSERT INTO deneigement_events (
+    cote_rue_id, old_etat, new_etat, old_status, new_status, event_date
+  )
+  SELECT e.cote_rue_id, e.old_etat, e.new_etat, e.old_status, e.new_status, e.event_date
+  FROM jsonb_to_recordset(COALESCE(events, '[]'::jsonb)) AS e(
+    cote_rue_id bigint,
+    old_etat smallint,
+    new_etat smallint,
+    old_status text,
+    new_status text,
+    event_date timestamptz
+  );
+
+  CREATE TEMP TABLE batch_currents ON COMMIT DROP AS
+  SELECT *
+  FROM jsonb_to_recordset(COALESCE(currents, '[]'::jsonb)) AS c(
+    cote_rue_id bigint,
+    etat_deneig smallint,
+    status text,
+    date_debut_planif timestamptz,
+    date_fin_planif timestamptz,
+    date_debut_replanif timestamptz,
+    date_fin_replanif timestamptz,
+    date_maj timestamptz
+  );
+
+  INSERT INTO deneigement_current AS dc (
+    cote_rue_id, etat_deneig, status,
+    date_debut_planif, date_fin_planif, date_debut_replanif, date_fin_replanif,
+    date_maj, last_seen_at
+  )
+  SELECT
+    c.cote_rue_id, c.etat_deneig, c.status,
+    c.date_debut_planif, c.date_fin_planif, c.date_debut_replanif, c.date_fin_replanif,
+    c.date_maj, now()
+  FROM batch_currents c
+  ON CONFLICT (cote_rue_id) DO UPDATE SET
+    etat_deneig = EXCLUDED.etat_deneig,
+    status = EXCLUDED.status,
+    date_debut_planif = COALESCE(EXCLUDED.date_debut_planif, dc.date_debut_planif),
+    date_fin_planif = COALESCE(EXCLUDED.date_fin_planif, dc.date_fin_planif),
+    date_debut_replanif = COALESCE(EXCLUDED.date_debut_replanif, dc.date_debut_replanif),
+    date_fin_replanif = COALESCE(EXCLUDED.date_fin_replanif, dc.date_fin_replanif),
+    date_maj = EXCLUDED.date_maj,
+    last_seen_at = now()
+  WHERE
+    (dc.etat_deneig, dc.status,
+     dc.date_debut_planif, dc.date_fin_planif, dc.date_debut_replanif, dc.date_fin_replanif,
+     dc.date_maj)
+    IS DISTINCT FROM
+    (EXCLUDED.etat_deneig, EXCLUDED.status,
+     COALESCE(EXCLUDED.date_debut_planif, dc.date_debut_planif),
+     COALESCE(EXCLUDED.date_fin_planif, dc.date_fin_planif),
+     COALESCE(EXCLUDED.date_debut_replanif, dc.date_debut_replanif),
+     COALESCE(EXCLUDED.date_fin_replanif, dc.date_fin_replanif),
+     EXCLUDED.date_maj);
+
+  GET DIAGNOSTICS written = ROW_COUNT;
+
+  -- Rows written above already carry this transaction's now()
+  UPDATE deneigement_current dc
+  SET last_seen_at = now()
+  FROM batch_currents c
+  WHERE dc.cote_rue_id = c.cote_rue_id
+    AND dc.last_seen_at IS DISTINCT FROM now();
+
+  GET DIAGNOSTICS touched = ROW_COUNT;
+  RETURN NEXT;
+END;
+$$;
+
+REVOKE EXECUTE ON FUNCTION apply_deneigement_batch FROM public;
+GRANT EXECUTE ON FUNCTION apply_deneigement_batch TO service_role;
@@ -0,0 +1,16 @@
+/*
+  # Partial index on unsent notifications
+
+  dispatch_notifications.py claims the oldest unsent notifications in batches
+  (`WHERE NOT sent ORDER BY id LIMIT n FOR UPDATE SKIP LOCKED`). The index on `sent`
+  covered every row ever sent; this one only holds the unsent ones, in claim order,
+  so it stays small and a claim reads just the rows it returns.
+
+  1. Indexes
+    - `idx_notifications_unsent` on `id` where `NOT sent`
+    - Drop `idx_notifications_sent`, replaced by the partial index
+*/
+
+CREATE INDEX IF NOT EXISTS idx_notifications_unsent ON notifications(id) WHERE NOT sent;
+
+DROP INDEX IF EXISTS idx_notifications_sent;
@@ -0,0 +1,40 @@
+/*
+  # Create tile_invalidations table
+
+  1. New Tables
+    - `tile_invalidations`
+      - `id` (bigserial, primary key) - Position in the feed
+      - `created_at` (timestamptz) - When the ingest committed the changes
+      - `cote_rue_ids` (bigint[]) - Street sides whose current state changed
+      - `tiles` (text[]) - Keys (`z/x/y`) of the vector tiles drawing them
+      - `cells` (text[]) - Keys (`i,j`) of the `cell_size`-degree grid cells they intersect
+      - `min_zoom`, `max_zoom` (smallint) - Zoom range the tiles were computed for
+      - `cell_size` (double precision) - Size of the bbox cells in degrees
+
+  2. Notes
+    - One row per ingest run, written by `dirty_tiles.publish()` after the
+      data is committed, together with a NOTIFY on the `tile_invalidations` channel.
+      The payload is `{"id", "tiles", "cells"}`, or `{"id", "tile_count", "cell_count"}`
+      when the change set does not fit in a NOTIFY payload (read the row by id)
+    - Caches that missed notifications catch up by reading the rows after the last id
+      they applied (`build_tiles.py --dirty` keeps its position next to the tiles)
+    - Rows older than `INVALIDATION_RETENTION_DAYS` (default 7) are deleted by the ingest
+
+  3. Security
+    - Enable RLS; no policies, only the service role reads and writes it
+*/
+
+CREATE TABLE IF NOT EXISTS tile_invalidations (
+  id bigserial PRIMARY KEY,
+  created_at timestamptz NOT NULL DEFAULT now(),
+  cote_rue_ids bigint[] NOT NULL,
+  tiles text[] NOT NULL,
+  cells text[] NOT NULL,
+  min_zoom smallint NOT NULL,
+  max_zoom smallint NOT NULL,
+  cell_size double precision NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_tile_invalidations_created_at ON tile_invalidations(created_at);
+
+ALTER TABLE tile_invalidations ENABLE ROW LEVEL SECURITY;
@@ -0,0 +1,123 @@
+/*
+  # Add per-zoom simplified geometries to streets
+
+  `get_streets_in_bbox` returned the full-resolution geometry (in `geometry` and in
+  `street_feature`) of every street in view, even at zoom levels where most vertices
+  fall within the same screen pixel. The ingest now also stores topology-preserving
+  simplifications of the normalized LineString, and the function picks the one
+  matching the requested zoom.
+
+  1. Modified Tables
+    - `streets`
+      - `geometry_z11` (geography linestring) - Simplified for zoom <= 11
+      - `geometry_z13` (geography linestring) - Simplified for zoom 12-13
+      - `geometry_z15` (geography linestring) - Simplified for zoom 14-15
+
+  2. Modified Functions
+    - `get_streets_in_bbox` gets a `zoom` parameter (default NULL: full resolution).
+      Below zoom 16 the returned `geometry` and `street_feature.geometry` are the
+      simplified copy for that zoom
+
+  3. Notes
+    - Each copy is simplified to half a 256px tile pixel at the highest zoom it serves
+      (360 / 256 / 2^zoom / 2 degrees), the same tolerances as SIMPLIFIED_GEOMETRIES
+      in fetch_planifications_batch.py
+    - Existing rows are backfilled here with ST_SimplifyPreserveTopology (GEOS, like
+      shapely's simplify(preserve_topology=True)); the ingest writes them for new and
+      changed streets
+*/
+
+ALTER TABLE streets
+  ADD COLUMN IF NOT EXISTS geometry_z11 geography(linestring, 4326),
+  ADD COLUMN IF NOT EXISTS geometry_z13 geography(linestring, 4326),
+  ADD COLUMN IF NOT EXISTS geometry_z15 geography(linestring, 4326);
+
+UPDATE streets SET
+  geometry_z11 = ST_SimplifyPreserveTopology(geometry::geometry, 0.00034332275390625)::geography,
+  geometry_z13 = ST_SimplifyPreserveTopology(geometry::geometry, 0.0000858306884765625)::geography,
+  geometry_z15 = ST_SimplifyPreserveTopology(geometry::geometry, 0.000021457672119140625)::geography
+WHERE geometry_z11 IS NULL;
+
+DROP FUNCTION IF EXISTS get_streets_in_bbox(double precision, double precision, double precision, double precision, boolean);
+
+CREATE FUNCTION get_streets_in_bbox(
+  min_lng double precision,
+  min_lat double precision,
+  max_lng double precision,
+  max_lat double precision,
+  include_snow boolean DEFAULT true,
+  zoom integer DEFAULT NULL
+)
+RETURNS TABLE (
+  cote_rue_id bigint,
+  id_trc bigint,
+  id_voie bigint,
+  nom_voie text,
+  nom_ville text,
+  debut_adresse int,
+  fin_adresse int,
+  cote text,
+  type_f text,
+  sens_cir int,
+  geometry geography,
+  street_feature jsonb,
+  created_at timestamptz,
+  updated_at timestamptz,
+  deneigement_current jsonb
+)
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  RETURN QUERY
+  SELECT
+    s.cote_rue_id,
+    s.id_trc,
+    s.id_voie,
+    s.nom_voie,
+    s.nom_ville,
+    s.debut_adresse,
+    s.fin_adresse,
+    s.cote,
+    s.type_f,
+    s.sens_cir,
+    COALESCE(z.geom, s.geometry),
+    CASE
+      WHEN z.geom IS NOT NULL THEN jsonb_set(s.street_feature, '{geometry}', ST_AsGeoJSON(z.geom)::jsonb)
+      ELSE s.street_feature
+    END,
+    s.created_at,
+    s.updated_at,
+    CASE
+      WHEN include_snow THEN
+        jsonb_build_object(
+          'etat_deneig', dc.etat_deneig,
+          'status', dc.status,
+          'date_debut_planif', dc.date_debut_planif,
+          'date_fin_planif', dc.date_fin_planif,
+          'date_debut_replanif', dc.date_debut_replanif,
+          'date_fin_replanif', dc.date_fin_replanif,
+          'date_maj', dc.date_maj
+        )
+      ELSE NULL
+    END as deneigement_current
+  FROM streets s
+  -- Simplified copy for the zoom, NULL for full resolution
+  CROSS JOIN LATERAL (
+    SELECT CASE
+      WHEN zoom IS NULL OR zoom >= 16 THEN NULL
+      WHEN zoom <= 11 THEN s.geometry_z11
+      WHEN zoom <= 13 THEN s.geometry_z13
+      ELSE s.geometry_z15
+    END AS geom
+  ) z
+  LEFT JOIN deneigement_current dc ON s.cote_rue_id = dc.cote_rue_id AND include_snow
+  WHERE ST_Intersects(
+    s.geometry::geometry,
+    ST_MakeEnvelope(min_lng, min_lat, max_lng, max_lat, 4326)
+  )
+  ORDER BY s.nom_voie ASC;
+END;
+$$;
+
+-- Grant execute permission to public (since we want this to be accessible via API)
+GRANT EXECUTE ON FUNCTION get_streets_in_bbox TO public;
@@ -0,0 +1,113 @@
+/*
+  # Serve street geometries as encoded polylines
+
+  Most of a `get_streets_in_bbox` response is coordinates: every street side came back
+  twice (the `geometry` column and `street_feature.geometry`), as full-precision GeoJSON
+  floats. The function can now return each geometry once, as an encoded polyline at
+  6 decimal places (~0.1 m), and rounds the simplified GeoJSON to the same precision.
+
+  1. Modified Functions
+    - `get_streets_in_bbox` gets a `polyline` parameter (default false: unchanged output).
+      When true:
+      - `encoded_geometry` (text, new column) - ST_AsEncodedPolyline of the geometry for the zoom, precision 6
+      - `street_feature` is returned without its `geometry` key
+      - `geometry` is NULL
+    - Simplified geometries (zoom < 16) are written with 6 decimal places instead of 9
+
+  2. Notes
+    - The polyline format is the Google one (latitude first, zigzag varint deltas), the same
+      as encode_polyline() in geometry_encoding.py and decodePolyline() in the client
+    - Rows written with SLIM_STREET_FEATURES=1 already store 6-decimal coordinates and only
+      the street properties in `street_feature`
+*/
+
+DROP FUNCTION IF EXISTS get_streets_in_bbox(double precision, double precision, double precision, double precision, boolean, integer);
+
+CREATE FUNCTION get_streets_in_bbox(
+  min_lng double precision,
+  min_lat double precision,
+  max_lng double precision,
+  max_lat double precision,
+  include_snow boolean DEFAULT true,
+  zoom integer DEFAULT NULL,
+  polyline boolean DEFAULT false
+)
+RETURNS TABLE (
+  cote_rue_id bigint,
+  id_trc bigint,
+  id_voie bigint,
+  nom_voie text,
+  nom_ville text,
+  debut_adresse int,
+  fin_adresse int,
+  cote text,
+  type_f text,
+  sens_cir int,
+  geometry geography,
+  street_feature jsonb,
+  created_at timestamptz,
+  updated_at timestamptz,
+  deneigement_current jsonb,
+  encoded_geometry text
+)
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  RETURN QUERY
+  SELECT
+    s.cote_rue_id,
+    s.id_trc,
+    s.id_voie,
+    s.nom_voie,
+    s.nom_ville,
+    s.debut_adresse,
+    s.fin_adresse,
+    s.cote,
+    s.type_f,
+    s.sens_cir,
+    CASE WHEN polyline THEN NULL ELSE COALESCE(z.geom, s.geometry) END,
+    CASE
+      WHEN polyline THEN s.street_feature - 'geometry'
+      WHEN z.geom IS NOT NULL THEN jsonb_set(s.street_feature, '{geometry}', ST_AsGeoJSON(z.geom, 6)::jsonb)
+      ELSE s.street_feature
+    END,
+    s.created_at,
+    s.updated_at,
+    CASE
+      WHEN include_snow THEN
+        jsonb_build_object(
+          'etat_deneig', dc.etat_deneig,
+          'status', dc.status,
+          'date_debut_planif', dc.date_debut_planif,
+          'date_fin_planif', dc.date_fin_planif,
+          'date_debut_replanif', dc.date_debut_replanif,
+          'date_fin_replanif', dc.date_fin_replanif,
+          'date_maj', dc.date_maj
+        )
+      ELSE NULL
+    END as deneigement_current,
+    CASE
+      WHEN polyline THEN ST_AsEncodedPolyline(COALESCE(z.geom, s.geometry)::geometry, 6)
+      ELSE NULL
+    END as encoded_geometry
+  FROM streets s
+  -- Simplified copy for the zoom, NULL for full resolution
+  CROSS JOIN LATERAL (
+    SELECT CASE
+      WHEN zoom IS NULL OR zoom >= 16 THEN NULL
+      WHEN zoom <= 11 THEN s.geometry_z11
+      WHEN zoom <= 13 THEN s.geometry_z13
+      ELSE s.geometry_z15
+    END AS geom
+  ) z
+  LEFT JOIN deneigement_current dc ON s.cote_rue_id = dc.cote_rue_id AND include_snow
+  WHERE ST_Intersects(
+    s.geometry::geometry,
+    ST_MakeEnvelope(min_lng, min_lat, max_lng, max_lat, 4326)
+  )
+  ORDER BY s.nom_voie ASC;
+END;
+$$;
+
+-- Grant execute permission to public (since we want this to be accessible via API)
+GRANT EXECUTE ON FUNCTION get_streets_in_bbox TO public;
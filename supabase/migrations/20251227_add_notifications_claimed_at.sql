@@ -0,0 +1,14 @@
+/*
+  # Add claimed_at to notifications
+
+  1. Columns
+    - `claimed_at` (timestamptz) - When a dispatcher claimed the unsent notification for delivery
+
+  2. Notes
+    - dispatch_notifications.py claims a batch by setting `claimed_at` and commits before POSTing
+      the digests, so no row lock or transaction stays open while the webhook is called.
+      Delivered rows are then marked `sent` and failed ones released (`claimed_at` back to NULL)
+    - A claim older than NOTIFY_CLAIM_TIMEOUT (dispatcher killed mid-batch) can be claimed again
+*/
+
+ALTER TABLE notifications ADD COLUMN IF NOT EXISTS claimed_at timestamptz;
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""Sync the streets table with the geobase: load only the street sides added, changed or removed since the last sync"""
+from typing import Optional, Dict, Any, List, Tuple
+import os
+import sys
+import time
+import pickle
+import argparse
+import psycopg2
+import geobase
+import dirty_tiles
+import fetch_planifications_batch as planif
+
+# id -> feature hash of the gbdouble.json version that was last synced
+MANIFEST_FILENAME = "gbdouble.hashes"
+
+
+def source_signature(json_path: str) -> List[int]:
+    """Size and modification time of gbdouble.json, to tell whether it changed since the last sync"""
+    stat = os.stat(json_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def load_manifest(path: str) -> Optional[Dict[str, Any]]:
+    """Read the manifest of the last sync, or None if there is none"""
+    try:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"Warning: Could not read sync manifest {path}: {str(e)}")
+        return None
+
+
+def save_manifest(path: str, signature: List[int], hashes: Dict[int, str]) -> None:
+    """Write the manifest atomically"""
+    tmp_path = path + ".part"
+    with open(tmp_path, "wb") as f:
+        pickle.dump({"signature": signature, "hashes": hashes}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def get_db_hashes(db_conn) -> Dict[int, Optional[str]]:
+    """Feature hash of every row of the streets table (NULL for rows written before feature_hash existed)"""
+    with db_conn.cursor() as cur:
+        cur.execute("SELECT cote_rue_id, feature_hash FROM streets")
+        return dict(cur.fetchall())
+
+
+def diff_hashes(old: Dict[int, Optional[str]], new: Dict[int, str]) -> Tuple[List[int], List[int], List[int]]:
+    """
+    Compare two id -> hash mappings.
+
+    Returns:
+        Tuple of sorted (added, changed, removed) ids
+    """
+    added = sorted(cote_rue_id for cote_rue_id in new if cote_rue_id not in old)
+    changed = sorted(cote_rue_id for cote_rue_id, content_hash in new.items()
+                     if cote_rue_id in old and old[cote_rue_id] != content_hash)
+    removed = sorted(cote_rue_id for cote_rue_id in old if cote_rue_id not in new)
+    return added, changed, removed
+
+
+def delete_streets(cur, cote_rue_ids: List[int]) -> List[Tuple[float, float, float, float]]:
+    """
+    Delete removed streets that nothing references: street sides with a current state,
+    events or user favorites are kept so their history and favorites survive.
+
+    Returns:
+        Bounds (min_lng, min_lat, max_lng, max_lat) of the deleted rows, one per row
+    """
+    cur.execute("""
+        DELETE FROM streets s
+        WHERE s.cote_rue_id = ANY(%s)
+          AND NOT EXISTS (SELECT 1 FROM deneigement_current c WHERE c.cote_rue_id = s.cote_rue_id)
+          AND NOT EXISTS (SELECT 1 FROM deneigement_events e WHERE e.cote_rue_id = s.cote_rue_id)
+          AND NOT EXISTS (SELECT 1 FROM user_favorites f WHERE f.cote_rue_id = s.cote_rue_id)
+        RETURNING ST_XMin(s.geometry::geometry), ST_YMin(s.geometry::geometry),
+                  ST_XMax(s.geometry::geometry), ST_YMax(s.geometry::geometry)
+    """, (cote_rue_ids,))
+    return cur.fetchall()
+
+
+def parse_args(argv=None):
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Sync the streets table with the Montreal geobase (gbdouble.json)")
+    parser.add_argument("--from-db", action="store_true",
+                        help="diff against the feature hashes stored in streets instead of the last sync manifest")
+    parser.add_argument("--force", action="store_true",
+                        help="diff even if gbdouble.json did not change since the last sync")
+    parser.add_argument("--delete-removed", action="store_true",
+                        help="delete removed street sides that have no current state, events or favorites")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="only report the delta")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Main function to sync streets with the geobase"""
+    args = parse_args(argv)
+
+    database_url = os.environ.get("DATABASE_URL") or os.environ.get("SUPABASE_DB_URL")
+    if not database_url:
+        print("ERROR: DATABASE_URL or SUPABASE_DB_URL not set in .env file")
+        return 1
+
+    start = time.monotonic()
+    try:
+        store = geobase.load_geobase()
+        print(f"Loaded {len(store)} features from gbdouble.json")
+    except Exception as e:
+        print(f"ERROR: Error loading gbdouble.json: {str(e)}")
+        return 1
+
+    json_path = os.path.join(geobase.GEOBASE_CACHE_DIR, geobase.GEOBASE_FILENAME)
+    manifest_path = os.path.join(geobase.GEOBASE_CACHE_DIR, MANIFEST_FILENAME)
+    signature = source_signature(json_path)
+    manifest = load_manifest(manifest_path)
+
+    if manifest and manifest["signature"] == signature and not (args.force or args.from_db):
+        print("✓ gbdouble.json unchanged since the last sync, nothing to do")
+        return 0
+
+    planif.geometry_cache = planif.GeometryCache.load(os.path.join(geobase.GEOBASE_CACHE_DIR, "geometry_cache.pkl"))
+    new_hashes = {cote_rue_id: planif.feature_hash(store[cote_rue_id]) for cote_rue_id in store}
+
+    db_conn = psycopg2.connect(database_url)
+    try:
+        if manifest is None or args.from_db:
+            print("Diffing against the streets table")
+            old_hashes = get_db_hashes(db_conn)
+        else:
+            print("Diffing against the last synced version")
+            old_hashes = manifest["hashes"]
+
+        added, changed, removed = diff_hashes(old_hashes, new_hashes)
+        print(f"Delta: {len(added)} added, {len(changed)} changed, {len(removed)} removed "
+              f"({len(new_hashes) - len(added) - len(changed)} unchanged)")
+
+        if args.dry_run:
+            return 0
+
+        # Features without a usable LineString (empty coordinates) would fail the whole transaction
+        street_rows = []
+        skipped = []
+        for cote_rue_id in added + changed:
+            prepared = planif.prepare_street(store[cote_rue_id])
+            if prepared is None or not planif.has_linestring(prepared):
+                skipped.append(cote_rue_id)
+                continue
+            street_rows.append(planif.street_row(prepared))
+        if skipped:
+            print(f"⚠ Skipped {len(skipped)} street side(s) without a LineString geometry")
+
+        try:
+            with db_conn.cursor() as cur:
+                street_ids, unchanged, street_bounds = (
+                    planif.bulk_upsert_streets(cur, street_rows) if street_rows else ([], 0, [])
+                )
+                deleted_bounds = delete_streets(cur, removed) if removed and args.delete_removed else []
+            db_conn.commit()
+        except Exception as e:
+            db_conn.rollback()
+            print(f"✗ Sync failed, nothing written: {str(e)}")
+            return 1
+        upserted = len(street_ids)
+        deleted = len(deleted_bounds)
+
+        # Tiles drawn with the old geometry, the new one or a deleted street must be re-rendered
+        if os.getenv("TILE_INVALIDATIONS", "1") != "0":
+            try:
+                feed = dirty_tiles.publish(db_conn, street_ids, extra_bounds=street_bounds + deleted_bounds)
+                if feed:
+                    print(f"✓ Published tile invalidation #{feed['id']}: {feed['tiles']} tile(s), "
+                          f"{feed['cells']} bbox cell(s) for {upserted + deleted} street side(s)")
+            except Exception as e:
+                print(f"Warning: Could not publish tile invalidations: {str(e)}")
+    finally:
+        db_conn.close()
+
+    # Skipped street sides are left out of the manifest, so the next sync tries them again
+    for cote_rue_id in skipped:
+        new_hashes.pop(cote_rue_id, None)
+    save_manifest(manifest_path, signature, new_hashes)
+    planif.geometry_cache.save()
+
+    print(f"✓ Streets written: {upserted} (already up to date: {unchanged}, skipped without geometry: {len(skipped)})")
+    if removed:
+        if args.delete_removed:
+            print(f"✓ Streets deleted: {deleted} ({len(removed) - deleted} still referenced, kept)")
+        else:
+            print(f"⚠ {len(removed)} street side(s) no longer in the geobase, kept (use --delete-removed)")
+    print(f"Sync completed in {time.monotonic() - start:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
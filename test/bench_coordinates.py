@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""Stored and served bytes of full vs slim (quantized) street features and of encoded polylines
+
+Usage:
+    python test/bench_coordinates.py              # geobase only
+    DATABASE_URL=... python test/bench_coordinates.py
+
+Prepares every gbdouble feature like the ingest, with and without SLIM_STREET_FEATURES,
+and compares the JSON bytes of street_feature, its jsonb size in Postgres and the bytes of
+the geometry as GeoJSON coordinates vs an encoded polyline. With a database, also reports
+the current size of streets and the get_streets_in_bbox response for the densest views,
+as GeoJSON and with polyline=true.
+"""
+import os
+import sys
+import json
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import psycopg2
+import geobase
+import geometry_encoding
+import fetch_planifications_batch as planif
+
+# Features per jsonb size query
+CHUNK_SIZE = 5000
+
+
+def jsonb_size(cur, documents):
+    """Total pg_column_size of the documents cast to jsonb (uncompressed datum size)"""
+    total = 0
+    for i in range(0, len(documents), CHUNK_SIZE):
+        cur.execute("SELECT sum(pg_column_size(d::jsonb)) FROM unnest(%s::text[]) d", (documents[i:i + CHUNK_SIZE],))
+        total += cur.fetchone()[0] or 0
+    return total
+
+
+def response_bytes(cur, bounds, polyline: bool):
+    cur.execute(
+        "SELECT json_agg(t) FROM get_streets_in_bbox(%s, %s, %s, %s, true, NULL, %s) t",
+        (*bounds, polyline)
+    )
+    return len(json.dumps(cur.fetchone()[0] or []))
+
+
+def main():
+    store = geobase.load_geobase()
+    print(f"Loaded {len(store)} features from gbdouble.json")
+    planif.geometry_cache = planif.GeometryCache()
+
+    full_documents = []
+    slim_documents = []
+    geojson_bytes = 0
+    polyline_bytes = 0
+    full_vertices = 0
+    slim_vertices = 0
+    start = time.perf_counter()
+    for cote_rue_id in store:
+        full = planif.prepare_street(store[cote_rue_id], slim=False)
+        slim = planif.prepare_street(store[cote_rue_id], slim=True)
+        if full is None:
+            continue
+        full_documents.append(json.dumps(full["street_feature"]))
+        slim_documents.append(json.dumps(slim["street_feature"]))
+        if full["wkt"]:
+            full_vertices += len(full["geometry"]["coordinates"])
+            slim_vertices += len(slim["geometry"]["coordinates"])
+            geojson_bytes += len(json.dumps(slim["geometry"]["coordinates"]))
+            polyline_bytes += len(json.dumps(geometry_encoding.encode_polyline(slim["geometry"]["coordinates"])))
+    elapsed = time.perf_counter() - start
+
+    full_bytes = sum(len(document) for document in full_documents)
+    slim_bytes = sum(len(document) for document in slim_documents)
+    print(f"{len(full_documents)} street features prepared twice in {elapsed:.1f}s "
+          f"(precision {geometry_encoding.COORDINATE_PRECISION} decimals)")
+    print(f"  street_feature JSON   full {full_bytes / 1024 / 1024:8.1f} MB  slim {slim_bytes / 1024 / 1024:8.1f} MB  "
+          f"({(1 - slim_bytes / full_bytes) * 100:.1f}% smaller)")
+    print(f"  vertices              full {full_vertices:10d}  slim {slim_vertices:10d}  (duplicates after rounding dropped)")
+    print(f"  coordinates           GeoJSON {geojson_bytes / 1024 / 1024:6.1f} MB  polyline {polyline_bytes / 1024 / 1024:6.1f} MB  "
+          f"({(1 - polyline_bytes / geojson_bytes) * 100:.1f}% smaller)")
+
+    database_url = os.environ.get("DATABASE_URL") or os.environ.get("SUPABASE_DB_URL")
+    if not database_url:
+        print("DATABASE_URL not set, skipping the table and response sizes")
+        return 0
+
+    db_conn = psycopg2.connect(database_url)
+    db_conn.autocommit = True
+    try:
+        with db_conn.cursor() as cur:
+            full_size = jsonb_size(cur, full_documents)
+            slim_size = jsonb_size(cur, slim_documents)
+            print(f"  street_feature jsonb  full {full_size / 1024 / 1024:8.1f} MB  slim {slim_size / 1024 / 1024:8.1f} MB  "
+                  f"({(1 - slim_size / full_size) * 100:.1f}% smaller, before TOAST compression)")
+
+            cur.execute("""
+                SELECT count(*), sum(pg_column_size(street_feature)),
+                       pg_total_relation_size('streets'), pg_relation_size('streets')
+                FROM streets
+            """)
+            rows, stored, total, heap = cur.fetchone()
+            print(f"streets table: {rows} rows, street_feature {(stored or 0) / 1024 / 1024:.1f} MB stored, "
+                  f"heap {heap / 1024 / 1024:.1f} MB, total with TOAST and indexes {total / 1024 / 1024:.1f} MB")
+
+            # A few 0.02 x 0.02 degree views around the center of the streets
+            cur.execute("SELECT ST_XMin(e), ST_YMin(e), ST_XMax(e), ST_YMax(e) FROM (SELECT ST_Extent(geometry::geometry) e FROM streets) s")
+            min_lng, min_lat, max_lng, max_lat = cur.fetchone()
+            center_lng, center_lat = (min_lng + max_lng) / 2, (min_lat + max_lat) / 2
+            views = [
+                (center_lng + dx - 0.01, center_lat + dy - 0.01, center_lng + dx + 0.01, center_lat + dy + 0.01)
+                for dx in (-0.02, 0.0, 0.02) for dy in (-0.02, 0.0, 0.02)
+            ]
+            geojson_response = sum(response_bytes(cur, view, False) for view in views)
+            polyline_response = sum(response_bytes(cur, view, True) for view in views)
+    finally:
+        db_conn.close()
+
+    print(f"get_streets_in_bbox ({len(views)} views): GeoJSON {geojson_response / len(views) / 1024:.1f} KB/view, "
+          f"polyline {polyline_response / len(views) / 1024:.1f} KB/view "
+          f"({(1 - polyline_response / geojson_response) * 100:.1f}% smaller)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""Vertex and GeoJSON size savings of the per-zoom simplified street geometries
+
+Usage:
+    python test/bench_simplify.py
+
+Normalizes every gbdouble feature like the ingest, simplifies it for each
+SIMPLIFIED_GEOMETRIES column and compares vertices and GeoJSON bytes with the
+full-resolution LineString returned at zoom 16.
+"""
+import os
+import sys
+import json
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import geobase
+import fetch_planifications_batch as planif
+
+
+def main():
+    store = geobase.load_geobase()
+    print(f"Loaded {len(store)} features from gbdouble.json")
+
+    full_vertices = 0
+    full_bytes = 0
+    vertices = {column: 0 for column in planif.SIMPLIFIED_COLUMNS}
+    sizes = {column: 0 for column in planif.SIMPLIFIED_COLUMNS}
+    lines = 0
+    start = time.perf_counter()
+    for cote_rue_id in store:
+        geometry = store[cote_rue_id].get("geometry")
+        normalized = planif.normalize_to_linestring(geometry) if geometry else None
+        if not normalized:
+            continue
+        lines += 1
+        full_vertices += len(normalized["coordinates"])
+        full_bytes += len(json.dumps(normalized))
+        for column, simplified in planif.simplify_linestring(normalized).items():
+            if simplified:
+                vertices[column] += len(simplified["coordinates"])
+                sizes[column] += len(json.dumps(simplified))
+    elapsed = time.perf_counter() - start
+
+    print(f"{lines} LineStrings normalized and simplified in {elapsed:.1f}s")
+    print(f"  {'full':<14} zoom >= 16  {full_vertices:10d} vertices  {full_bytes / 1024 / 1024:8.1f} MB")
+    previous = 0
+    for column, zoom in planif.SIMPLIFIED_GEOMETRIES.items():
+        zooms = f"zoom {previous}-{zoom}" if previous else f"zoom <= {zoom}"
+        print(f"  {column:<14} {zooms:<10}  {vertices[column]:10d} vertices  {sizes[column] / 1024 / 1024:8.1f} MB  "
+              f"({vertices[column] / full_vertices * 100:5.1f}% of the vertices, tolerance {planif.simplify_tolerance(zoom):.2e} deg)")
+        previous = zoom + 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""Benchmark the raw SOAP parser (planif_raw) against the zeep path on a GetPlanificationsForDate reply
+
+Usage:
+    python test/bench_soap_parser.py                 # synthetic reply with 50000 planifications
+    python test/bench_soap_parser.py 200000          # synthetic reply with 200000 planifications
+    python test/bench_soap_parser.py reply.xml       # saved reply (e.g. the output of test/test.py)
+
+The zeep path needs the WSDL (network) and a reply matching its schema; it is skipped otherwise.
+"""
+import io
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import planif_raw
+
+DEFAULT_URL = 'https://servicesenligne2.ville.montreal.qc.ca/api/infoneige/InfoneigeWebService?WSDL'
+
+
+def build_reply(count: int) -> bytes:
+    """Build a synthetic reply shaped like the API's"""
+    parts = [
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">'
+        '<soap:Body><ns2:GetPlanificationsForDateResponse xmlns:ns2="%s">'
+        '<return><responseStatus>0</responseStatus><planifications>' % planif_raw.SERVICE_NAMESPACE
+    ]
+    for i in range(count):
+        parts.append(
+            "<planification>"
+            f"<munid>{i % 19}</munid>"
+            f"<coteRueId>{10000000 + i}</coteRueId>"
+            f"<etatDeneig>{i % 5}</etatDeneig>"
+            "<dateDebutPlanif>2025-12-20T07:00:00</dateDebutPlanif>"
+            "<dateFinPlanif>2025-12-21T07:00:00</dateFinPlanif>"
+            '<dateDebutReplanif xsi:nil="true" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"/>'
+            '<dateFinReplanif xsi:nil="true" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"/>'
+            f"<dateMaj>2025-12-20T06:{i % 60:02d}:{i % 59:02d}.{i % 1000:03d}-05:00</dateMaj>"
+            "</planification>"
+        )
+    parts.append("</planifications></return></ns2:GetPlanificationsForDateResponse></soap:Body></soap:Envelope>")
+    return "".join(parts).encode("utf-8")
+
+
+def convert_datetime_to_string(obj):
+    """Recursively convert datetime objects to ISO format strings"""
+    if isinstance(obj, datetime):
+        return obj.replace(microsecond=0).isoformat()
+    elif isinstance(obj, dict):
+        return {key: convert_datetime_to_string(value) for key, value in obj.items()}
+    elif isinstance(obj, list):
+        return [convert_datetime_to_string(item) for item in obj]
+    return obj
+
+
+def measure(label: str, func):
+    """Run func once timed, then once more under tracemalloc for its peak memory, and return its result"""
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"  {label:<6} {elapsed:8.3f}s  peak {peak / 1024 / 1024:8.1f} MB  {len(result) / elapsed:10.0f} records/s")
+    return result, elapsed
+
+
+def parse_raw(reply: bytes):
+    return list(planif_raw.iter_planifications(io.BytesIO(reply)))
+
+
+def parse_zeep(reply: bytes):
+    import zeep
+    from lxml import etree
+
+    client = zeep.Client(wsdl=DEFAULT_URL)
+    operation = client.service._binding.get("GetPlanificationsForDate")
+
+    def run():
+        response = operation.process_reply(etree.fromstring(reply))
+        result = zeep.helpers.serialize_object(response)
+        planification_list = result.get('planifications', {}).get('planification', [])
+        if isinstance(planification_list, dict):
+            planification_list = [planification_list]
+        return convert_datetime_to_string(planification_list)
+
+    return run
+
+
+def main():
+    arg = sys.argv[1] if len(sys.argv) > 1 else "50000"
+    if arg.isdigit():
+        reply = build_reply(int(arg))
+        print(f"Synthetic reply: {int(arg)} planifications, {len(reply) / 1024 / 1024:.1f} MB")
+    else:
+        with open(arg, "rb") as f:
+            reply = f.read()
+        print(f"Reply {arg}: {len(reply) / 1024 / 1024:.1f} MB")
+
+    raw_records, raw_time = measure("raw", lambda: parse_raw(reply))
+
+    try:
+        run_zeep = parse_zeep(reply)
+        zeep_records, zeep_time = measure("zeep", run_zeep)
+    except Exception as e:
+        print(f"  zeep   skipped: {str(e)}")
+        return 0
+
+    print(f"  speedup {zeep_time / raw_time:.1f}x")
+    if zeep_records == raw_records:
+        print("  ✓ Records identical")
+    else:
+        print("  ✗ Records differ")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""Benchmark the in-memory street index (street_index.py) against PostGIS for the same questions
+
+Usage:
+    python test/bench_street_index.py              # 200 views of 0.01 degree and 200 nearest queries
+    python test/bench_street_index.py 0.02 500     # 500 views of 0.02 degree
+
+Times building, saving and loading the index, then for random map views and points
+around the center of the streets: StreetIndex.query against get_streets_in_bbox (ids only
+and the full call the map makes) and StreetIndex.nearest against a PostGIS <-> KNN query,
+checking that both return the same street sides.
+"""
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import psycopg2
+import geobase
+import street_index
+
+# Street sides returned by each nearest query
+K = 5
+
+
+def main():
+    size = float(sys.argv[1]) if len(sys.argv) > 1 else 0.01
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    store = geobase.load_geobase()
+    start = time.perf_counter()
+    index = street_index.StreetIndex.from_geobase(store)
+    build_time = time.perf_counter() - start
+    path = os.path.join(geobase.GEOBASE_CACHE_DIR, street_index.INDEX_FILENAME)
+    index.save(path, os.path.getsize(os.path.join(geobase.GEOBASE_CACHE_DIR, geobase.GEOBASE_FILENAME)))
+    start = time.perf_counter()
+    index = street_index.StreetIndex.load(path)
+    load_time = time.perf_counter() - start
+    print(f"{len(index)} street sides indexed in {build_time:.2f}s, loaded in {load_time * 1000:.1f} ms "
+          f"({os.path.getsize(path) / 1024 / 1024:.1f} MB)")
+
+    database_url = os.environ.get("DATABASE_URL") or os.environ.get("SUPABASE_DB_URL")
+    if not database_url:
+        print("ERROR: DATABASE_URL or SUPABASE_DB_URL not set in .env file")
+        return 1
+
+    # Views and points around the center of the streets, where they are densest
+    random.seed(0)
+    min_lng, min_lat, max_lng, max_lat = index.extent()
+    center_lng, center_lat = (min_lng + max_lng) / 2, (min_lat + max_lat) / 2
+    points = [
+        (center_lng + random.uniform(-0.05, 0.05), center_lat + random.uniform(-0.05, 0.05))
+        for _ in range(count)
+    ]
+    views = [(lng, lat, lng + size, lat + size) for lng, lat in points]
+
+    index_time = 0.0
+    sql_ids_time = 0.0
+    sql_time = 0.0
+    nearest_time = 0.0
+    sql_nearest_time = 0.0
+    found = 0
+    mismatches = 0
+    nearest_mismatches = 0
+    db_conn = psycopg2.connect(database_url)
+    db_conn.autocommit = True
+    try:
+        with db_conn.cursor() as cur:
+            for view in views:
+                start = time.perf_counter()
+                ids = index.query(*view)
+                index_time += time.perf_counter() - start
+                found += len(ids)
+
+                start = time.perf_counter()
+                cur.execute("SELECT cote_rue_id FROM get_streets_in_bbox(%s, %s, %s, %s, false)", view)
+                sql_ids = [row[0] for row in cur.fetchall()]
+                sql_ids_time += time.perf_counter() - start
+                if set(ids) != set(sql_ids):
+                    mismatches += 1
+
+                start = time.perf_counter()
+                cur.execute("SELECT * FROM get_streets_in_bbox(%s, %s, %s, %s, true)", view)
+                cur.fetchall()
+                sql_time += time.perf_counter() - start
+
+            for lng, lat in points:
+                start = time.perf_counter()
+                nearest = index.nearest(lng, lat, k=K)
+                nearest_time += time.perf_counter() - start
+
+                start = time.perf_counter()
+                cur.execute("""
+                    SELECT cote_rue_id FROM streets
+                    ORDER BY geometry <-> ST_SetSRID(ST_MakePoint(%s, %s), 4326)::geography
+                    LIMIT %s
+                """, (lng, lat, K))
+                sql_nearest = [row[0] for row in cur.fetchall()]
+                sql_nearest_time += time.perf_counter() - start
+                # Planar vs spheroid distances can swap near ties, so only the closest one is compared
+                if nearest and sql_nearest and nearest[0][0] != sql_nearest[0]:
+                    nearest_mismatches += 1
+    finally:
+        db_conn.close()
+
+    n = len(views)
+    print(f"{n} views of {size} degree ({found / n:.0f} street sides each), {n} nearest queries (k={K})")
+    print(f"  StreetIndex.query            {index_time / n * 1e6:10.0f} µs/view")
+    print(f"  get_streets_in_bbox (ids)    {sql_ids_time / n * 1e6:10.0f} µs/view  ({mismatches} view(s) with different ids)")
+    print(f"  get_streets_in_bbox (full)   {sql_time / n * 1e6:10.0f} µs/view")
+    print(f"  StreetIndex.nearest          {nearest_time / n * 1e6:10.0f} µs/query")
+    print(f"  PostGIS <-> KNN              {sql_nearest_time / n * 1e6:10.0f} µs/query  ({nearest_mismatches} with a different closest side)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
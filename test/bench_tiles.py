@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""Benchmark vector tile rendering (build_tiles) against get_streets_in_bbox for the same map views
+
+Usage:
+    python test/bench_tiles.py              # 200 tiles at zoom 16 around the center of the streets
+    python test/bench_tiles.py 15 500       # 500 tiles at zoom 15
+
+For each sampled tile, times the ST_AsMVT render, the get_streets_in_bbox call the
+map makes today for the same area (and the size of its JSON), and the read of the
+tile from the cache when build_tiles.py already wrote it.
+"""
+import os
+import sys
+import json
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import psycopg2
+import build_tiles
+
+
+def sample_tiles(bounds, z: int, count: int):
+    """Tiles spiraling out of the center of bounds, where streets are densest"""
+    center_x, center_y = build_tiles.lonlat_to_tile((bounds[0] + bounds[2]) / 2, (bounds[1] + bounds[3]) / 2, z)
+    tiles = []
+    radius = 0
+    while len(tiles) < count:
+        for x in range(center_x - radius, center_x + radius + 1):
+            for y in range(center_y - radius, center_y + radius + 1):
+                if max(abs(x - center_x), abs(y - center_y)) == radius and len(tiles) < count:
+                    tiles.append((z, x, y))
+        radius += 1
+    return tiles
+
+
+def main():
+    z = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    database_url = os.environ.get("DATABASE_URL") or os.environ.get("SUPABASE_DB_URL")
+    if not database_url:
+        print("ERROR: DATABASE_URL or SUPABASE_DB_URL not set in .env file")
+        return 1
+
+    db_conn = psycopg2.connect(database_url)
+    db_conn.autocommit = True
+    try:
+        bounds = build_tiles.get_streets_bounds(db_conn)
+        if bounds is None:
+            print("No streets")
+            return 1
+        tiles = sample_tiles(bounds, z, count)
+        print(f"{len(tiles)} tiles at zoom {z}")
+
+        mvt_time = 0.0
+        mvt_bytes = 0
+        bbox_time = 0.0
+        bbox_bytes = 0
+        with db_conn.cursor() as cur:
+            for tile_z, x, y in tiles:
+                start = time.perf_counter()
+                data = build_tiles.render_tile(cur, tile_z, x, y)
+                mvt_time += time.perf_counter() - start
+                mvt_bytes += len(data)
+
+                min_lng, max_lat = build_tiles.tile_to_lonlat(x, y, tile_z)
+                max_lng, min_lat = build_tiles.tile_to_lonlat(x + 1, y + 1, tile_z)
+                start = time.perf_counter()
+                cur.execute(
+                    "SELECT json_agg(t) FROM get_streets_in_bbox(%s, %s, %s, %s, true) t",
+                    (min_lng, min_lat, max_lng, max_lat)
+                )
+                rows = cur.fetchone()[0] or []
+                bbox_time += time.perf_counter() - start
+                bbox_bytes += len(json.dumps(rows))
+    finally:
+        db_conn.close()
+
+    cached = [build_tiles.tile_path(build_tiles.TILES_DIR, tile_z, x, y) for tile_z, x, y in tiles]
+    cached = [path for path in cached if os.path.exists(path)]
+    cache_time = 0.0
+    for path in cached:
+        start = time.perf_counter()
+        with open(path, "rb") as f:
+            f.read()
+        cache_time += time.perf_counter() - start
+
+    n = len(tiles)
+    print(f"  ST_AsMVT             {n / mvt_time:8.1f} tiles/s  {mvt_time / n * 1000:7.1f} ms/tile  {mvt_bytes / n / 1024:8.1f} KB/tile")
+    print(f"  get_streets_in_bbox  {n / bbox_time:8.1f} views/s  {bbox_time / n * 1000:7.1f} ms/view  {bbox_bytes / n / 1024:8.1f} KB/view (JSON)")
+    if cached:
+        print(f"  tile cache read      {len(cached) / cache_time:8.0f} tiles/s  ({len(cached)} of {n} tiles cached in {build_tiles.TILES_DIR}/)")
+    else:
+        print(f"  tile cache read      skipped (run build_tiles.py first)")
+    count, size = build_tiles.cache_size(build_tiles.TILES_DIR)
+    print(f"  cache size           {count} tiles, {size / 1024 / 1024:.1f} MB")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
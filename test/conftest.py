@@ -0,0 +1,2 @@
+# test_dates.py is a script that probes the live API (its test_date() takes a client and a token), not a pytest module
+collect_ignore = ["test_dates.py"]
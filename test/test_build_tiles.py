@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""Checks of the XYZ tile math of build_tiles.py, without a database"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pytest
+import build_tiles
+
+# Downtown Montreal
+LNG, LAT = -73.5673, 45.5017
+
+
+def test_lonlat_to_tile_known_values():
+    assert build_tiles.lonlat_to_tile(0.0, 0.0, 0) == (0, 0)
+    assert build_tiles.lonlat_to_tile(-180.0, 85.0511, 3) == (0, 0)
+    assert build_tiles.lonlat_to_tile(180.0, -85.0511, 3) == (7, 7)
+    assert build_tiles.lonlat_to_tile(LNG, LAT, 12) == (1210, 1465)
+
+
+def test_tile_corner_round_trip():
+    for z in (0, 12, 16):
+        x, y = build_tiles.lonlat_to_tile(LNG, LAT, z)
+        lon, lat = build_tiles.tile_to_lonlat(x, y, z)
+        assert build_tiles.lonlat_to_tile(lon + 1e-9, lat - 1e-9, z) == (x, y)
+        next_lon, next_lat = build_tiles.tile_to_lonlat(x + 1, y + 1, z)
+        assert lon <= LNG < next_lon
+        assert next_lat < LAT <= lat
+
+
+def test_tiles_in_bounds():
+    z = 14
+    x, y = build_tiles.lonlat_to_tile(LNG, LAT, z)
+    west, north = build_tiles.tile_to_lonlat(x, y, z)
+    east, south = build_tiles.tile_to_lonlat(x + 1, y + 1, z)
+
+    # A box inside one tile
+    inner = (west + (east - west) / 4, south + (north - south) / 4, east - (east - west) / 4, north - (north - south) / 4)
+    assert list(build_tiles.tiles_in_bounds(inner, z)) == [(z, x, y)]
+
+    # With a half-tile margin, the neighbours whose buffer reaches the box are included
+    assert set(build_tiles.tiles_in_bounds(inner, z, margin=0.5)) == {
+        (z, x + dx, y + dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+    }
+
+    # Spanning two tiles horizontally
+    span = (west + (east - west) / 2, inner[1], east + (east - west) / 2, inner[3])
+    assert sorted(build_tiles.tiles_in_bounds(span, z)) == [(z, x, y), (z, x + 1, y)]
+
+
+def test_tiles_in_bounds_clamped_to_the_world():
+    assert list(build_tiles.tiles_in_bounds((-180.0, -85.0, 180.0, 85.0), 1, margin=2)) == [
+        (1, 0, 0), (1, 0, 1), (1, 1, 0), (1, 1, 1)
+    ]
+
+
+def test_write_tile(tmp_path):
+    tiles_dir = str(tmp_path)
+    build_tiles.write_tile(tiles_dir, 12, 1210, 1465, b"\x1a\x00")
+    path = build_tiles.tile_path(tiles_dir, 12, 1210, 1465)
+    with open(path, "rb") as f:
+        assert f.read() == b"\x1a\x00"
+    # An empty render removes the tile
+    build_tiles.write_tile(tiles_dir, 12, 1210, 1465, b"")
+    assert not os.path.exists(path)
+
+
+@pytest.mark.parametrize("z", [12, 16])
+def test_tile_size_at_montreal(z):
+    x, y = build_tiles.lonlat_to_tile(LNG, LAT, z)
+    west, north = build_tiles.tile_to_lonlat(x, y, z)
+    east, _ = build_tiles.tile_to_lonlat(x + 1, y, z)
+    assert east - west == pytest.approx(360.0 / 2 ** z)
@@ -6,12 +6,17 @@ import os
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 import zeep
+from zeep.cache import SqliteCache
 
 # Load environment variables
 load_dotenv()
 
 DEFAULT_URL = 'https://servicesenligne2.ville.montreal.qc.ca/api/infoneige/InfoneigeWebService?WSDL'
 
+# On-disk WSDL/XSD cache shared with fetch_planifications_batch.py
+WSDL_CACHE_PATH = os.getenv("WSDL_CACHE_PATH", os.path.join(os.getenv("GEOBASE_CACHE_DIR", "data"), "wsdl_cache.db"))
+WSDL_CACHE_TTL = int(os.getenv("WSDL_CACHE_TTL", str(7 * 24 * 3600)))
+
 def convert_datetime_to_string(obj):
     """Recursively convert datetime objects to ISO format strings"""
     if isinstance(obj, datetime):
@@ -23,15 +28,21 @@ def convert_datetime_to_string(obj):
     return obj
 
 
-def test_date(token: str, test_date: str, wsdl_url: str = DEFAULT_URL):
+def build_client(wsdl_url: str = DEFAULT_URL):
+    """Build one zeep client (WSDL cached on disk) to reuse for every tested date"""
+    cache_dir = os.path.dirname(WSDL_CACHE_PATH)
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+    transport = zeep.Transport(cache=SqliteCache(path=WSDL_CACHE_PATH, timeout=WSDL_CACHE_TTL))
+    transport.session.headers['User-Agent'] = (
+        "planif-neige-client https://github.com/poboisvert"
+    )
+    return zeep.Client(wsdl=wsdl_url, transport=transport)
+
+
+def test_date(client, token: str, test_date: str):
     """Test a specific date with the API"""
     try:
-        transport = zeep.Transport()
-        transport.session.headers['User-Agent'] = (
-            "planif-neige-client https://github.com/poboisvert"
-        )
-        client = zeep.Client(wsdl=wsdl_url, transport=transport)
-        
         request = {'fromDate': test_date, 'tokenString': token}
         response = client.service.GetPlanificationsForDate(request)
         result = zeep.helpers.serialize_object(response)
@@ -70,6 +81,7 @@ def main():
     wsdl_url = os.getenv("WSDL_URL", DEFAULT_URL)
     print(f"Using WSDL URL: {wsdl_url}")
     print(f"Token: {token[:20]}...")
+    client = build_client(wsdl_url)
     print("\nStarting date testing...")
     print("="*80)
     
@@ -121,7 +133,7 @@ def main():
             break
         
         print(f"Making API request...")
-        success, count, error = test_date(token, test_date_str, wsdl_url)
+        success, count, error = test_date(client, token, test_date_str)
         
         if success:
             print(f"\n{'='*80}")
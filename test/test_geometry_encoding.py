@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""Checks of the coordinate quantization and encoded polylines (geometry_encoding.py)"""
+import os
+import sys
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import geometry_encoding
+
+
+def random_line(rng: random.Random, count: int):
+    """Line of random positions around Montreal"""
+    return [[rng.uniform(-73.99, -73.47), rng.uniform(45.40, 45.71)] for _ in range(count)]
+
+
+def test_polyline_known_value():
+    # Reference example of the encoded polyline algorithm (precision 5)
+    coordinates = [[-120.2, 38.5], [-120.95, 40.7], [-126.453, 43.252]]
+    assert geometry_encoding.encode_polyline(coordinates, precision=5) == "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+    assert geometry_encoding.decode_polyline("_p~iF~ps|U_ulLnnqC_mqNvxq`@", precision=5) == coordinates
+
+
+def test_polyline_round_trip():
+    rng = random.Random(0)
+    for precision in (5, 6):
+        for count in (1, 2, 10, 200):
+            coordinates = geometry_encoding.quantize_coordinates(random_line(rng, count), precision)
+            encoded = geometry_encoding.encode_polyline(coordinates, precision)
+            assert geometry_encoding.decode_polyline(encoded, precision) == coordinates
+
+
+def test_polyline_empty():
+    assert geometry_encoding.encode_polyline([]) == ""
+    assert geometry_encoding.decode_polyline("") == []
+
+
+def test_quantize_merges_duplicates_but_keeps_two_positions():
+    assert geometry_encoding.quantize_coordinates([[1.0000001, 2.0], [1.0000002, 2.0], [3.0, 4.0]], 6) == [[1.0, 2.0], [3.0, 4.0]]
+    assert geometry_encoding.quantize_coordinates([[1.0000001, 2.0], [1.0000002, 2.0]], 6) == [[1.0, 2.0], [1.0, 2.0]]
+
+
+def test_quantize_geometry():
+    line = {"type": "LineString", "coordinates": [[-73.1234567, 45.7654321, 12.0], [-73.2, 45.8]]}
+    assert geometry_encoding.quantize_geometry(line, 6) == {
+        "type": "LineString", "coordinates": [[-73.123457, 45.765432], [-73.2, 45.8]]
+    }
+    # The source geometry is not modified
+    assert line["coordinates"][0] == [-73.1234567, 45.7654321, 12.0]
+    point = {"type": "Point", "coordinates": [-73.1234567, 45.7654321]}
+    assert geometry_encoding.quantize_geometry(point, 6) is point
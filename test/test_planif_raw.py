@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""Checks that the raw SOAP parser (planif_raw.py) returns the same records as the zeep path
+
+zeep runs against a local copy of the operation's schema, so no network is needed.
+"""
+import io
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pytest
+import planif_raw
+
+zeep = pytest.importorskip("zeep")
+from lxml import etree
+
+# GetPlanificationsForDate as described by the service WSDL (document/literal, unqualified elements)
+WSDL = """<?xml version="1.0" encoding="UTF-8"?>
+<definitions xmlns="http://schemas.xmlsoap.org/wsdl/"
+    xmlns:soap="http://schemas.xmlsoap.org/wsdl/soap/"
+    xmlns:xs="http://www.w3.org/2001/XMLSchema"
+    xmlns:tns="{ns}" targetNamespace="{ns}" name="InfoneigeWebService">
+  <types>
+    <xs:schema targetNamespace="{ns}" version="1.0">
+      <xs:element name="GetPlanificationsForDate" type="tns:GetPlanificationsForDate"/>
+      <xs:element name="GetPlanificationsForDateResponse" type="tns:GetPlanificationsForDateResponse"/>
+      <xs:complexType name="GetPlanificationsForDate">
+        <xs:sequence>
+          <xs:element name="getPlanificationsForDate" type="tns:getPlanificationsForDate" minOccurs="0"/>
+        </xs:sequence>
+      </xs:complexType>
+      <xs:complexType name="getPlanificationsForDate">
+        <xs:sequence>
+          <xs:element name="fromDate" type="xs:string" minOccurs="0"/>
+          <xs:element name="tokenString" type="xs:string" minOccurs="0"/>
+        </xs:sequence>
+      </xs:complexType>
+      <xs:complexType name="GetPlanificationsForDateResponse">
+        <xs:sequence>
+          <xs:element name="return" type="tns:planificationsResponse" minOccurs="0"/>
+        </xs:sequence>
+      </xs:complexType>
+      <xs:complexType name="planificationsResponse">
+        <xs:sequence>
+          <xs:element name="responseStatus" type="xs:int"/>
+          <xs:element name="planifications" minOccurs="0">
+            <xs:complexType>
+              <xs:sequence>
+                <xs:element name="planification" type="tns:planification" minOccurs="0" maxOccurs="unbounded"/>
+              </xs:sequence>
+            </xs:complexType>
+          </xs:element>
+        </xs:sequence>
+      </xs:complexType>
+      <xs:complexType name="planification">
+        <xs:sequence>
+          <xs:element name="munid" type="xs:long" minOccurs="0"/>
+          <xs:element name="coteRueId" type="xs:long" minOccurs="0"/>
+          <xs:element name="etatDeneig" type="xs:int" minOccurs="0"/>
+          <xs:element name="dateDebutPlanif" type="xs:dateTime" minOccurs="0" nillable="true"/>
+          <xs:element name="dateFinPlanif" type="xs:dateTime" minOccurs="0" nillable="true"/>
+          <xs:element name="dateDebutReplanif" type="xs:dateTime" minOccurs="0" nillable="true"/>
+          <xs:element name="dateFinReplanif" type="xs:dateTime" minOccurs="0" nillable="true"/>
+          <xs:element name="dateMaj" type="xs:dateTime" minOccurs="0" nillable="true"/>
+        </xs:sequence>
+      </xs:complexType>
+    </xs:schema>
+  </types>
+  <message name="GetPlanificationsForDate">
+    <part name="parameters" element="tns:GetPlanificationsForDate"/>
+  </message>
+  <message name="GetPlanificationsForDateResponse">
+    <part name="parameters" element="tns:GetPlanificationsForDateResponse"/>
+  </message>
+  <portType name="InfoneigeWebService">
+    <operation name="GetPlanificationsForDate">
+      <input message="tns:GetPlanificationsForDate"/>
+      <output message="tns:GetPlanificationsForDateResponse"/>
+    </operation>
+  </portType>
+  <binding name="InfoneigeWebServicePortBinding" type="tns:InfoneigeWebService">
+    <soap:binding transport="http://schemas.xmlsoap.org/soap/http" style="document"/>
+    <operation name="GetPlanificationsForDate">
+      <soap:operation soapAction=""/>
+      <input><soap:body use="literal"/></input>
+      <output><soap:body use="literal"/></output>
+    </operation>
+  </binding>
+  <service name="InfoneigeWebService">
+    <port name="InfoneigeWebServicePort" binding="tns:InfoneigeWebServicePortBinding">
+      <soap:address location="https://servicesenligne2.ville.montreal.qc.ca/api/infoneige/InfoneigeWebService"/>
+    </port>
+  </service>
+</definitions>
+""".format(ns=planif_raw.SERVICE_NAMESPACE)
+
+NIL = ' xsi:nil="true" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"/>'
+
+PLANIFICATIONS = [
+    # Dates without offset, with fractions, with offsets, nil and missing fields
+    "<munid>1</munid><coteRueId>10000001</coteRueId><etatDeneig>2</etatDeneig>"
+    "<dateDebutPlanif>2025-12-20T07:00:00</dateDebutPlanif><dateFinPlanif>2025-12-21T07:00:00</dateFinPlanif>"
+    "<dateDebutReplanif" + NIL + "<dateFinReplanif" + NIL +
+    "<dateMaj>2025-12-20T06:01:02.345-05:00</dateMaj>",
+    "<munid>18</munid><coteRueId>13000000</coteRueId><etatDeneig>10</etatDeneig>"
+    "<dateDebutPlanif" + NIL + "<dateFinPlanif" + NIL +
+    "<dateDebutReplanif>2025-12-22T19:00:00.5</dateDebutReplanif><dateFinReplanif>2025-12-23T07:00:00Z</dateFinReplanif>"
+    "<dateMaj>2025-12-21T23:59:59</dateMaj>",
+    "<munid>3</munid><coteRueId>10000003</coteRueId><etatDeneig>0</etatDeneig><dateMaj>2025-12-20T06:00:00+00:00</dateMaj>",
+]
+
+
+def build_reply(planifications, status: int = 0) -> bytes:
+    """Reply shaped like the API's"""
+    body = "".join(f"<planification>{fields}</planification>" for fields in planifications)
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">'
+        f'<soap:Body><ns2:GetPlanificationsForDateResponse xmlns:ns2="{planif_raw.SERVICE_NAMESPACE}">'
+        f"<return><responseStatus>{status}</responseStatus><planifications>{body}</planifications></return>"
+        "</ns2:GetPlanificationsForDateResponse></soap:Body></soap:Envelope>"
+    ).encode("utf-8")
+
+
+def convert_datetime_to_string(obj):
+    """Same conversion as fetch_planifications_batch.convert_datetime_to_string"""
+    if isinstance(obj, datetime):
+        return obj.replace(microsecond=0).isoformat()
+    elif isinstance(obj, dict):
+        return {key: convert_datetime_to_string(value) for key, value in obj.items()}
+    elif isinstance(obj, list):
+        return [convert_datetime_to_string(item) for item in obj]
+    return obj
+
+
+@pytest.fixture(scope="module")
+def zeep_operation(tmp_path_factory):
+    path = tmp_path_factory.mktemp("wsdl") / "InfoneigeWebService.wsdl"
+    path.write_text(WSDL, encoding="utf-8")
+    client = zeep.Client(wsdl=str(path))
+    return client.service._binding.get("GetPlanificationsForDate")
+
+
+def parse_zeep(operation, reply: bytes):
+    """Records as PlanifNeigeClient.get_planification_for_date builds them with zeep"""
+    response = operation.process_reply(etree.fromstring(reply))
+    result = zeep.helpers.serialize_object(response)
+    planification_list = result.get('planifications', {}).get('planification', [])
+    if isinstance(planification_list, dict):
+        planification_list = [planification_list]
+    return convert_datetime_to_string(planification_list)
+
+
+def test_records_match_zeep(zeep_operation):
+    reply = build_reply(PLANIFICATIONS)
+    raw_records = list(planif_raw.iter_planifications(io.BytesIO(reply)))
+    assert len(raw_records) == len(PLANIFICATIONS)
+    zeep_records = parse_zeep(zeep_operation, reply)
+    # zeep fills the fields missing from the reply with None; the raw parser leaves them out
+    for raw, expected in zip(raw_records, zeep_records):
+        assert raw == {field: value for field, value in expected.items() if field in raw}
+        assert all(expected[field] is None for field in expected if field not in raw)
+
+
+def test_empty_reply():
+    assert list(planif_raw.iter_planifications(io.BytesIO(build_reply([])))) == []
+
+
+def test_error_status():
+    with pytest.raises(Exception, match="status code: 14"):
+        list(planif_raw.iter_planifications(io.BytesIO(build_reply([], status=14))))
+
+
+def test_soap_fault():
+    reply = (
+        b'<?xml version="1.0" encoding="UTF-8"?>'
+        b'<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"><soap:Body><soap:Fault>'
+        b"<faultcode>soap:Server</faultcode><faultstring>Invalid token</faultstring>"
+        b"</soap:Fault></soap:Body></soap:Envelope>"
+    )
+    with pytest.raises(Exception, match="Invalid token"):
+        list(planif_raw.iter_planifications(io.BytesIO(reply)))
+
+
+def test_envelope_escapes_values():
+    envelope = planif_raw.build_envelope("2025-12-20T07:00:00", "a<b&c")
+    tree = etree.fromstring(envelope)
+    assert tree.findtext(".//tokenString") == "a<b&c"
+    assert tree.findtext(".//fromDate") == "2025-12-20T07:00:00"
+    assert planif_raw.endpoint_url("https://example.test/ws?WSDL") == "https://example.test/ws"
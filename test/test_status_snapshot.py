@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""Checks of the status snapshot binary encoding and patches (status_snapshot.py), without a database"""
+import os
+import sys
+import gzip
+import json
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pytest
+import status_snapshot
+
+
+def make_columns(rows):
+    """Columns as fetch_status() returns them, from (cote_rue_id, etat_deneig, dates...) rows"""
+    columns = {column: [] for column in status_snapshot.COLUMNS}
+    for row in sorted(rows):
+        for column, value in zip(status_snapshot.COLUMNS, row):
+            columns[column].append(value)
+    return columns
+
+
+ROWS = [
+    (10000001, 0, 1766232000, 1766318400, None, None, 1766228400),
+    (10000002, 2, 1766232000, 1766318400, 1766404800, 1766491200, 1766228460),
+    (10000010, None, None, None, None, None, 1766228520),
+    (13000000, 10, None, None, None, None, 1766228580),
+]
+
+
+def test_binary_round_trip():
+    columns = make_columns(ROWS)
+    version, decoded = status_snapshot.decode_binary(status_snapshot.encode_binary(columns, 1766230000))
+    assert version == 1766230000
+    assert decoded == columns
+
+
+def test_binary_empty():
+    columns = make_columns([])
+    assert status_snapshot.decode_binary(status_snapshot.encode_binary(columns, 1)) == (1, columns)
+
+
+def test_binary_rejects_other_data():
+    with pytest.raises(ValueError):
+        status_snapshot.decode_binary(b"XXXX" + bytes(status_snapshot.HEADER.size))
+
+
+def test_json_matches_binary():
+    columns = make_columns(ROWS)
+    document = json.loads(gzip.decompress(status_snapshot.encode_json(columns, 7)))
+    assert document == {"version": 7, "count": len(ROWS), "columns": columns}
+
+
+def test_content_hash_ignores_version_only():
+    columns = make_columns(ROWS)
+    assert status_snapshot.content_hash(columns) == status_snapshot.content_hash(make_columns(ROWS))
+    changed = make_columns([ROWS[0][:1] + (1,) + ROWS[0][2:]] + ROWS[1:])
+    assert status_snapshot.content_hash(columns) != status_snapshot.content_hash(changed)
+
+
+def test_diff_snapshots():
+    old = make_columns(ROWS)
+    changed_row = (10000002, 1) + ROWS[1][2:6] + (1766300000,)
+    added_row = (12000000, 2, 1766232000, None, None, None, 1766300060)
+    new = make_columns([ROWS[0], changed_row, ROWS[3], added_row])
+
+    diff = status_snapshot.diff_snapshots(old, new)
+    assert diff == {
+        "changed": {
+            10000002: list(changed_row[1:]),
+            12000000: list(added_row[1:]),
+        },
+        "removed": [10000010],
+    }
+
+    # Applying the patch to the old rows gives the new ones
+    rows = status_snapshot.to_rows(old)
+    for cote_rue_id in diff["removed"]:
+        del rows[cote_rue_id]
+    rows.update({cote_rue_id: tuple(row) for cote_rue_id, row in diff["changed"].items()})
+    assert rows == status_snapshot.to_rows(new)
+
+
+def test_diff_identical():
+    columns = make_columns(ROWS)
+    assert status_snapshot.diff_snapshots(columns, make_columns(ROWS)) == {"changed": {}, "removed": []}
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""Checks of the in-memory street index (street_index.py) against brute force over the same lines"""
+import os
+import sys
+import math
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pytest
+from shapely.geometry import LineString, Point, box
+import street_index
+
+CENTER_LNG, CENTER_LAT = -73.6, 45.5
+
+
+def make_lines(count: int, seed: int = 0):
+    """Short random polylines around Montreal, like street sides"""
+    rng = random.Random(seed)
+    lines = []
+    for i in range(count):
+        lng = CENTER_LNG + rng.uniform(-0.1, 0.1)
+        lat = CENTER_LAT + rng.uniform(-0.1, 0.1)
+        coordinates = [[lng, lat]]
+        for _ in range(rng.randint(1, 5)):
+            lng += rng.uniform(-0.002, 0.002)
+            lat += rng.uniform(-0.002, 0.002)
+            coordinates.append([lng, lat])
+        lines.append((10000000 + i, coordinates))
+    return lines
+
+
+@pytest.fixture(scope="module")
+def lines():
+    return make_lines(3000)
+
+
+@pytest.fixture(scope="module")
+def index(lines):
+    return street_index.StreetIndex.build(lines)
+
+
+def projected_distance(coordinates, lng: float, lat: float) -> float:
+    """Distance in meters on the same local equirectangular projection as StreetIndex.nearest"""
+    kx = math.cos(math.radians(lat)) * street_index.METERS_PER_DEGREE
+    ky = street_index.METERS_PER_DEGREE
+    line = LineString([((x - lng) * kx, (y - lat) * ky) for x, y in coordinates])
+    return line.distance(Point(0, 0))
+
+
+def test_query_matches_brute_force(index, lines):
+    rng = random.Random(1)
+    for _ in range(200):
+        lng = CENTER_LNG + rng.uniform(-0.12, 0.1)
+        lat = CENTER_LAT + rng.uniform(-0.12, 0.1)
+        size = rng.choice((0.001, 0.005, 0.02))
+        view = box(lng, lat, lng + size, lat + size)
+        expected = {cote_rue_id for cote_rue_id, coordinates in lines if LineString(coordinates).intersects(view)}
+        assert set(index.query(lng, lat, lng + size, lat + size)) == expected
+
+
+def test_query_bounding_boxes_only(index, lines):
+    min_lng, min_lat, max_lng, max_lat = CENTER_LNG, CENTER_LAT, CENTER_LNG + 0.01, CENTER_LAT + 0.01
+    view = box(min_lng, min_lat, max_lng, max_lat)
+    expected = {cote_rue_id for cote_rue_id, coordinates in lines if box(*LineString(coordinates).bounds).intersects(view)}
+    candidates = set(index.query(min_lng, min_lat, max_lng, max_lat, exact=False))
+    assert candidates == expected
+    assert set(index.query(min_lng, min_lat, max_lng, max_lat)) <= candidates
+
+
+def test_nearest_matches_brute_force(index, lines):
+    rng = random.Random(2)
+    for _ in range(50):
+        lng = CENTER_LNG + rng.uniform(-0.1, 0.1)
+        lat = CENTER_LAT + rng.uniform(-0.1, 0.1)
+        distances = sorted((projected_distance(coordinates, lng, lat), cote_rue_id) for cote_rue_id, coordinates in lines)
+        results = index.nearest(lng, lat, k=5)
+        assert len(results) == 5
+        for (cote_rue_id, distance), (expected_distance, _) in zip(results, distances):
+            assert distance == pytest.approx(expected_distance, abs=1e-6)
+        assert results[0][0] in {cote_rue_id for distance, cote_rue_id in distances if distance <= distances[0][0] + 1e-6}
+
+
+def test_nearest_max_distance(index, lines):
+    lng, lat = CENTER_LNG, CENTER_LAT
+    expected = sorted(
+        cote_rue_id for cote_rue_id, coordinates in lines if projected_distance(coordinates, lng, lat) <= 300
+    )
+    results = index.nearest(lng, lat, k=len(lines), max_distance=300)
+    assert sorted(cote_rue_id for cote_rue_id, _ in results) == expected
+    assert [distance for _, distance in results] == sorted(distance for _, distance in results)
+
+
+def test_lookup_and_extent(index, lines):
+    assert len(index) == len(lines)
+    cote_rue_id, coordinates = lines[42]
+    assert cote_rue_id in index
+    assert index.coordinates(cote_rue_id) == coordinates
+    assert index.bounds(cote_rue_id) == LineString(coordinates).bounds
+    with pytest.raises(KeyError):
+        index.bounds(1)
+    all_bounds = [LineString(coordinates).bounds for _, coordinates in lines]
+    assert index.extent() == (
+        min(b[0] for b in all_bounds), min(b[1] for b in all_bounds),
+        max(b[2] for b in all_bounds), max(b[3] for b in all_bounds),
+    )
+
+
+def test_save_and_load(index, tmp_path):
+    path = str(tmp_path / street_index.INDEX_FILENAME)
+    index.save(path, source_size=1234)
+    loaded = street_index.StreetIndex.load(path, source_size=1234)
+    assert len(loaded) == len(index)
+    assert loaded.query(CENTER_LNG, CENTER_LAT, CENTER_LNG + 0.02, CENTER_LAT + 0.02) == \
+        index.query(CENTER_LNG, CENTER_LAT, CENTER_LNG + 0.02, CENTER_LAT + 0.02)
+    assert loaded.nearest(CENTER_LNG, CENTER_LAT, k=3) == index.nearest(CENTER_LNG, CENTER_LAT, k=3)
+    with pytest.raises(ValueError):
+        street_index.StreetIndex.load(path, source_size=999)
+
+
+def test_short_and_empty_lines():
+    index = street_index.StreetIndex.build([(1, [[0.0, 0.0]]), (2, []), (3, [[0.0, 0.0], [1.0, 1.0]])])
+    assert len(index) == 1
+    assert index.query(-1, -1, 2, 2) == [3]
+    empty = street_index.StreetIndex.build([])
+    assert empty.query(-1, -1, 2, 2) == []
+    assert empty.nearest(0, 0) == []
+    assert empty.extent() is None